@@ -0,0 +1,242 @@
+"""
+Asyncio query engine for latency bound MongoDB lookups
+
+Stages made of many small queries (latest user object of each user, tweets of each user, ...) are bound by
+round-trip latency, not by the server. Instead of a process per core each waiting on one query at a time,
+one process keeps a bounded number of queries in flight on an asyncio client (see mongodb.get_async_client),
+with retries of transient errors, and streams the results in input order or as they complete:
+    for user_id, docs_lst in async_queries.find_grouped(DB_NAME, TW_NT_COL, 'user.id', user_ids_lst,
+                                                        projection={'_id': 0, 'user.id': 1, 'text': 1}):
+        ...
+stream() runs the event loop in a background thread, so results are consumed by plain (synchronous) code,
+e.g. a worker writing into a sink; see multiprocessing_workers.worker_get_unique_user with async_concurrency.
+"""
+
+import asyncio
+import collections
+import inspect
+import queue
+import threading
+
+import pymongo
+from pymongo import errors
+
+import mongodb
+import queries
+
+
+# errors worth retrying: lost connections, elections, network and server selection timeouts
+RETRYABLE_ERRORS = (errors.AutoReconnect,)
+
+
+async def resolve(value):
+    """
+    Await value if it is awaitable (e.g. aggregate() and close() are coroutines with pymongo's asyncio client
+    but not with motor)
+    """
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+async def find_one(collection, filter, projection=None, sort=None):
+    """
+    :return: the first matched document, None if none
+    """
+    return await collection.find_one(filter, projection=projection, sort=sort)
+
+
+async def find_list(collection, filter, projection=None, sort=None, limit=0):
+    """
+    :return: a list of the matched documents
+    """
+    cursor = collection.find(filter, projection=projection, sort=sort, limit=limit)
+    if mongodb.CURSOR_BATCH_SIZE:
+        cursor = cursor.batch_size(mongodb.CURSOR_BATCH_SIZE)
+    return await cursor.to_list(None)
+
+
+async def aggregate_list(collection, pipeline, **kwargs):
+    """
+    :return: a list of the documents output by an aggregation
+    """
+    cursor = await resolve(collection.aggregate(pipeline, **kwargs))
+    return await cursor.to_list(None)
+
+
+class AsyncQueryEngine(object):
+    """
+    Run queries concurrently on one asyncio client, at most concurrency at a time
+    """
+
+    def __init__(self, db_name, concurrency=32, retries=3, retry_delay=0.2, host='localhost', port=27017,
+                 **client_options):
+        """
+        :param db_name: the name of the MongoDB database
+        :param concurrency: max number of queries in flight
+        :param retries: max number of retries of a query failing with a transient error (RETRYABLE_ERRORS)
+        :param retry_delay: delay before the first retry in seconds, doubled for each next retry
+        :param host: MongoDB host
+        :param port: MongoDB port
+        :param client_options: extra client options, e.g. maxPoolSize (at least concurrency is sensible)
+        """
+        self.db_name = db_name
+        self.concurrency = concurrency
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.host = host
+        self.port = port
+        self.client_options = client_options
+        self.client = None
+        self.db = None
+        self.retries_n = 0
+
+    async def __aenter__(self):
+        self.client = mongodb.get_async_client(self.host, self.port, **self.client_options)
+        self.db = self.client[self.db_name]
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await resolve(self.client.close())
+        self.client = None
+        self.db = None
+
+    async def call(self, query_fn, item):
+        """
+        Run one query, retrying transient errors with exponential backoff
+
+        :param query_fn: coroutine function taking (db obj, item)
+        :param item: the item to query for
+        :return: the result of query_fn
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return await query_fn(self.db, item)
+            except RETRYABLE_ERRORS:
+                if attempt == self.retries:
+                    raise
+                self.retries_n += 1
+                await asyncio.sleep(self.retry_delay * 2 ** attempt)
+
+    async def map(self, query_fn, items, ordered=True):
+        """
+        Run query_fn for each item, with at most concurrency queries in flight. Items are taken lazily,
+        so items can be a generator over more items than fit in memory.
+
+        :param query_fn: coroutine function taking (db obj, item)
+        :param items: iterable of items
+        :param ordered: bool value indicates whether to yield results in the order of items (a slow query then
+                        holds back the results after it), otherwise as they complete
+        :return: async generator of (item, result) tuples
+        """
+        items_iter = iter(items)
+        pending = collections.deque() if ordered else set()
+        try:
+            while True:
+                while len(pending) < self.concurrency:
+                    item = next(items_iter, StopIteration)
+                    if item is StopIteration:
+                        break
+                    task = asyncio.ensure_future(self.call(query_fn, item))
+                    task.item = item
+                    if ordered:
+                        pending.append(task)
+                    else:
+                        pending.add(task)
+                if not pending:
+                    return
+                if ordered:
+                    task = pending.popleft()
+                    yield task.item, await task
+                else:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield task.item, task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+def stream(db_name, query_fn, items, ordered=True, concurrency=32, retries=3, retry_delay=0.2,
+           host='localhost', port=27017, **client_options):
+    """
+    Run query_fn for each item on an AsyncQueryEngine in a background thread, and yield the results here.
+    At most about 2 * concurrency results are buffered, so a slow consumer slows the queries down.
+
+    :param query_fn: coroutine function taking (db obj, item), e.g. lambda db, uid: find_one(db[TW_NT_COL], ...)
+    :param items: iterable of items
+    :param ordered: see AsyncQueryEngine.map
+    :return: generator of (item, result) tuples
+    """
+    results_queue = queue.Queue(maxsize=concurrency)
+    stop_event = threading.Event()
+    end = object()
+
+    def put(result):
+        while not stop_event.is_set():
+            try:
+                results_queue.put(result, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    async def produce():
+        engine = AsyncQueryEngine(db_name, concurrency=concurrency, retries=retries, retry_delay=retry_delay,
+                                  host=host, port=port, **client_options)
+        async with engine:
+            results = engine.map(query_fn, items, ordered=ordered)
+            try:
+                async for result in results:
+                    # blocking put in the loop thread: the in-flight queries keep running in the meantime
+                    if not await asyncio.get_running_loop().run_in_executor(None, put, result):
+                        return
+            finally:
+                await results.aclose()
+
+    def run():
+        try:
+            asyncio.run(produce())
+            put(end)
+        except BaseException as e:
+            put(e)
+
+    thread = threading.Thread(target=run, name='async-queries', daemon=True)
+    thread.start()
+    try:
+        while True:
+            result = results_queue.get()
+            if result is end:
+                return
+            if isinstance(result, BaseException):
+                raise result
+            yield result
+    finally:
+        stop_event.set()
+        thread.join()
+
+
+def find_grouped(db_name, collection_name, key, ids, filter=None, projection=None, chunk_size=1000, ordered=True,
+                 concurrency=32, **stream_options):
+    """
+    Concurrent version of queries.find_grouped: the '$in' batches of ids are queried concurrently
+    (smaller batches than in queries.find_grouped are fine, since their latencies overlap)
+
+    :param db_name: the name of the MongoDB database
+    :param collection_name: the name of the collection
+    :param key: the (indexed) field the ids are on, e.g. 'user.id'
+    :param ids: iterable of ids
+    :param filter: extra filter dict
+    :param projection: projection dict, has to include key
+    :param chunk_size: maximum number of ids per '$in' query
+    :param ordered: bool value indicates whether to yield groups in ascending order of ids
+    :return: generator of (id, a list of documents) tuples
+    """
+    async def query_chunk(db, ids_lst):
+        return await find_list(db[collection_name], queries.gen_in_filter(key, ids_lst, filter),
+                               projection=projection, sort=[(key, pymongo.ASCENDING)])
+
+    for _, docs_lst in stream(db_name, query_chunk, queries.chunk_ids(ids, chunk_size), ordered=ordered,
+                              concurrency=concurrency, **stream_options):
+        for group in queries.iter_groups(docs_lst, key):
+            yield group
@@ -0,0 +1,354 @@
+"""
+Benchmark suite of the workers and helpers, on a synthetic corpus (see synthetic_corpus.py)
+
+The corpus is loaded into a throwaway local mongod (if a 'mongod' binary is found) or into an in-process stand-in
+(mongomock, which needs the 'fork' start method so that worker processes inherit the data).
+Each worker stage runs with multiprocessing.Process as in the notebooks, and reports docs/sec, peak RSS and the skew
+of process running times; pure helpers are timed on the same corpus. Results are saved as JSON into BENCHMARK_DIR,
+and compare_results() flags regressions between two runs.
+
+Usage: python benchmarks.py [--tweets-n 20000] [--process-n 4] [--backend auto] [--compare baseline.json]
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pymongo
+
+import ingest
+import keywords_matcher
+import mongodb
+import multiprocessing_workers
+import synthetic_corpus
+import utilities
+from config import * # import all global config variables
+
+
+BENCHMARK_DB_NAME = 'benchmark'
+
+
+@contextlib.contextmanager
+def ephemeral_mongod(mongod_bin='mongod', startup_timeout=30):
+    """
+    Run a throwaway mongod on a free local port with a temporary dbpath, and point all clients to it
+
+    :param mongod_bin: the mongod binary
+    :param startup_timeout: seconds to wait for the server to accept connections
+    """
+    dbpath = tempfile.mkdtemp(prefix='benchmark-mongod-')
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    proc = subprocess.Popen([mongod_bin, '--dbpath', dbpath, '--port', str(port), '--bind_ip', '127.0.0.1', '--quiet'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        client = pymongo.MongoClient('127.0.0.1', port, serverSelectionTimeoutMS=startup_timeout * 1000)
+        client.admin.command('ping')
+        client.close()
+        mongodb.set_client_factory(lambda host, port_, **options: pymongo.MongoClient('127.0.0.1', port, **options))
+        yield 'mongod'
+    finally:
+        mongodb.set_client_factory(None)
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(dbpath, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def in_process_stand_in():
+    """
+    Point all clients to one in-process mongomock client (optional dependency)
+    """
+    import mongomock
+    if multiprocessing.get_start_method() != 'fork':
+        raise RuntimeError('The in-process stand-in needs the "fork" start method')
+    client = mongomock.MongoClient()
+    mongodb.set_client_factory(lambda host, port, **options: client)
+    try:
+        yield 'mongomock'
+    finally:
+        mongodb.set_client_factory(None)
+
+
+def open_backend(backend='auto'):
+    """
+    :param backend: 'mongod', 'mongomock', or 'auto' to use mongod when its binary is found
+    :return: context manager yielding the name of the backend
+    """
+    if backend == 'auto':
+        backend = 'mongod' if shutil.which('mongod') else 'mongomock'
+    if backend == 'mongod':
+        return ephemeral_mongod()
+    return in_process_stand_in()
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process, in MB
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_timed_target(target, args, batch_i, result_queue):
+    """
+    Run a worker function in a process and report its running time and peak RSS
+    """
+    start = time.perf_counter()
+    target(*args)
+    result_queue.put({'batch_i': batch_i, 'seconds': time.perf_counter() - start, 'peak_rss_mb': peak_rss_mb()})
+
+
+def count_lines(files_lst):
+    lines_n = 0
+    for file in files_lst:
+        if os.path.exists(file):
+            with open(file, 'rb') as f:
+                lines_n += sum(1 for _ in f)
+    return lines_n
+
+
+def run_stage(stage_name, target, gen_args, process_n, input_docs_n, output_dir):
+    """
+    Run a worker function in process_n processes, as the notebooks do, and measure it
+
+    :param stage_name: the name of the stage
+    :param target: the worker function
+    :param gen_args: function taking (batch_i, output_file) and returning the args of the worker
+    :param process_n: number of processes
+    :param input_docs_n: number of documents the stage works on, for docs/sec
+    :param output_dir: directory of the intermediate output files
+    :return: dict of measurements
+    """
+    output_files = [os.path.join(output_dir, '{}-{}.json'.format(stage_name, batch_i)) for batch_i in range(process_n)]
+    result_queue = multiprocessing.Queue()
+    jobs = [multiprocessing.Process(target=run_timed_target,
+                                    args=(target, gen_args(batch_i, output_files[batch_i]), batch_i, result_queue),
+                                    name='Process-{}/{}'.format(batch_i, process_n))
+            for batch_i in range(process_n)]
+
+    start = time.perf_counter()
+    for job in jobs:
+        job.start()
+    process_results = sorted([result_queue.get() for _ in jobs], key=lambda res: res['batch_i'])
+    for job in jobs:
+        job.join()
+    seconds = time.perf_counter() - start
+
+    process_seconds = [res['seconds'] for res in process_results]
+    return {'seconds': seconds,
+            'input_docs_n': input_docs_n,
+            'output_docs_n': count_lines(output_files),
+            'docs_per_sec': input_docs_n / max(seconds, 1e-9),
+            'peak_rss_mb': max(res['peak_rss_mb'] for res in process_results),
+            'process_seconds': process_seconds,
+            'skew': max(process_seconds) / max(np.mean(process_seconds), 1e-9)}
+
+
+def time_helper(fn, repeat=3):
+    """
+    :return: best running time of fn() in seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def bench_helpers(tweets_lst, users_lst, repeat=3):
+    """
+    Time the pure helpers on the corpus
+
+    :return: dict of {'seconds', 'items_n', 'items_per_sec'} per helper
+    """
+    created_at_strs = [tweet['created_at'] for tweet in tweets_lst]
+    texts = [tweet['text'] for tweet in tweets_lst]
+    user_lines = [json.dumps(user).encode('utf-8') for user in users_lst]
+    kws_lst = API_QUERY_KWS
+    matcher = keywords_matcher.KeywordsMatcher(kws_lst)
+    runs = [('parse_tweet_created_at_str', created_at_strs,
+             lambda: [utilities.parse_tweet_created_at_str(s) for s in created_at_strs]),
+            ('parse_tweet_created_at_str_fast', created_at_strs,
+             lambda: [utilities.parse_tweet_created_at_str_fast(s) for s in created_at_strs]),
+            ('parse_tweet_created_at_strs', created_at_strs,
+             lambda: utilities.parse_tweet_created_at_strs(created_at_strs)),
+            ('get_tweets_timestamps', tweets_lst,
+             lambda: utilities.get_tweets_timestamps(tweets_lst)),
+            ('simple_test_keyword_in_text', texts,
+             lambda: [utilities.simple_test_keyword_in_text(text, 'ibm') for text in texts]),
+            ('simple_test_keyword_in_text-all_kws', texts,
+             lambda: [[utilities.simple_test_keyword_in_text(text, kw) for kw in kws_lst] for text in texts]),
+            ('KeywordsMatcher.tag', texts,
+             lambda: [matcher.tag(text) for text in texts]),
+            ('json_loads-description', user_lines,
+             lambda: ['ibm' in (multiprocessing_workers.json_loads(line).get('description') or '').lower()
+                      for line in user_lines])]
+    res = {}
+    for name, items, run in runs:
+        seconds = time_helper(run, repeat)
+        res[name] = {'seconds': seconds, 'items_n': len(items), 'items_per_sec': len(items) / max(seconds, 1e-9)}
+        print('{}: {:.0f} items/s'.format(name, res[name]['items_per_sec']))
+    return res
+
+
+def gen_ranges_queue(collection, ranges_n, process_n, field='_id'):
+    """
+    Queue of ranges by sampling, which works on the stand-in too (no '$bucketAuto')
+    """
+    id_ranges = mongodb.gen_id_ranges(collection, ranges_n, sample_size=max(ranges_n * 20, 1000), field=field)
+    return utilities.gen_id_ranges_queue(id_ranges, process_n)
+
+
+def bench_stages(users_lst, tweets_lst, process_n, work_dir, ranges_per_process=8):
+    """
+    Load the corpus with ingest.ingest_raw_files and time each worker stage on it
+
+    :return: dict of measurements per stage (see run_stage)
+    """
+    raw_file = os.path.join(work_dir, 'raw.json')
+    synthetic_corpus.write_raw_dump(tweets_lst, raw_file, server_messages_n=len(tweets_lst) // 100)
+    start = time.perf_counter()
+    stats = ingest.ingest_raw_files([raw_file], db_name=BENCHMARK_DB_NAME)
+    seconds = time.perf_counter() - start
+    res = {'ingest': {'seconds': seconds, 'input_docs_n': len(tweets_lst), 'output_docs_n': stats[TW_RAW_COL],
+                      'docs_per_sec': len(tweets_lst) / max(seconds, 1e-9), 'peak_rss_mb': peak_rss_mb(),
+                      'process_seconds': [seconds], 'skew': 1.0}}
+
+    db = mongodb.initialize_db(BENCHMARK_DB_NAME)
+    ranges_n = process_n * ranges_per_process
+    counts = {col_name: db[col_name].count_documents({}) for col_name in [TW_RAW_COL, TW_NT_COL, TW_RT_COL, TW_NT_QT_COL]}
+    ibm_user_ids_lst = [user['id'] for user in users_lst if 'IBM' in user['description']]
+    hydrated_uids_lst = ibm_user_ids_lst[:200]
+    followers_dir = os.path.join(work_dir, 'follower_objs')
+    followers_n = synthetic_corpus.write_follower_files(users_lst, followers_dir, hydrated_uids_lst)
+
+    stages = [('parse_created_at', multiprocessing_workers.worker_parse_created_at, TW_RAW_COL, '_id', (), counts[TW_RAW_COL]),
+              ('tag_kws_in_tw', multiprocessing_workers.worker_tag_kws_in_tw, TW_RAW_COL, '_id', (API_QUERY_KWS,), counts[TW_RAW_COL]),
+              ('filter_rt_ibm_tweets', multiprocessing_workers.worker_filter_rt_ibm_tweets, TW_RT_COL, '_id', (ibm_user_ids_lst,), counts[TW_RT_COL]),
+              ('get_unique_user', multiprocessing_workers.worker_get_unique_user, TW_NT_COL, 'user.id', (), counts[TW_NT_COL]),
+              ('qt_sentiment', multiprocessing_workers.worker_qt_sentiment, TW_NT_QT_COL, '_id', (), counts[TW_NT_QT_COL])]
+    for stage_name, target, col_name, field, extra_args, input_docs_n in stages:
+        print('Benchmarking {}...'.format(stage_name))
+        ranges_queue = gen_ranges_queue(db[col_name], ranges_n, process_n, field=field)
+        if stage_name == 'get_unique_user':
+            gen_args = lambda batch_i, output_file: (BENCHMARK_DB_NAME, col_name, batch_i, process_n, output_file,
+                                                     None, 1000, ranges_queue)
+        else:
+            gen_args = lambda batch_i, output_file: ((BENCHMARK_DB_NAME, col_name, batch_i, process_n, output_file)
+                                                     + extra_args + (ranges_queue,))
+        res[stage_name] = run_stage(stage_name, target, gen_args, process_n, input_docs_n, work_dir)
+
+    print('Benchmarking count_ibm_followers_ibm_users...')
+    files_queue = utilities.gen_files_queue_by_size(followers_dir, hydrated_uids_lst, process_n)
+    res['count_ibm_followers_ibm_users'] = run_stage(
+        'count_ibm_followers_ibm_users', multiprocessing_workers.worker_count_ibm_followers_ibm_users,
+        lambda batch_i, output_file: (followers_dir, batch_i, process_n, output_file, hydrated_uids_lst, files_queue),
+        process_n, followers_n, work_dir)
+    return res
+
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(users_n=2000, tweets_n=20000, process_n=4, backend='auto', seed=0, label='benchmark',
+                   results_dir=BENCHMARK_DIR, helpers_only=False):
+    """
+    Generate the corpus, run all benchmarks and save the results
+
+    :param users_n: number of synthetic users
+    :param tweets_n: number of synthetic tweets
+    :param process_n: number of processes of each worker stage
+    :param backend: see open_backend
+    :param seed: random seed of the corpus
+    :param label: label in the name of the results file
+    :param results_dir: directory of the results files
+    :param helpers_only: bool value indicates whether to skip the worker stages (no database needed)
+    :return: (results dict, path of the results file)
+    """
+    print('Generating {} tweets of {} users...'.format(tweets_n, users_n))
+    users_lst, tweets_lst = synthetic_corpus.gen_corpus(users_n=users_n, tweets_n=tweets_n, seed=seed)
+    results = {'meta': {'label': label, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'git_commit': get_git_commit(),
+                        'python': sys.version.split()[0], 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+                        'users_n': users_n, 'tweets_n': tweets_n, 'process_n': process_n, 'seed': seed},
+               'helpers': bench_helpers(tweets_lst, users_lst)}
+    if not helpers_only:
+        work_dir = tempfile.mkdtemp(prefix='benchmark-')
+        try:
+            with open_backend(backend) as backend_name:
+                results['meta']['backend'] = backend_name
+                results['stages'] = bench_stages(users_lst, tweets_lst, process_n, work_dir)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if not os.path.exists(results_dir):
+        os.makedirs(results_dir)
+    results_file = os.path.join(results_dir, '{}-{}.json'.format(label, time.strftime('%Y%m%d-%H%M%S')))
+    with open(results_file, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Results written to {}'.format(results_file))
+    return results, results_file
+
+
+def compare_results(baseline_file, results_file, tolerance=0.1):
+    """
+    Compare throughput of two benchmark runs and list the regressions
+
+    :param baseline_file: results file of the reference run
+    :param results_file: results file of the new run
+    :param tolerance: relative slowdown tolerated before flagging a regression
+    :return: a list of (name, baseline throughput, new throughput) of regressions
+    """
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    with open(results_file) as f:
+        results = json.load(f)
+
+    regressions = []
+    for section, metric in [('helpers', 'items_per_sec'), ('stages', 'docs_per_sec')]:
+        for name, res in sorted(results.get(section, {}).items()):
+            base_res = baseline.get(section, {}).get(name)
+            if base_res is None:
+                continue
+            ratio = res[metric] / max(base_res[metric], 1e-9)
+            flag = 'REGRESSION' if ratio < 1 - tolerance else ''
+            print('{:<40} {:>14.0f} -> {:>14.0f} {:>6.2f}x {}'.format(name, base_res[metric], res[metric], ratio, flag))
+            if flag:
+                regressions.append((name, base_res[metric], res[metric]))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark workers and helpers on a synthetic corpus')
+    parser.add_argument('--users-n', type=int, default=2000)
+    parser.add_argument('--tweets-n', type=int, default=20000)
+    parser.add_argument('--process-n', type=int, default=4)
+    parser.add_argument('--backend', choices=['auto', 'mongod', 'mongomock'], default='auto')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--label', default='benchmark')
+    parser.add_argument('--helpers-only', action='store_true')
+    parser.add_argument('--compare', help='results file of a baseline run to compare with')
+    args = parser.parse_args()
+
+    _, new_results_file = run_benchmarks(users_n=args.users_n, tweets_n=args.tweets_n, process_n=args.process_n,
+                                         backend=args.backend, seed=args.seed, label=args.label,
+                                         helpers_only=args.helpers_only)
+    if args.compare:
+        compare_results(args.compare, new_results_file)
@@ -0,0 +1,151 @@
+"""
+Incremental, resumable multiprocessing procedures via per-procedure '_id' watermarks
+
+Each run of a procedure (named as with utilities.gen_inter_filenames_list, e.g. 'tag_tw_raw_text') plans
+an epoch covering the documents added since the previous epoch, i.e. with '_id' above the previous watermark,
+split into '_id' ranges. Workers mark each range done once its output is committed to their sink.
+Re-running the procedure only hands out ranges not done yet plus ranges of new documents,
+so a crash only loses unfinished ranges and daily refreshes only process new data.
+Write the output with sinks.MongoBulkSink(upsert_key='id') to merge results into the existing derived collection,
+or into intermediate files, which sinks.open_sink turns into one file per range (see sinks.RangeFilesSink).
+"""
+
+import datetime
+import os
+
+import pymongo
+
+import mongodb
+import utilities
+from config import * # import all global config variables
+
+
+class Checkpointer(object):
+    """
+    Checkpoints of one procedure on one collection, stored in PROCEDURE_CHECKPOINTS_COL of the same database.
+
+    Checkpoint documents:
+        {'procedure', 'type': 'epoch', 'epoch_i', 'until_id', 'ranges_n', 'planned_at'}
+        {'procedure', 'type': 'range', 'epoch_i', 'range_i', 'lower', 'upper', 'upper_inclusive', 'done', ...}
+    A Checkpointer is created in the parent and passed to the workers; connections are opened lazily in each process.
+    """
+
+    def __init__(self, db_name, procedure_name, checkpoint_col_name=PROCEDURE_CHECKPOINTS_COL,
+                 host='localhost', port=27017):
+        """
+        :param db_name: the name of the MongoDB database
+        :param procedure_name: the name of the procedure
+        :param checkpoint_col_name: the name of the collection of checkpoints
+        :param host: MongoDB host
+        :param port: MongoDB port
+        """
+        self.db_name = db_name
+        self.procedure_name = procedure_name
+        self.checkpoint_col_name = checkpoint_col_name
+        self.host = host
+        self.port = port
+
+    def get_checkpoint_col(self):
+        checkpoint_col = mongodb.get_client(self.host, self.port)[self.db_name][self.checkpoint_col_name]
+        return checkpoint_col
+
+    def plan_pending_id_ranges(self, collection, ranges_n, sample_size=None):
+        """
+        Plan a new epoch for documents added since the last epoch (if any),
+        and get all ranges not done yet, from this and previous epochs
+
+        :param collection: the collection obj the procedure works on
+        :param ranges_n: number of ranges to split the new documents into
+        :param sample_size: see mongodb.gen_id_ranges
+        :return: a list of (range index, (lower, upper, upper_inclusive)) tuples
+        """
+        checkpoint_col = self.get_checkpoint_col()
+        checkpoint_col.create_index([('procedure', pymongo.ASCENDING), ('type', pymongo.ASCENDING),
+                                     ('range_i', pymongo.ASCENDING)])
+        procedure_filter = {'procedure': self.procedure_name}
+
+        epochs_lst = list(checkpoint_col.find(filter=dict(procedure_filter, type='epoch'),
+                                              sort=[('epoch_i', pymongo.ASCENDING)]))
+        epoch_i = len(epochs_lst)
+        # ranges of an epoch whose planning did not complete (crash before its epoch doc was written)
+        checkpoint_col.delete_many(dict(procedure_filter, type='range', epoch_i={'$gte': epoch_i}))
+
+        after_id = epochs_lst[-1]['until_id'] if epochs_lst else None
+        new_filter = {'_id': {'$gt': after_id}} if after_id is not None else {}
+        last_doc = collection.find_one(filter=new_filter, sort=[('_id', pymongo.DESCENDING)], projection={'_id': 1})
+        if last_doc is not None:
+            until_id = last_doc['_id']
+            epoch_filter = {'_id': dict(new_filter.get('_id', {}), **{'$lte': until_id})}
+            first_doc = collection.find_one(filter=epoch_filter, sort=[('_id', pymongo.ASCENDING)], projection={'_id': 1})
+
+            # bound the ranges of this epoch by its first and last '_id', the last one inclusive
+            id_ranges = mongodb.gen_id_ranges(collection, ranges_n, sample_size=sample_size, filter=epoch_filter)
+            id_ranges[0] = (first_doc['_id'], id_ranges[0][1])
+            id_ranges[-1] = (id_ranges[-1][0], until_id)
+
+            first_range_i = checkpoint_col.count_documents(dict(procedure_filter, type='range'))
+            range_docs_lst = [dict(procedure_filter, type='range', epoch_i=epoch_i, range_i=first_range_i + ind,
+                                   lower=lower, upper=upper, upper_inclusive=(ind == len(id_ranges) - 1), done=False)
+                              for ind, (lower, upper) in enumerate(id_ranges)]
+            checkpoint_col.insert_many(range_docs_lst)
+            checkpoint_col.insert_one(dict(procedure_filter, type='epoch', epoch_i=epoch_i, until_id=until_id,
+                                           ranges_n=len(id_ranges), planned_at=datetime.datetime.utcnow()))
+            print('Procedure {}: planned epoch {} of {} ranges up to _id {}'.format(self.procedure_name, epoch_i,
+                                                                                 len(id_ranges), until_id))
+
+        cursor = checkpoint_col.find(filter=dict(procedure_filter, type='range', done=False),
+                                     sort=[('range_i', pymongo.ASCENDING)])
+        pending_lst = [(doc['range_i'], (doc['lower'], doc['upper'], doc['upper_inclusive'])) for doc in cursor]
+        print('Procedure {}: {} pending ranges'.format(self.procedure_name, len(pending_lst)))
+        return pending_lst
+
+    def gen_pending_id_ranges_queue(self, collection, ranges_n, process_n, sample_size=None):
+        """
+        Plan pending ranges (see plan_pending_id_ranges) and put them into a queue shared by the workers
+
+        :return: multiprocessing.Queue obj, see utilities.gen_id_ranges_queue
+        """
+        pending_lst = self.plan_pending_id_ranges(collection, ranges_n, sample_size=sample_size)
+        return utilities.gen_id_ranges_queue([id_range for _, id_range in pending_lst], process_n,
+                                             range_inds=[range_i for range_i, _ in pending_lst])
+
+    def commit_range(self, range_i, sink=None):
+        """
+        Mark a range as done, after committing the sink its output was written into
+
+        :param range_i: the index of the range
+        :param sink: sink obj to commit first (see sinks.py)
+        """
+        if sink is not None:
+            sink.commit(range_i)
+        self.get_checkpoint_col().update_one(filter={'procedure': self.procedure_name, 'type': 'range', 'range_i': range_i},
+                                             update={'$set': {'done': True, 'done_at': datetime.datetime.utcnow()}})
+
+    def gen_range_filename(self, range_i, output_dir=TMP_DIR, suffix='json'):
+        """
+        :return: the name/path of the output file of a range, see sinks.RangeFilesSink
+        """
+        return os.path.join(output_dir, '{}-range{}.{}'.format(self.procedure_name, range_i, suffix))
+
+    def get_range_files(self, output_dir=TMP_DIR, suffix='json'):
+        """
+        :return: a list of output files of all ranges done so far, ordered by range index
+        """
+        cursor = self.get_checkpoint_col().find(filter={'procedure': self.procedure_name, 'type': 'range', 'done': True},
+                                                sort=[('range_i', pymongo.ASCENDING)], projection={'range_i': 1})
+        return [self.gen_range_filename(doc['range_i'], output_dir=output_dir, suffix=suffix) for doc in cursor]
+
+    def get_progress(self):
+        """
+        :return: (number of ranges done, number of ranges planned)
+        """
+        checkpoint_col = self.get_checkpoint_col()
+        range_filter = {'procedure': self.procedure_name, 'type': 'range'}
+        return (checkpoint_col.count_documents(dict(range_filter, done=True)),
+                checkpoint_col.count_documents(range_filter))
+
+    def reset(self):
+        """
+        Forget all checkpoints of the procedure, so that the next run processes the whole collection again
+        """
+        self.get_checkpoint_col().delete_many({'procedure': self.procedure_name})
@@ -56,6 +56,9 @@ TW_RT_QT_COL = 'tw_rt_qt'
 # colletion of sentiment analysis on quote tweets
 TW_NT_QT_SENT_COL = 'tw_nt_qt_sent'
 
+# collection of '_id' range checkpoints of multiprocessing procedures (see checkpoints.py)
+PROCEDURE_CHECKPOINTS_COL = 'procedure_checkpoints'
+
 
 
 """
@@ -64,6 +67,7 @@ Directories
 DATA_DIR = './data'  # directory for pickled data
 TMP_DIR = './tmp'  # directory for temporary data
 FIG_DIR = './fig' # directory for figures
+BENCHMARK_DIR = './benchmarks' # directory for benchmark results (see benchmarks.py)
 
 
 """
@@ -109,6 +113,15 @@ USER_NT_IBM_TW_PROP_3_IDS_LST_PKL = os.path.join(DATA_DIR, 'user_nt_ibm_tw_prop_
 # list of 'user.id' field of users with < median of IBM tweets proportion
 USER_NT_NONIBM_TW_PROP_3_IDS_LST_PKL = os.path.join(DATA_DIR, 'user_nt_nonibm_tw_prop_3_ids.lst.pkl')
 
+# all pickled lists of ids above, migrated into memory-mapped sorted int64 arrays by ids_store.migrate_all_ids_pkls()
+# (load either of them with ids_store.load_ids)
+IDS_LST_PKLS = [TW_RAW_IDS_LST_PKL, TW_NT_IDS_LST_PKL, TW_RT_IDS_LST_PKL,
+                USER_RAW_IDS_LST_PKL, USER_NT_IDS_LST_PKL, USER_RT_IDS_LST_PKL,
+                USER_NT_IBM_DESC_IDS_LST_PKL, USER_NT_NONIBM_DESC_IDS_LST_PKL,
+                USER_NT_IBM_TW_PROP_1_IDS_LST_PKL, USER_NT_NONIBM_TW_PROP_1_IDS_LST_PKL,
+                USER_NT_IBM_TW_PROP_2_IDS_LST_PKL, USER_NT_NONIBM_TW_PROP_2_IDS_LST_PKL,
+                USER_NT_IBM_TW_PROP_3_IDS_LST_PKL, USER_NT_NONIBM_TW_PROP_3_IDS_LST_PKL]
+
 # dataframe for aggregated (different types of) tweets number and (different types of) retweets count on users
 SIMPLE_INFLUENCE_PKL = os.path.join(DATA_DIR, 'simple_influence.df.pkl')
 
@@ -122,6 +135,27 @@ IBM_FOLLOWERS_PKL = os.path.join(DATA_DIR, 'ibm_followers.df.pkl')
 # based on IBM_CASCADE_PKL and IBM_FOLLOWERS_PKL
 IBM_INFLUENCE_PKL = os.path.join(DATA_DIR, 'ibm_influence.df.pkl')
 
+# per-user influence aggregates with '_id' watermarks of the scanned collections (see influence.py)
+INFLUENCE_STATE_NPZ = os.path.join(DATA_DIR, 'influence_state.npz')
+
+# directory of the memory-mapped CSR arrays of the retweet graph built from TW_RT_COL (see retweet_graph.py)
+RETWEET_GRAPH_DIR = os.path.join(DATA_DIR, 'retweet_graph')
+
+# directory of the keyword bitmap indexes of the tag collections, one subdirectory per collection (see kws_index.py)
+KWS_INDEX_DIR = os.path.join(DATA_DIR, 'kws_index')
+
+# directory of the memory-mapped rollup cube of tweet counts by hour/keyword/type/affiliation of TW_RAW_COL (see rollup_cube.py)
+TW_ROLLUP_DIR = os.path.join(DATA_DIR, 'tw_rollup')
+
+# directory of the merged streaming sketches of the tweet collections, one .npz per collection (see sketches.py)
+SKETCHES_DIR = os.path.join(DATA_DIR, 'sketches')
+
+# fingerprints of the inputs/outputs of the last successful run of each pipeline stage (see pipeline.py)
+PIPELINE_STATE_FILE = os.path.join(DATA_DIR, 'pipeline_state.json')
+
+# sqlite file of memoized sentiment polarity scores, shared by all processes and notebooks (see sentiment_cache.py)
+SENTIMENT_CACHE_DB = os.path.join(DATA_DIR, 'sentiment_cache.sqlite')
+
 # dataframe for pos/neu/neg sentiments quote tweets influence info
 QT_SENY_INFLUENCE_PKL = os.path.join(DATA_DIR, 'qt_sent_influence.df.pkl')
 
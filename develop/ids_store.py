@@ -0,0 +1,152 @@
+"""
+Store lists of ids (tweet ids, user ids) as sorted int64 NumPy arrays, memory-mapped on load
+
+Replacement for the pickled lists of ids (the *_IDS_LST_PKL files in config.py):
+loading is near instant and uses no Python int objects,
+and membership tests and set operations are vectorized over the sorted arrays.
+"""
+
+import os
+import pickle
+
+import numpy as np
+
+from config import * # import all global config variables
+
+
+def ids_npy_path(ids_path):
+    """
+    Get the .npy path of a list of ids, e.g. 'data/tw_raw_ids.lst.pkl' -> 'data/tw_raw_ids.npy'
+
+    :param ids_path: path of the pickled list of ids (as in config.py), or of the .npy file itself
+    :return: path of the .npy file
+    """
+    if ids_path.endswith('.npy'):
+        return ids_path
+    if ids_path.endswith('.lst.pkl'):
+        return ids_path[:-len('.lst.pkl')] + '.npy'
+    return os.path.splitext(ids_path)[0] + '.npy'
+
+
+def to_ids_array(ids):
+    """
+    Turn ids (list, set, array, ...) into a sorted array of unique int64 ids
+
+    :param ids: iterable of ids
+    :return: NumPy int64 array
+    """
+    if isinstance(ids, np.ndarray):
+        return np.unique(ids.astype(np.int64, copy=False))
+    if not isinstance(ids, (list, tuple)):
+        ids = list(ids)
+    return np.unique(np.array(ids, dtype=np.int64))
+
+
+def save_ids(ids, ids_path):
+    """
+    Save ids as a sorted array of unique int64 ids
+
+    :param ids: iterable of ids
+    :param ids_path: path of the pickled list of ids (as in config.py) or of the .npy file
+    :return: path of the written .npy file
+    """
+    npy_path = ids_npy_path(ids_path)
+    np.save(npy_path, to_ids_array(ids))
+    return npy_path
+
+
+def load_ids(ids_path, mmap=True):
+    """
+    Load a sorted array of ids. Takes the config.py pickle path and reads the migrated .npy file if present,
+    otherwise falls back to the original pickle.
+
+    :param ids_path: path of the pickled list of ids (as in config.py) or of the .npy file
+    :param mmap: bool value indicates whether to memory-map the file (read-only) instead of reading it into memory
+    :return: NumPy int64 array of sorted unique ids
+    """
+    npy_path = ids_npy_path(ids_path)
+    if os.path.exists(npy_path):
+        return np.load(npy_path, mmap_mode='r' if mmap else None)
+    with open(ids_path, 'rb') as f:
+        return to_ids_array(pickle.load(f))
+
+
+def migrate_ids_pkl(ids_pkl, remove_pkl=False):
+    """
+    One-time migration of a pickled list of ids into a .npy file next to it
+
+    :param ids_pkl: path of the pickled list of ids
+    :param remove_pkl: bool value indicates whether to remove the pickle afterwards
+    :return: path of the written .npy file
+    """
+    with open(ids_pkl, 'rb') as f:
+        ids_lst = pickle.load(f)
+    npy_path = save_ids(ids_lst, ids_pkl)
+    print('Migrated {} ({} ids) to {}'.format(ids_pkl, len(ids_lst), npy_path))
+    if remove_pkl:
+        os.remove(ids_pkl)
+    return npy_path
+
+
+def migrate_all_ids_pkls(ids_pkls=IDS_LST_PKLS, remove_pkl=False):
+    """
+    Migrate all existing pickled lists of ids listed in config.py
+
+    :param ids_pkls: a list of paths of pickled lists of ids
+    :param remove_pkl: bool value indicates whether to remove the pickles afterwards
+    :return: a list of paths of written .npy files
+    """
+    return [migrate_ids_pkl(ids_pkl, remove_pkl=remove_pkl) for ids_pkl in ids_pkls if os.path.exists(ids_pkl)]
+
+
+def isin(ids_arr, values):
+    """
+    Vectorized membership test of values in a sorted array of ids
+
+    :param ids_arr: NumPy array of sorted unique ids
+    :param values: array-like of ids to test
+    :return: NumPy bool array, True where the value is in ids_arr
+    """
+    values = np.asarray(values, dtype=np.int64)
+    if len(ids_arr) == 0:
+        return np.zeros(values.shape, dtype=bool)
+    inds = np.searchsorted(ids_arr, values)
+    inds[inds == len(ids_arr)] = 0
+    return ids_arr[inds] == values
+
+
+def contains(ids_arr, value):
+    """
+    Membership test of a single id in a sorted array of ids
+
+    :param ids_arr: NumPy array of sorted unique ids
+    :param value: id to test
+    :return: bool value
+    """
+    ind = np.searchsorted(ids_arr, value)
+    return bool(ind < len(ids_arr) and ids_arr[ind] == value)
+
+
+def intersect(ids_arr_a, ids_arr_b):
+    """
+    Ids in both sorted arrays of ids
+    """
+    return np.intersect1d(ids_arr_a, ids_arr_b, assume_unique=True)
+
+
+def union(ids_arr_a, ids_arr_b):
+    """
+    Ids in any of the sorted arrays of ids
+    """
+    return np.union1d(ids_arr_a, ids_arr_b)
+
+
+def difference(ids_arr_a, ids_arr_b):
+    """
+    Ids in the first sorted array of ids but not in the second one
+    """
+    return ids_arr_a[~isin(ids_arr_b, ids_arr_a)]
+
+
+if __name__ == '__main__':
+    migrate_all_ids_pkls()
@@ -0,0 +1,398 @@
+"""
+Per-user influence aggregates and vectorized influence scores
+
+Replaces the '$group' chains of 20170504-influence_plots and 20170507-compare_influence_inside_outside
+(SIMPLE_INFLUENCE_PKL, IBM_CASCADE_PKL, IBM_FOLLOWERS_PKL, IBM_INFLUENCE_PKL):
+one sequential scan of TW_NT_COL and one of TW_RT_COL feed NumPy accumulators keyed by user id,
+and all influence variants are computed from those arrays at once.
+The accumulators are saved together with the last '_id' scanned in each collection,
+so that updating them after new tweets arrive only scans the new documents.
+
+Columns (names as in the original dataframes):
+    fo, n_n, n_src, q_n, q_src, p_n, p_src, nr_n, nr_src: followers_count, number of native tweets and
+        sum of their retweet_count, for all/quote/reply/normal native tweets (SIMPLE_INFLUENCE_PKL)
+    all_n, ibm_n, nonibm_n, all_srt, ibm_srt, nonibm_srt: number of distinct tweets of the user retweeted by
+        all/IBM/non-IBM users, and number of retweets on them by all/IBM/non-IBM users (IBM_CASCADE_PKL)
+    fo_2, fo_ibm: followers number and IBM followers number, from the hydrated followers (IBM_FOLLOWERS_PKL)
+"""
+
+import os
+
+import bson
+import numpy as np
+import pandas as pd
+import pymongo
+
+import ids_store
+import mongodb
+import utilities
+from config import * # import all global config variables
+
+
+# columns summed over tweets
+SUM_COLS = ['n_n', 'n_src', 'q_n', 'q_src', 'p_n', 'p_src', 'nr_n', 'nr_src',
+            'all_n', 'all_srt', 'ibm_n', 'ibm_srt', 'nonibm_n', 'nonibm_srt']
+# columns counting distinct retweeted tweets
+RETWEETED_COLS = ['all_n', 'ibm_n', 'nonibm_n']
+# columns keeping the latest value seen, -1 when never seen
+LATEST_COLS = ['fo', 'fo_2', 'fo_ibm']
+
+NATIVE_PROJECTION = {'_id': 1, 'id': 1, 'user.id': 1, 'user.followers_count': 1, 'retweet_count': 1,
+                     'quoted_status.id': 1, 'in_reply_to_status_id': 1}
+RETWEET_PROJECTION = {'_id': 1, 'user.id': 1, 'user.description': 1,
+                      'retweeted_status.id': 1, 'retweeted_status.user.id': 1}
+
+
+class InfluenceAccumulator(object):
+    """
+    Per-user aggregates as NumPy arrays aligned with a sorted array of user ids.
+
+    Tweets are added chunk by chunk; chunks are buffered and merged into the arrays
+    every merge_rows rows (and on consolidate()), so that the arrays are not rebuilt for each chunk.
+    """
+
+    def __init__(self, merge_rows=5000000):
+        """
+        :param merge_rows: number of buffered rows which triggers a merge into the arrays
+        """
+        self.merge_rows = merge_rows
+        self.uids = np.zeros(0, dtype=np.int64)
+        self.cols = {col: np.zeros(0, dtype=np.int64) for col in SUM_COLS + LATEST_COLS}
+        # order keys of the latest values: tweet id for 'fo', arrival order for 'fo_2'/'fo_ibm'
+        self.keys = {col: np.zeros(0, dtype=np.int64) for col in LATEST_COLS}
+        # sorted ids of retweeted tweets already counted in each of RETWEETED_COLS
+        self.rt_tids = {col: np.zeros(0, dtype=np.int64) for col in RETWEETED_COLS}
+        # last '_id' scanned in each collection
+        self.watermarks = {}
+        self._arrival_i = 0
+        self._pending = []
+        self._pending_rows = 0
+
+    def _extend_uids(self, uids):
+        """
+        Add (sorted unique) user ids to the arrays, return their indices
+        """
+        new_uids = np.union1d(self.uids, uids)
+        if len(new_uids) != len(self.uids):
+            inds = np.searchsorted(new_uids, self.uids)
+            for col, arr in self.cols.items():
+                new_arr = np.full(len(new_uids), 0 if col in SUM_COLS else -1, dtype=np.int64)
+                new_arr[inds] = arr
+                self.cols[col] = new_arr
+            for col, arr in self.keys.items():
+                new_arr = np.full(len(new_uids), -1, dtype=np.int64)
+                new_arr[inds] = arr
+                self.keys[col] = new_arr
+            self.uids = new_uids
+        return np.searchsorted(self.uids, uids)
+
+    def _buffer(self, kind, uids, values):
+        self._pending.append((kind, uids, values))
+        self._pending_rows += len(uids)
+        if self._pending_rows >= self.merge_rows:
+            self.consolidate()
+
+    def add_sums(self, uids, **values):
+        """
+        :param uids: array-like of user ids
+        :param values: column name -> array-like of values added to the user of the same position
+        """
+        self._buffer('sums', np.asarray(uids, dtype=np.int64),
+                     {col: np.asarray(arr, dtype=np.int64) for col, arr in values.items()})
+
+    def add_latest(self, uids, keys, **values):
+        """
+        :param uids: array-like of user ids
+        :param keys: array-like of order keys; for each user the value with the largest key is kept
+        :param values: column name -> array-like of values
+        """
+        self._buffer('latest', np.asarray(uids, dtype=np.int64),
+                     dict({col: np.asarray(arr, dtype=np.int64) for col, arr in values.items()},
+                          _key=np.asarray(keys, dtype=np.int64)))
+
+    def add_retweeted_tweets(self, tids, uids, col='all_n'):
+        """
+        :param tids: array-like of retweeted tweet ids
+        :param uids: array-like of the ids of their authors
+        :param col: the column counting them, one of RETWEETED_COLS
+        """
+        self._buffer('retweeted', np.asarray(uids, dtype=np.int64), {col: np.asarray(tids, dtype=np.int64)})
+
+    def consolidate(self):
+        """
+        Merge all buffered chunks into the arrays
+        """
+        pending, self._pending, self._pending_rows = self._pending, [], 0
+        # chunks of the same kind and columns are merged together (e.g. native tweets and retweets add different sums)
+        groups = {}
+        for kind, uids, values in pending:
+            groups.setdefault((kind, tuple(sorted(values))), []).append((uids, values))
+        kind_order = ['sums', 'latest', 'retweeted']
+        for (kind, _), chunks in sorted(groups.items(), key=lambda item: (kind_order.index(item[0][0]), item[0][1])):
+            uids = np.concatenate([uids for uids, _ in chunks])
+            values = {col: np.concatenate([values[col] for _, values in chunks]) for col in chunks[0][1]}
+            if kind == 'retweeted':
+                # count each retweeted tweet once, also across updates
+                (col, tids), = values.items()
+                tids, first_inds = np.unique(tids, return_index=True)
+                new_mask = ~ids_store.isin(self.rt_tids[col], tids)
+                self.rt_tids[col] = np.union1d(self.rt_tids[col], tids[new_mask])
+                uids = uids[first_inds[new_mask]]
+                kind, values = 'sums', {col: np.ones(len(uids), dtype=np.int64)}
+            uniq_uids, inverse = np.unique(uids, return_inverse=True)
+            inds = self._extend_uids(uniq_uids)[inverse]
+            if kind == 'sums':
+                for col, arr in values.items():
+                    self.cols[col] += np.bincount(inds, weights=arr, minlength=len(self.uids)).astype(np.int64)
+            else:
+                # last value of each user by key, kept only if newer than the current one
+                keys = values.pop('_key')
+                order = np.lexsort((keys, inds))
+                inds, keys = inds[order], keys[order]
+                last_mask = np.append(inds[1:] != inds[:-1], True)
+                inds, keys, order = inds[last_mask], keys[last_mask], order[last_mask]
+                for col, arr in values.items():
+                    newer_mask = keys > self.keys[col][inds]
+                    self.cols[col][inds[newer_mask]] = arr[order[newer_mask]]
+                    self.keys[col][inds[newer_mask]] = keys[newer_mask]
+
+    def add_native_tweets(self, docs_lst):
+        """
+        Add a chunk of native tweets (projected with NATIVE_PROJECTION)
+        """
+        n = len(docs_lst)
+        uids = np.empty(n, dtype=np.int64)
+        tids = np.empty(n, dtype=np.int64)
+        fos = np.empty(n, dtype=np.int64)
+        srts = np.empty(n, dtype=np.int64)
+        is_q = np.empty(n, dtype=bool)
+        is_p = np.empty(n, dtype=bool)
+        for ind, doc in enumerate(docs_lst):
+            uids[ind] = doc['user']['id']
+            tids[ind] = doc['id']
+            fos[ind] = doc['user'].get('followers_count') or 0
+            srts[ind] = doc.get('retweet_count') or 0
+            is_q[ind] = 'quoted_status' in doc
+            is_p[ind] = doc.get('in_reply_to_status_id') is not None
+        is_nr = ~(is_q | is_p)
+        self.add_sums(uids, n_n=np.ones(n, dtype=np.int64), n_src=srts,
+                      q_n=is_q, q_src=srts * is_q, p_n=is_p, p_src=srts * is_p, nr_n=is_nr, nr_src=srts * is_nr)
+        self.add_latest(uids, tids, fo=fos)
+
+    def add_retweets(self, docs_lst, ibm_retweeter_ids=None, keyword='ibm'):
+        """
+        Add a chunk of retweets (projected with RETWEET_PROJECTION)
+
+        :param docs_lst: a list of retweets
+        :param ibm_retweeter_ids: sorted array of ids of IBM users among the retweeters,
+                                  None to tag retweeters by keyword in the 'description' of each retweet
+        :param keyword: keyword tagging IBM users
+        """
+        n = len(docs_lst)
+        uids = np.empty(n, dtype=np.int64)
+        tids = np.empty(n, dtype=np.int64)
+        retweeter_uids = np.empty(n, dtype=np.int64)
+        is_ibm = np.empty(n, dtype=bool)
+        for ind, doc in enumerate(docs_lst):
+            uids[ind] = doc['retweeted_status']['user']['id']
+            tids[ind] = doc['retweeted_status']['id']
+            retweeter_uids[ind] = doc['user']['id']
+            if ibm_retweeter_ids is None:
+                is_ibm[ind] = utilities.simple_test_keyword_in_text(doc['user'].get('description'), keyword)
+        if ibm_retweeter_ids is not None:
+            is_ibm = ids_store.isin(ibm_retweeter_ids, retweeter_uids)
+        self.add_sums(uids, all_srt=np.ones(n, dtype=np.int64), ibm_srt=is_ibm, nonibm_srt=~is_ibm)
+        self.add_retweeted_tweets(tids, uids)
+        self.add_retweeted_tweets(tids[is_ibm], uids[is_ibm], 'ibm_n')
+        self.add_retweeted_tweets(tids[~is_ibm], uids[~is_ibm], 'nonibm_n')
+
+    def add_followers(self, docs_lst):
+        """
+        Add followers counts of hydrated users, as written by multiprocessing_workers.worker_count_ibm_followers_ibm_users
+
+        :param docs_lst: a list of {'uid', 'followers_count', 'ibm_followers_count'} dicts
+        """
+        n = len(docs_lst)
+        keys = np.arange(self._arrival_i, self._arrival_i + n, dtype=np.int64)
+        self._arrival_i += n
+        self.add_latest([doc['uid'] for doc in docs_lst], keys,
+                        fo_2=[doc['followers_count'] for doc in docs_lst],
+                        fo_ibm=[doc['ibm_followers_count'] for doc in docs_lst])
+
+    def load_followers_inter_files(self, inter_files, chunk_size=10000):
+        """
+        :param inter_files: a list of intermediate output files of worker_count_ibm_followers_ibm_users
+        """
+        for inter_file in inter_files:
+            for docs_lst in utilities.read_inter_file_chunks(inter_file, chunk_size):
+                self.add_followers(docs_lst)
+
+    def scan_collection(self, collection, add_fn, projection, chunk_size=10000):
+        """
+        Feed the documents of a collection added since the last scan (by '_id') to add_fn, chunk by chunk
+
+        :param collection: the collection obj
+        :param add_fn: function taking a list of documents, e.g. self.add_native_tweets
+        :param projection: projection of the documents
+        :param chunk_size: number of documents per chunk
+        :return: number of scanned documents
+        """
+        col_key = '{}.{}'.format(collection.database.name, collection.name)
+        last_id = self.watermarks.get(col_key)
+        cursor = collection.find(filter={'_id': {'$gt': last_id}} if last_id is not None else {},
+                                 projection=projection, sort=[('_id', pymongo.ASCENDING)])
+        if mongodb.CURSOR_BATCH_SIZE:
+            cursor = cursor.batch_size(mongodb.CURSOR_BATCH_SIZE)
+        docs_n = 0
+        for docs_lst in utilities.iter_chunks(cursor, chunk_size):
+            add_fn(docs_lst)
+            docs_n += len(docs_lst)
+            last_id = docs_lst[-1]['_id']
+        self.consolidate()
+        if last_id is not None:
+            self.watermarks[col_key] = last_id
+        print('Scanned {} new docs of {}'.format(docs_n, col_key))
+        return docs_n
+
+    def save(self, state_file):
+        """
+        Save the arrays and watermarks into a .npz file
+        """
+        self.consolidate()
+        arrays = {'uids': self.uids,
+                  'arrival_i': np.array(self._arrival_i, dtype=np.int64),
+                  'watermark_cols': np.array(list(self.watermarks.keys()), dtype=str),
+                  'watermark_ids': np.array([str(_id) for _id in self.watermarks.values()], dtype=str)}
+        arrays.update({'col_' + col: arr for col, arr in self.cols.items()})
+        arrays.update({'key_' + col: arr for col, arr in self.keys.items()})
+        arrays.update({'rt_tids_' + col: arr for col, arr in self.rt_tids.items()})
+        with open(state_file, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, state_file, merge_rows=5000000):
+        """
+        Load arrays and watermarks saved with save()
+        """
+        acc = cls(merge_rows=merge_rows)
+        with np.load(state_file) as arrays:
+            if 'rt_tids' in arrays: # saved before ibm_n and nonibm_n were counted
+                raise ValueError('{} has no ibm_n/nonibm_n, delete it to recompute the aggregates'.format(state_file))
+            acc.uids = arrays['uids']
+            acc._arrival_i = int(arrays['arrival_i'])
+            acc.cols = {col: arrays['col_' + col] for col in SUM_COLS + LATEST_COLS}
+            acc.keys = {col: arrays['key_' + col] for col in LATEST_COLS}
+            acc.rt_tids = {col: arrays['rt_tids_' + col] for col in RETWEETED_COLS}
+            acc.watermarks = {col_key: bson.ObjectId(_id) if bson.ObjectId.is_valid(_id) else _id
+                              for col_key, _id in zip(arrays['watermark_cols'].tolist(), arrays['watermark_ids'].tolist())}
+        return acc
+
+
+def update_influence_state(db_name=DB_NAME, state_file=INFLUENCE_STATE_NPZ, followers_inter_files=None,
+                           ibm_retweeter_ids=None, chunk_size=10000):
+    """
+    Create or update the influence aggregates: scan only tweets added since the last update and save the state.
+    Changing ibm_retweeter_ids between updates only affects retweets scanned afterwards;
+    delete state_file to recompute everything.
+
+    :param db_name: the name of the MongoDB database
+    :param state_file: .npz file of the aggregates
+    :param followers_inter_files: intermediate output files of worker_count_ibm_followers_ibm_users to load, if any
+    :param ibm_retweeter_ids: see InfluenceAccumulator.add_retweets
+    :param chunk_size: number of documents per chunk
+    :return: InfluenceAccumulator obj
+    """
+    if os.path.exists(state_file):
+        acc = InfluenceAccumulator.load(state_file)
+    else:
+        acc = InfluenceAccumulator()
+
+    acc.scan_collection(mongodb.initialize(db_name, TW_NT_COL), acc.add_native_tweets, NATIVE_PROJECTION, chunk_size)
+    acc.scan_collection(mongodb.initialize(db_name, TW_RT_COL),
+                        lambda docs_lst: acc.add_retweets(docs_lst, ibm_retweeter_ids=ibm_retweeter_ids),
+                        RETWEET_PROJECTION, chunk_size)
+    if followers_inter_files:
+        acc.load_followers_inter_files(followers_inter_files, chunk_size)
+
+    acc.save(state_file)
+    return acc
+
+
+def simple_influence(srt, fo, native_n, min_inf=None):
+    """
+    Simple influence: retweets per native tweet per follower, srt / (fo * native_n)
+
+    :param srt: array of numbers of retweets
+    :param fo: array of followers numbers
+    :param native_n: array of numbers of native tweets
+    :param min_inf: lower limit of the influence (so that it can be plotted in log scale), None for no limit
+    :return: NumPy float array
+    """
+    norm = np.asarray(fo, dtype=np.float64) * np.asarray(native_n, dtype=np.float64)
+    norm[norm == 0] = 1 # clean 0 values since its denominator
+    inf = np.asarray(srt, dtype=np.float64) / norm
+    if min_inf is not None:
+        inf = np.maximum(inf, min_inf)
+    return inf
+
+
+def compound_influence(srt, fo, native_n, min_inf=None):
+    """
+    Compound influence: retweets per native tweet times log of followers number, srt / native_n * log(fo)
+
+    :param srt: array of numbers of retweets
+    :param fo: array of followers numbers
+    :param native_n: array of numbers of native tweets
+    :param min_inf: lower limit of the influence, None for no limit
+    :return: NumPy float array
+    """
+    native_n = np.asarray(native_n, dtype=np.float64).copy()
+    native_n[native_n == 0] = 1
+    fo = np.asarray(fo, dtype=np.float64).copy()
+    fo[fo <= 0] = 1 # clean 0 values, log(1) = 0
+    inf = np.asarray(srt, dtype=np.float64) / native_n * np.log(fo)
+    if min_inf is not None:
+        inf = np.maximum(inf, min_inf)
+    return inf
+
+
+def influence_table(acc, uids=None, min_inf=None):
+    """
+    All per-user aggregates and influence variants as a dataframe
+
+    Influence columns:
+        simple_inf: simple influence of all native tweets, n_src / (fo * n_n), as in 20170504-influence_plots
+        all_simple_inf, in_simple_inf, out_simple_inf: simple influence of native tweets on all/IBM/non-IBM users,
+            e.g. ibm_srt / (fo_ibm * n_n), as in 20170507-compare_influence_inside_outside
+        all_compound_inf, in_compound_inf, out_compound_inf: compound influence, e.g. ibm_srt / n_n * log(fo_ibm)
+    Followers based columns are NaN for users whose followers were not hydrated (fo_2 is -1).
+    Users retweeted inside/outside are selected as in 20170507-compare_influence_inside_outside,
+    e.g. df[df['ibm_n'] > 0].
+
+    :param acc: InfluenceAccumulator obj
+    :param uids: array-like of user ids to keep (e.g. ids_store.load_ids(USER_NT_IBM_DESC_IDS_LST_PKL)), None for all users
+    :param min_inf: lower limit of the influence, None for no limit
+    :return: pandas dataframe, one row per user
+    """
+    acc.consolidate()
+    mask = slice(None) if uids is None else ids_store.isin(ids_store.to_ids_array(uids), acc.uids)
+    data = {'uid': acc.uids[mask]}
+    data.update({col: arr[mask] for col, arr in acc.cols.items()})
+
+    hydrated_mask = data['fo_2'] >= 0
+    fo_2 = np.where(hydrated_mask, data['fo_2'], np.nan)
+    fo_ibm = np.where(hydrated_mask, data['fo_ibm'], np.nan)
+    data['fo_nonibm'] = fo_2 - fo_ibm
+
+    native_n = data['n_n']
+    data['simple_inf'] = simple_influence(data['n_src'], data['fo'], native_n, min_inf)
+    for direction, srt, fo in [('all', data['all_srt'], fo_2), ('in', data['ibm_srt'], fo_ibm),
+                               ('out', data['nonibm_srt'], data['fo_nonibm'])]:
+        data[direction + '_simple_inf'] = np.where(hydrated_mask, simple_influence(srt, np.nan_to_num(fo), native_n, min_inf), np.nan)
+        data[direction + '_compound_inf'] = np.where(hydrated_mask, compound_influence(srt, np.nan_to_num(fo), native_n, min_inf), np.nan)
+    return pd.DataFrame(data)
+
+
+if __name__ == '__main__':
+    influence_acc = update_influence_state()
+    print(influence_table(influence_acc).describe())
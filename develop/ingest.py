@@ -0,0 +1,178 @@
+"""
+Single-pass streaming ingest of raw tweet dumps (JSON lines) into the tweets collections
+
+Replaces mongoimport + delete_many cleanup + one '$match'/'$out' aggregation per derived collection:
+the dumps are read once, each tweet is validated and routed to all collections it belongs to,
+with unordered bulk inserts into the collections running in parallel.
+Tweets are deduplicated by the server: unique indexes on 'id' are built before the load and inserts of tweets
+already in a collection (from earlier dumps or earlier in the same dumps) are rejected and counted as duplicates,
+so memory use does not grow with the number of tweets. Other indexes are built after the load.
+A database loaded before (with non-unique indexes on 'id', maybe with duplicates) is deduplicated and reindexed first.
+"""
+
+import json
+
+import bson
+from pymongo import IndexModel, ASCENDING
+
+import mongodb
+import sinks
+from config import * # import all global config variables
+
+try:
+    import orjson # fast JSON decoder, optional
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+
+# basic indexes for tweets and users, see 20170414-clean_raw_data
+BASIC_INDEX_KEYS = ['id', 'id_str', 'user.id', 'user.id_str', 'user.screen_name']
+# basic indexes that are unique, built before the load to deduplicate tweets
+UNIQUE_INDEX_KEYS = ['id']
+# extra indexes on fields inside 'retweeted_status', for retweets collections
+RT_EXTRA_INDEX_KEYS = ['retweeted_status.id', 'retweeted_status.id_str', 'retweeted_status.user.id',
+                       'retweeted_status.user.id_str', 'retweeted_status.user.screen_name']
+
+
+def route_tweet(tweet):
+    """
+    Get the collections a (valid) tweet belongs to
+
+    :param tweet: tweet document
+    :return: a list of collection names
+    """
+    if 'retweeted_status' in tweet:
+        col_names = [TW_RAW_COL, TW_RT_COL]
+        if 'quoted_status' in tweet['retweeted_status']:
+            col_names.append(TW_RT_QT_COL)
+    else:
+        col_names = [TW_RAW_COL, TW_NT_COL]
+        if 'quoted_status' in tweet:
+            col_names.append(TW_NT_QT_COL)
+    return col_names
+
+
+def iter_raw_tweets(raw_files, stats):
+    """
+    Read raw dumps line by line and yield valid tweets, counting what is dropped.
+    Server messages (e.g. 'delete', 'limit') have no 'id' field; tweets without 'user' field are server errors.
+
+    :param raw_files: a list of raw JSON lines dump files
+    :param stats: dict of counters to update
+    :return: generator of tweet documents
+    """
+    for raw_file in raw_files:
+        print('Reading {}...'.format(raw_file))
+        with open(raw_file, 'rb', buffering=1 << 20) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    tweet = json_loads(line)
+                except ValueError:
+                    stats['malformed'] += 1
+                    continue
+                if not isinstance(tweet, dict) or 'id' not in tweet:
+                    stats['server_messages'] += 1
+                    continue
+                if 'user' not in tweet:
+                    stats['no_user'] += 1
+                    continue
+                yield tweet
+
+
+def ingest_raw_files(raw_files, db_name=DB_NAME, build_indexes=True, batch_size=1000):
+    """
+    Load raw dumps into TW_RAW_COL, TW_NT_COL, TW_RT_COL, TW_NT_QT_COL and TW_RT_QT_COL in one sequential read.
+    Tweets whose 'id' is already in the collections are skipped, so new dumps can be appended to an existing database.
+
+    :param raw_files: a list of raw JSON lines dump files
+    :param db_name: the name of the MongoDB database to load into
+    :param build_indexes: bool value indicates whether to build the other indexes after the load
+    :param batch_size: number of documents per bulk insert
+    :return: dict of counters
+    """
+    col_names = [TW_RAW_COL, TW_NT_COL, TW_RT_COL, TW_NT_QT_COL, TW_RT_QT_COL]
+    build_unique_indexes(db_name, col_names)
+    # one sink per collection, each with its own writer thread, so inserts into all collections run in parallel
+    col_sinks = {col_name: sinks.MongoBulkSink(db_name, col_name, batch_size=batch_size, max_pending_batches=4,
+                                               ignore_duplicates=True)
+                 for col_name in col_names}
+
+    stats = dict.fromkeys(['malformed', 'server_messages', 'no_user', 'duplicates'] + col_names, 0)
+    try:
+        for tweet in iter_raw_tweets(raw_files, stats):
+            # same '_id' in all collections, as '$out' would keep it; also avoids sinks adding it concurrently
+            tweet['_id'] = bson.ObjectId()
+            for col_name in route_tweet(tweet):
+                col_sinks[col_name].write(tweet)
+    finally:
+        for sink in col_sinks.values():
+            sink.close()
+    for col_name, sink in col_sinks.items():
+        stats[col_name] = sink.written_n
+    stats['duplicates'] = col_sinks[TW_RAW_COL].duplicates_n # every tweet goes into TW_RAW_COL
+    print('Ingested: {}'.format(stats))
+
+    if build_indexes:
+        build_tweets_indexes(db_name, col_names)
+    return stats
+
+
+def dedupe_collection(collection, key):
+    """
+    Delete documents with the same value of key as an earlier document (smaller '_id'), keeping the earliest one
+
+    :param collection: pymongo.collection.Collection obj
+    :param key: the field to deduplicate on, e.g. 'id'
+    :return: number of documents deleted
+    """
+    deleted_n = 0
+    pipeline = [{'$group': {'_id': '$' + key, 'doc_ids': {'$push': '$_id'}, 'docs_n': {'$sum': 1}}},
+                {'$match': {'docs_n': {'$gt': 1}}}]
+    for group in collection.aggregate(pipeline, allowDiskUse=True):
+        deleted_n += collection.delete_many({'_id': {'$in': sorted(group['doc_ids'])[1:]}}).deleted_count
+    return deleted_n
+
+
+def build_unique_indexes(db_name=DB_NAME, col_names=(TW_RAW_COL, TW_NT_COL, TW_RT_COL, TW_NT_QT_COL, TW_RT_QT_COL)):
+    """
+    Build the unique indexes (UNIQUE_INDEX_KEYS) on tweets collections, so that inserting a tweet twice fails.
+    Existing collections are migrated first: duplicates are deleted (see dedupe_collection) and a non-unique index
+    on the same key (e.g. built by 20170414-clean_raw_data) is dropped, as it cannot be turned into a unique one.
+
+    :param db_name: the name of the MongoDB database
+    :param col_names: names of the collections to index
+    """
+    db = mongodb.initialize_db(db_name)
+    for col_name in col_names:
+        indexes_info = db[col_name].index_information()
+        for index_key in UNIQUE_INDEX_KEYS:
+            index_keys = [(index_key, ASCENDING)]
+            if any(info['key'] == index_keys and info.get('unique') for info in indexes_info.values()):
+                continue
+            deleted_n = dedupe_collection(db[col_name], index_key)
+            if deleted_n:
+                print('Deleted {} duplicates of {} in {}'.format(deleted_n, index_key, col_name))
+            for index_name, info in indexes_info.items():
+                if info['key'] == index_keys:
+                    print('Rebuilding index {} on {} as unique...'.format(index_name, col_name))
+                    db[col_name].drop_index(index_name)
+            db[col_name].create_indexes([IndexModel(index_keys, unique=True)])
+
+
+def build_tweets_indexes(db_name=DB_NAME, col_names=(TW_RAW_COL, TW_NT_COL, TW_RT_COL, TW_NT_QT_COL, TW_RT_QT_COL)):
+    """
+    Build basic indexes on tweets collections, and extra 'retweeted_status' indexes on retweets collections
+
+    :param db_name: the name of the MongoDB database
+    :param col_names: names of the collections to index
+    """
+    build_unique_indexes(db_name, col_names)
+    db = mongodb.initialize_db(db_name)
+    for col_name in col_names:
+        index_keys = BASIC_INDEX_KEYS + (RT_EXTRA_INDEX_KEYS if col_name in (TW_RT_COL, TW_RT_QT_COL) else [])
+        print('Building indexes on {}...'.format(col_name))
+        db[col_name].create_indexes([IndexModel([(index_key, ASCENDING)])
+                                     for index_key in index_keys if index_key not in UNIQUE_INDEX_KEYS])
@@ -0,0 +1,382 @@
+"""
+Per-process instrumentation of multiprocessing procedures: counters, timers, live progress and JSON profiles
+
+An Instrument is created in the parent and passed to every worker (like checkpoints.Checkpointer):
+    instrument = instrumentation.Instrument(procedure_name, total_docs_n=collection.estimated_document_count(),
+                                            profile_file=os.path.join(TMP_DIR, '{}-profile.json'.format(procedure_name)))
+    jobs = [multiprocessing.Process(target=multiprocessing_workers.worker_..., args=(..., ), kwargs={'instrument': instrument})
+            for batch_i in range(process_n)]
+    for job in jobs:
+        job.start()
+    instrument.monitor(jobs) # live progress/ETA until all processes are done, then writes the profile
+    for job in jobs:
+        job.join()
+To pass it to pool tasks (e.g. worker_pool.WarmPool.apply_async), create it with a multiprocessing.Manager:
+    instrument = instrumentation.Instrument(procedure_name, manager=manager)
+    async_results = [pool.apply_async(multiprocessing_workers.worker_..., args=(...), kwds={'instrument': instrument})
+                     for batch_i in range(process_n)]
+    instrument.monitor(async_results)
+
+In each worker, the stats of its process count documents read from cursors and written into sinks,
+and split the time into cursor wait (waiting for MongoDB), write (sinks) and compute (everything else).
+Snapshots are sent to the parent over a queue every report_interval seconds.
+With profile=True, a sampling profiler records the hottest functions of each process;
+workers are decorated with instrumented, so that the profiler stops even when a worker raises.
+"""
+
+import collections
+import functools
+import json
+import multiprocessing
+import multiprocessing.queues
+import os
+import queue
+import signal
+import time
+
+
+# sampling profilers started in this process and not stopped yet
+running_profilers = []
+
+
+class SamplingProfiler(object):
+    """
+    Minimal statistical profiler: samples the current stack of the main thread every interval seconds of CPU time
+    (SIGPROF), and counts the functions on top of the stack and on the stack at all.
+    """
+
+    def __init__(self, interval=0.005):
+        """
+        :param interval: sampling interval in seconds of CPU time
+        """
+        self.interval = interval
+        self.self_counts = collections.Counter()
+        self.total_counts = collections.Counter()
+        self.samples_n = 0
+
+    def _sample(self, signum, frame):
+        self.samples_n += 1
+        seen = set()
+        top = True
+        while frame is not None:
+            code = frame.f_code
+            key = '{}:{}:{}'.format(os.path.basename(code.co_filename), code.co_firstlineno, code.co_name)
+            if top:
+                self.self_counts[key] += 1
+                top = False
+            if key not in seen:
+                self.total_counts[key] += 1
+                seen.add(key)
+            frame = frame.f_back
+
+    def start(self):
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        running_profilers.append(self)
+
+    def stop(self):
+        if self not in running_profilers:
+            return
+        running_profilers.remove(self)
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def top(self, n=20):
+        """
+        :return: dict of the n hottest functions by self samples and by total (inclusive) samples
+        """
+        return {'samples_n': self.samples_n, 'interval': self.interval,
+                'self': self.self_counts.most_common(n), 'total': self.total_counts.most_common(n)}
+
+
+class WorkerStats(object):
+    """
+    Counters and timers of one worker process, see Instrument.start
+    """
+
+    def __init__(self, instrument, batch_i, process_n):
+        self.instrument = instrument
+        self.batch_i = batch_i
+        self.process_n = process_n
+        self.counters = collections.Counter()
+        self.timers = collections.Counter()
+        self.start_time = time.perf_counter()
+        self.last_report_time = self.start_time
+        self.profiler = None
+        if instrument.profile:
+            self.profiler = SamplingProfiler(instrument.profile_interval)
+            self.profiler.start()
+
+    def add(self, name, n=1):
+        """
+        Increase a counter, e.g. add('bytes_read', file_bytes)
+        """
+        self.counters[name] += n
+
+    def iter_docs(self, cursor, counter='docs_read'):
+        """
+        Iterate over a cursor (or any iterable), counting documents and timing the wait for each of them
+        """
+        iterator = iter(cursor)
+        perf_counter = time.perf_counter
+        while True:
+            wait_start = perf_counter()
+            try:
+                doc = next(iterator)
+            except StopIteration:
+                self.timers['cursor_wait'] += perf_counter() - wait_start
+                return
+            now = perf_counter()
+            self.timers['cursor_wait'] += now - wait_start
+            self.counters[counter] += 1
+            if now - self.last_report_time >= self.instrument.report_interval:
+                self.report()
+            yield doc
+
+    def wrap_sink(self, sink):
+        """
+        :param sink: sink obj (see sinks.py)
+        :return: sink obj counting and timing writes into sink
+        """
+        return InstrumentedSink(sink, self)
+
+    def snapshot(self, done=False):
+        elapsed = time.perf_counter() - self.start_time
+        timers = dict(self.timers)
+        timers['compute'] = max(elapsed - timers.get('cursor_wait', 0.0) - timers.get('write', 0.0), 0.0)
+        return {'procedure': self.instrument.procedure_name, 'batch_i': self.batch_i, 'process_n': self.process_n,
+                'pid': os.getpid(), 'elapsed': elapsed, 'counters': dict(self.counters), 'timers': timers, 'done': done}
+
+    def report(self, done=False):
+        """
+        Send a snapshot to the parent (if there is a queue)
+        """
+        self.last_report_time = time.perf_counter()
+        snapshot = self.snapshot(done)
+        if done and self.profiler is not None:
+            self.profiler.stop()
+            snapshot['profile'] = self.profiler.top()
+        if self.instrument.stats_queue is not None:
+            self.instrument.stats_queue.put(snapshot)
+        return snapshot
+
+    def finish(self):
+        """
+        Send the final snapshot, and print a one line summary
+        """
+        snapshot = self.report(done=True)
+        timers = snapshot['timers']
+        print('Process{}/{} {}: read {} docs, wrote {} docs in {:.1f}s ({:.0f} docs/s; cursor wait {:.1f}s, compute {:.1f}s, write {:.1f}s)'.format(
+            self.batch_i, self.process_n, self.instrument.procedure_name, snapshot['counters'].get('docs_read', 0),
+            snapshot['counters'].get('docs_written', 0), snapshot['elapsed'],
+            snapshot['counters'].get('docs_read', 0) / max(snapshot['elapsed'], 1e-9),
+            timers.get('cursor_wait', 0.0), timers['compute'], timers.get('write', 0.0)))
+        return snapshot
+
+
+class NullStats(object):
+    """
+    Stand-in for WorkerStats when a worker runs without an Instrument: no counting, no timing
+    """
+
+    def add(self, name, n=1):
+        pass
+
+    def iter_docs(self, cursor, counter='docs_read'):
+        return cursor
+
+    def wrap_sink(self, sink):
+        return sink
+
+    def finish(self):
+        return None
+
+
+class InstrumentedSink(object):
+    """
+    Sink obj counting documents and bytes written into another sink, and timing writes and commits
+    """
+
+    def __init__(self, sink, stats):
+        self.sink = sink
+        self.stats = stats
+
+    def write(self, doc):
+        start = time.perf_counter()
+        self.sink.write(doc)
+        self.stats.timers['write'] += time.perf_counter() - start
+        self.stats.counters['docs_written'] += 1
+
+    def commit(self, range_i=None):
+        start = time.perf_counter()
+        self.sink.commit(range_i)
+        self.stats.timers['write'] += time.perf_counter() - start
+
+    def close(self):
+        start = time.perf_counter()
+        self.sink.close()
+        self.stats.timers['write'] += time.perf_counter() - start
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # the wrapped sink decides how to close when leaving on an exception
+        start = time.perf_counter()
+        self.sink.__exit__(exc_type, exc_value, traceback)
+        self.stats.timers['write'] += time.perf_counter() - start
+
+
+def instrumented(worker):
+    """
+    Decorator of worker functions: stops the sampling profilers the worker started (see WorkerStats) once it returns
+    or raises, so that a failed worker does not leave SIGPROF firing in its (e.g. warm pool) process
+    """
+    @functools.wraps(worker)
+    def wrapper(*args, **kwargs):
+        try:
+            return worker(*args, **kwargs)
+        finally:
+            for profiler in list(running_profilers):
+                profiler.stop()
+    return wrapper
+
+
+def is_running(job):
+    """
+    :param job: multiprocessing.Process obj, or AsyncResult obj of a pool task
+    :return: bool value indicates whether the job is still running
+    """
+    if hasattr(job, 'is_alive'):
+        return job.is_alive()
+    return not job.ready()
+
+
+def start(instrument, batch_i, process_n):
+    """
+    Get the stats of a worker process
+
+    :param instrument: Instrument obj, or None for no instrumentation
+    :param batch_i: the index of this batch
+    :param process_n: the total number of processes
+    :return: WorkerStats obj, or NullStats obj
+    """
+    if instrument is None:
+        return NullStats()
+    return instrument.start(batch_i, process_n)
+
+
+class Instrument(object):
+    """
+    Instrumentation of one run of a multiprocessing procedure, created in the parent and passed to the workers
+    """
+
+    def __init__(self, procedure_name, total_docs_n=None, report_interval=5.0, profile_file=None,
+                 profile=False, profile_interval=0.005, manager=None):
+        """
+        :param procedure_name: the name of the procedure
+        :param total_docs_n: number of documents the procedure reads in total, for the ETA; None if unknown
+        :param report_interval: seconds between snapshots sent by each process
+        :param profile_file: the JSON file the final profile is written into, None to not write it
+        :param profile: bool value indicates whether to run the sampling profiler in each process
+        :param profile_interval: sampling interval of the profiler, in seconds of CPU time
+        :param manager: multiprocessing.Manager obj to create the stats queue with, so that the instrument can be
+                        passed to pool tasks; None for a plain multiprocessing.Queue passed to new processes
+        """
+        self.procedure_name = procedure_name
+        self.total_docs_n = total_docs_n
+        self.report_interval = report_interval
+        self.profile_file = profile_file
+        self.profile = profile
+        self.profile_interval = profile_interval
+        self.stats_queue = manager.Queue() if manager is not None else multiprocessing.Queue()
+
+    def __getstate__(self):
+        # a plain queue can only be inherited by new processes, fail early with a clear error instead of in the pool
+        if (isinstance(self.stats_queue, multiprocessing.queues.Queue)
+                and multiprocessing.context.get_spawning_popen() is None):
+            raise RuntimeError('Instrument {} can only be passed to new processes; create it with '
+                               'manager=multiprocessing.Manager() to pass it to pool tasks'.format(self.procedure_name))
+        return self.__dict__
+
+    def start(self, batch_i, process_n):
+        """
+        Start the stats of a worker process (called in the worker)
+        """
+        return WorkerStats(self, batch_i, process_n)
+
+    def summarize(self, snapshots, elapsed):
+        """
+        Aggregate the latest snapshot of each process
+
+        :param snapshots: dict of batch_i -> latest snapshot
+        :param elapsed: seconds since the procedure started
+        :return: summary dict
+        """
+        counters = collections.Counter()
+        timers = collections.Counter()
+        for snapshot in snapshots.values():
+            counters.update(snapshot['counters'])
+            timers.update(snapshot['timers'])
+        docs_read = counters.get('docs_read', 0)
+        rate = docs_read / max(elapsed, 1e-9)
+        eta = None
+        if self.total_docs_n and rate > 0:
+            eta = max(self.total_docs_n - docs_read, 0) / rate
+        # slowest process by its own throughput, among those still running
+        running = [s for s in snapshots.values() if not s['done']]
+        straggler = min(running, key=lambda s: s['counters'].get('docs_read', 0) / max(s['elapsed'], 1e-9),
+                        default=None)
+        timers_sum = sum(timers.values())
+        return {'elapsed': elapsed, 'counters': dict(counters), 'docs_per_sec': rate, 'eta': eta,
+                'time_shares': {name: value / timers_sum for name, value in timers.items()} if timers_sum else {},
+                'straggler': straggler['batch_i'] if straggler else None,
+                'processes_done': len(snapshots) - len(running)}
+
+    def print_summary(self, summary, process_n):
+        shares = summary['time_shares']
+        print('{}: {} docs read, {:.0f} docs/s, {}/{} processes done, ETA {}, time: cursor wait {:.0%} / compute {:.0%} / write {:.0%}{}'.format(
+            self.procedure_name, summary['counters'].get('docs_read', 0), summary['docs_per_sec'],
+            summary['processes_done'], process_n,
+            '{:.0f}s'.format(summary['eta']) if summary['eta'] is not None else '?',
+            shares.get('cursor_wait', 0.0), shares.get('compute', 0.0), shares.get('write', 0.0),
+            ', straggler: Process{}'.format(summary['straggler']) if summary['straggler'] is not None else ''))
+
+    def monitor(self, jobs, print_interval=None):
+        """
+        Collect snapshots from the worker processes and print progress until all of them are done,
+        then write the profile (called in the parent after starting the jobs)
+
+        :param jobs: a list of started multiprocessing.Process objs, or AsyncResult objs of pool tasks
+        :param print_interval: seconds between progress lines, report_interval by default
+        :return: profile dict
+        """
+        print_interval = print_interval or self.report_interval
+        start_time = time.perf_counter()
+        last_print_time = start_time
+        snapshots = {}
+        done_n = 0
+        while done_n < len(jobs):
+            try:
+                snapshot = self.stats_queue.get(timeout=print_interval)
+                snapshots[snapshot['batch_i']] = snapshot
+                done_n += snapshot['done']
+            except queue.Empty:
+                if not any(is_running(job) for job in jobs): # processes died without a final snapshot
+                    break
+            if time.perf_counter() - last_print_time >= print_interval:
+                last_print_time = time.perf_counter()
+                self.print_summary(self.summarize(snapshots, last_print_time - start_time), len(jobs))
+
+        summary = self.summarize(snapshots, time.perf_counter() - start_time)
+        self.print_summary(summary, len(jobs))
+        process_seconds = [snapshot['elapsed'] for snapshot in snapshots.values()]
+        summary['skew'] = max(process_seconds) / (sum(process_seconds) / len(process_seconds)) if process_seconds else None
+        profile = {'procedure': self.procedure_name, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'process_n': len(jobs), 'total_docs_n': self.total_docs_n, 'summary': summary,
+                   'processes': [snapshots[batch_i] for batch_i in sorted(snapshots)]}
+        if self.profile_file:
+            with open(self.profile_file, 'w') as f:
+                json.dump(profile, f, indent=2)
+            print('Profile written to {}'.format(self.profile_file))
+        return profile
@@ -0,0 +1,273 @@
+"""
+Multi-keyword matcher for tagging tweets/descriptions against a list of keywords
+
+This is an API cleanup rather than a speedup: one place for the matching semantics (ignore case, word boundaries,
+case sensitive keywords), keyword bitmasks, and matchers compiled once per process. Compared to calling
+utilities.simple_test_keyword_in_text for each keyword, tag()/mask() are about twice as fast, only because each text
+is lowercased once; code lowercasing once inline is as fast (see benchmark). test() on many keywords is faster,
+as it runs one compiled alternation.
+"""
+
+import random
+import re
+import time
+
+import utilities
+from config import * # import all global config variables
+
+
+# smallest number of keywords for which test() runs one compiled alternation instead of a substring test per keyword
+MIN_ALTERNATION_KWS = 4
+
+
+def compile_keyword_pattern(kws_lst, word_boundary=False):
+    """
+    Compile one regex alternation of keywords, optionally only matching when not glued to other word characters
+    (a word character is alphanumeric or underscore, same as str.isalnum() or '_')
+
+    :param kws_lst: a non-empty list of keywords, already lowercased if matching ignores case
+    :param word_boundary: bool value indicates whether keywords have to match on word boundaries
+    :return: compiled regex obj
+    """
+    pattern = '|'.join(re.escape(kw) for kw in sorted(kws_lst, key=len, reverse=True))
+    if word_boundary:
+        pattern = r'(?<!\w)(?:{})(?!\w)'.format(pattern)
+    return re.compile(pattern)
+
+
+class KeywordsMatcher(object):
+    """
+    Match a list of keywords against texts.
+    Texts are lowercased once per text (instead of once per keyword), then each keyword is tested with the
+    builtin substring test, which runs in C; test() runs one compiled alternation of all keywords instead
+    when there are at least MIN_ALTERNATION_KWS of them.
+
+    By default a keyword hits if it appears anywhere in the text ignoring case,
+    the same as utilities.simple_test_keyword_in_text.
+    With word_boundary=True, a keyword only hits when it is not glued to other word characters,
+    e.g. 'ibm' hits 'IBM Watson' and '#ibm' but not 'iloveibmhahaha';
+    hashtag keywords like '#AI' hit '#AI' and '#ai!' but not '#AIR' or 'x#AI'.
+    Keywords in case_sensitive_kws are matched on the original text without ignoring case.
+    """
+
+    def __init__(self, kws_lst, ignore_case=True, word_boundary=False, case_sensitive_kws=None):
+        """
+        :param kws_lst: a list of keywords
+        :param ignore_case: bool value indicates whether to ignore case for both texts and keywords
+        :param word_boundary: bool value indicates whether keywords have to match on word boundaries
+        :param case_sensitive_kws: keywords (in kws_lst) always matched case sensitively
+        """
+        self.kws_lst = list(kws_lst)
+        self.ignore_case = ignore_case
+        self.word_boundary = word_boundary
+
+        case_sensitive_kws = set(case_sensitive_kws or [])
+        if not ignore_case:
+            case_sensitive_kws = set(self.kws_lst)
+
+        # (keyword index, keyword, word boundary pattern or None) of keywords matched on lowercased text
+        # and on original text; empty keywords never match, same as utilities.simple_test_keyword_in_text
+        lower_kws = []
+        exact_kws = []
+        for kw_ind, kw in enumerate(self.kws_lst):
+            if not kw:
+                continue
+            if kw in case_sensitive_kws:
+                exact_kws.append((kw_ind, kw))
+            else:
+                lower_kws.append((kw_ind, kw.lower()))
+        self._lower_kws = self._compile_kws(lower_kws)
+        self._exact_kws = self._compile_kws(exact_kws)
+        self._lower_any_re = self._compile_any(lower_kws)
+        self._exact_any_re = self._compile_any(exact_kws)
+
+    def _compile_kws(self, kws):
+        """
+        Attach a word boundary pattern to each (keyword index, keyword) pair when matching on word boundaries
+        """
+        boundary_res = {}
+        if self.word_boundary:
+            boundary_res = {kw: compile_keyword_pattern([kw], word_boundary=True) for _, kw in kws}
+        return [(kw_ind, kw, boundary_res.get(kw)) for kw_ind, kw in kws]
+
+    def _compile_any(self, kws):
+        """
+        One alternation of all keywords for test(), None when there are too few keywords to pay off
+        """
+        if len(kws) < MIN_ALTERNATION_KWS:
+            return None
+        return compile_keyword_pattern([kw for _, kw in kws], word_boundary=self.word_boundary)
+
+    @staticmethod
+    def _find(kws, text, hits):
+        """
+        Add indices of keywords (see _compile_kws) appearing in text into hits set
+        """
+        for kw_ind, kw, boundary_re in kws:
+            if kw in text and (boundary_re is None or boundary_re.search(text) is not None):
+                hits.add(kw_ind)
+        return hits
+
+    @staticmethod
+    def _any(kws, any_re, text):
+        """
+        Test whether any of the keywords (see _compile_kws) appears in text
+        """
+        if any_re is not None:
+            return any_re.search(text) is not None
+        for _, kw, boundary_re in kws:
+            if kw in text and (boundary_re is None or boundary_re.search(text) is not None):
+                return True
+        return False
+
+    def find_all(self, text):
+        """
+        Find all keywords appearing in text
+
+        :param text: string to be tested on
+        :return: set of indices (in kws_lst) of hit keywords
+        """
+        hits = set()
+        if not text:
+            return hits
+        if self._lower_kws:
+            self._find(self._lower_kws, text.lower(), hits)
+        if self._exact_kws:
+            self._find(self._exact_kws, text, hits)
+        return hits
+
+    def tag(self, text):
+        """
+        Tag whether each keyword appears in text
+
+        :param text: string to be tested on
+        :return: a list of bool values, one for each keyword in kws_lst
+        """
+        res = [False] * len(self.kws_lst)
+        for kw_ind in self.find_all(text):
+            res[kw_ind] = True
+        return res
+
+    def mask(self, text):
+        """
+        Tag whether each keyword appears in text, packed into an int: bit i is set if kws_lst[i] appears
+
+        :param text: string to be tested on
+        :return: int bitmask
+        """
+        res = 0
+        for kw_ind in self.find_all(text):
+            res |= 1 << kw_ind
+        return res
+
+    def test(self, text):
+        """
+        Test whether any of the keywords appears in text
+
+        :param text: string to be tested on
+        :return: bool value
+        """
+        if not text:
+            return False
+        if self._lower_kws and self._any(self._lower_kws, self._lower_any_re, text.lower()):
+            return True
+        return bool(self._exact_kws) and self._any(self._exact_kws, self._exact_any_re, text)
+
+
+# compiled matchers of this process, see get_matcher
+matchers = {}
+
+
+def get_matcher(kws_lst, **matcher_options):
+    """
+    Get the compiled matcher of this process for a list of keywords and options, compiling it on first use,
+    so that stages run many times in the same (warm) process compile their keywords once (see worker_pool.py)
+
+    :param kws_lst: a list of keywords
+    :param matcher_options: see KeywordsMatcher
+    :return: KeywordsMatcher obj
+    """
+    matcher_key = (tuple(kws_lst), tuple(sorted((key, repr(value)) for key, value in matcher_options.items())))
+    matcher = matchers.get(matcher_key)
+    if matcher is None:
+        matcher = KeywordsMatcher(kws_lst, **matcher_options)
+        matchers[matcher_key] = matcher
+    return matcher
+
+
+def benchmark(kws_lst, texts_lst, repeat=3):
+    """
+    Compare KeywordsMatcher against calling utilities.simple_test_keyword_in_text for each keyword on each text,
+    and against lowercasing each text once and testing 'kw in text' for each keyword inline
+
+    :param kws_lst: a list of keywords
+    :param texts_lst: a list of texts
+    :param repeat: number of timing runs, the best one is reported
+    :return: dict of best running time (in seconds) of each approach and the speedups of the matcher
+    """
+    matcher = KeywordsMatcher(kws_lst)
+    lower_kws_lst = [kw.lower() for kw in kws_lst]
+
+    def run_loop():
+        return [[utilities.simple_test_keyword_in_text(text=text, keyword=kw) for kw in kws_lst] for text in texts_lst]
+
+    def run_lowercase_once():
+        res = []
+        for text in texts_lst:
+            lowered = text.lower()
+            res.append([bool(kw) and kw in lowered for kw in lower_kws_lst])
+        return res
+
+    def run_matcher():
+        return [matcher.tag(text) for text in texts_lst]
+
+    def run_matcher_test():
+        return [matcher.test(text) for text in texts_lst]
+
+    loop_res = run_loop()
+    assert loop_res == run_lowercase_once() == run_matcher(), \
+        'KeywordsMatcher results differ from simple_test_keyword_in_text'
+    assert [any(tags) for tags in loop_res] == run_matcher_test(), \
+        'KeywordsMatcher.test results differ from simple_test_keyword_in_text'
+
+    res = {}
+    for name, run in [('loop', run_loop), ('lowercase_once', run_lowercase_once), ('matcher', run_matcher),
+                      ('matcher_test', run_matcher_test)]:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+        res[name] = min(timings)
+    res['speedup'] = res['loop'] / res['matcher']
+    res['speedup_lowercase_once'] = res['lowercase_once'] / res['matcher']
+    return res
+
+
+if __name__ == '__main__':
+    '''
+    Benchmark on synthetic tweets mixing API query keywords with common words
+    '''
+    random.seed(0)
+    vocab = ['the', 'a', 'of', 'new', 'is', 'great', 'today', 'http://t.co/xyz', '@user', 'RT', 'ibm', '#IBM', 'IBMer',
+             'cloud', 'data', 'learning', 'watson', 'AI', 'Big', 'Data', 'machine'] + API_QUERY_KWS
+    texts_lst = [' '.join(random.choice(vocab) for _ in range(random.randint(5, 25))) for _ in range(20000)]
+
+    res = benchmark(API_QUERY_KWS, texts_lst)
+    print('{} texts x {} keywords'.format(len(texts_lst), len(API_QUERY_KWS)))
+    print('simple_test_keyword_in_text loop: {:.3f}s'.format(res['loop']))
+    print('lowercase once + kw in text: {:.3f}s'.format(res['lowercase_once']))
+    print('KeywordsMatcher.tag: {:.3f}s ({:.1f}x loop, {:.2f}x lowercase once)'.format(
+        res['matcher'], res['speedup'], res['speedup_lowercase_once']))
+    print('KeywordsMatcher.test: {:.3f}s'.format(res['matcher_test']))
+
+    descs_lst = [' '.join(random.choice(vocab[:10] + ['IBM', 'research']) for _ in range(random.randint(3, 15)))
+                 for _ in range(50000)]
+    res = benchmark(['ibm'], descs_lst)
+    print('{} descriptions x 1 keyword'.format(len(descs_lst)))
+    print('simple_test_keyword_in_text loop: {:.3f}s, lowercase once: {:.3f}s, KeywordsMatcher.tag: {:.3f}s, '
+          'KeywordsMatcher.test: {:.3f}s'.format(res['loop'], res['lowercase_once'], res['matcher'], res['matcher_test']))
+
+    matcher = KeywordsMatcher(['ibm', '#AI'], word_boundary=True)
+    for test_text in ['test on IBM', 'test on iloveibmhahaha', 'this is a test on #Ibm tag', '#AIR and #ai!']:
+        print('"{}": {}'.format(test_text, matcher.tag(test_text)))
@@ -0,0 +1,345 @@
+"""
+Keyword bitmap index over tagged tweets, for boolean keyword queries without scanning the tag collections
+
+Built once from a collection written by multiprocessing_workers.worker_tag_kws_in_tw
+(e.g. TW_NT_TXT_IBM_TAG_COL, TW_RAW_TXT_KWS_TAG_COL). Tweets are numbered by dense ordinals in ascending order of ids:
+    tweet_ids:  ids of the tweets, sorted                                    (N)
+    user_inds:  index in users of the author of each tweet                   (N)
+    users:      sorted unique ids of the authors                             (U)
+    masks:      packed keyword bitmask of each tweet, bit i for kws_lst[i]   (N)
+plus one compressed (roaring) bitmap of ordinals per keyword. Counts and id lists of AND/OR/NOT combinations
+of keywords come from the bitmaps, per-user rollups from the masks, e.g.
+    index = kws_index.KeywordsIndex(os.path.join(KWS_INDEX_DIR, TW_NT_TXT_IBM_TAG_COL))
+    index.count(all_of=['ibm'])                 # instead of count({'X_0': True})
+    index.user_rollup(all_of=['ibm'])           # tweets_num and matched_num of each user
+"""
+
+import json
+import os
+
+import numpy as np
+
+import ids_store
+import mongodb
+import utilities
+from config import * # import all global config variables
+
+
+# keywords bitmasks are stored as int64 in MongoDB
+MAX_MASK_KWS = 63
+
+INDEX_ARRAYS = ['tweet_ids', 'user_inds', 'users', 'masks']
+
+# ordinals are split into containers of 2**16 values: the high bits are the key of the container,
+# the low bits are stored as a sorted uint16 array (sparse) or as 1024 uint64 words of bits (dense)
+CONTAINER_BITS = 16
+CONTAINER_SIZE = 1 << CONTAINER_BITS
+ARRAY_CONTAINER_MAX = 4096
+
+
+def popcount(words):
+    """
+    Number of set bits in an array of uint64 words
+    """
+    if hasattr(np, 'bitwise_count'):
+        return int(np.bitwise_count(words).sum())
+    return int(np.unpackbits(words.view(np.uint8)).sum())
+
+
+def array_to_words(arr):
+    """
+    Bitmap container (1024 uint64 words) of an array container
+    """
+    bits = np.zeros(CONTAINER_SIZE, dtype=bool)
+    bits[arr] = True
+    return np.packbits(bits, bitorder='little').view(np.uint64)
+
+
+def words_to_array(words):
+    """
+    Array container (sorted uint16) of a bitmap container
+    """
+    return np.flatnonzero(np.unpackbits(words.view(np.uint8), bitorder='little')).astype(np.uint16)
+
+
+def optimize_container(container):
+    """
+    Store a container as an array if it has at most ARRAY_CONTAINER_MAX values, otherwise as words
+    """
+    if container.dtype == np.uint16:
+        return array_to_words(container) if len(container) > ARRAY_CONTAINER_MAX else container
+    return words_to_array(container) if popcount(container) <= ARRAY_CONTAINER_MAX else container
+
+
+def container_len(container):
+    return len(container) if container.dtype == np.uint16 else popcount(container)
+
+
+class RoaringBitmap(object):
+    """
+    Compressed set of non-negative int ordinals, roaring layout: sorted container keys and one container per key
+    """
+
+    def __init__(self, keys=None, containers=None):
+        """
+        :param keys: a list of container keys (ordinal >> CONTAINER_BITS), ascending
+        :param containers: a list of containers (uint16 arrays or uint64 words), non-empty
+        """
+        self.keys = list(keys or [])
+        self.containers = list(containers or [])
+
+    @classmethod
+    def from_ordinals(cls, ordinals):
+        """
+        :param ordinals: NumPy int array of sorted unique ordinals
+        """
+        ordinals = np.asarray(ordinals, dtype=np.int64)
+        high = ordinals >> CONTAINER_BITS
+        starts = np.flatnonzero(np.r_[True, high[1:] != high[:-1]]) if len(ordinals) else np.zeros(0, dtype=np.int64)
+        ends = np.append(starts[1:], len(ordinals))
+        keys = high[starts].tolist()
+        containers = [optimize_container((ordinals[s_ind: e_ind] & (CONTAINER_SIZE - 1)).astype(np.uint16))
+                      for s_ind, e_ind in zip(starts, ends)]
+        return cls(keys, containers)
+
+    @classmethod
+    def from_range(cls, ordinals_n):
+        """
+        Bitmap of all ordinals from 0 to ordinals_n - 1
+        """
+        return cls.from_ordinals(np.arange(ordinals_n, dtype=np.int64))
+
+    def to_ordinals(self):
+        """
+        :return: NumPy int64 array of the sorted ordinals
+        """
+        if not self.keys:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([(key << CONTAINER_BITS) + (container if container.dtype == np.uint16
+                                                          else words_to_array(container)).astype(np.int64)
+                               for key, container in zip(self.keys, self.containers)])
+
+    def __len__(self):
+        return sum(container_len(container) for container in self.containers)
+
+    @property
+    def nbytes(self):
+        return sum(container.nbytes for container in self.containers)
+
+    def _combine(self, other, op):
+        containers_a = dict(zip(self.keys, self.containers))
+        containers_b = dict(zip(other.keys, other.containers))
+        keys, containers = [], []
+        for key in sorted(set(containers_a) | set(containers_b)):
+            a, b = containers_a.get(key), containers_b.get(key)
+            if a is None or b is None:
+                if op == 'and' or (op == 'andnot' and a is None):
+                    continue
+                container = a if a is not None else b
+            elif a.dtype == np.uint16 and b.dtype == np.uint16:
+                if op == 'and':
+                    container = np.intersect1d(a, b, assume_unique=True)
+                elif op == 'or':
+                    container = optimize_container(np.union1d(a, b))
+                else:
+                    container = np.setdiff1d(a, b, assume_unique=True)
+            elif op != 'or' and a.dtype == np.uint16:
+                # keep the values of the array whose bits are set (and) or not set (andnot) in the words
+                in_b = ((b[a >> 6] >> (a & 63).astype(np.uint64)) & np.uint64(1)).astype(bool)
+                container = a[in_b] if op == 'and' else a[~in_b]
+            elif op == 'and' and b.dtype == np.uint16:
+                container = b[((a[b >> 6] >> (b & 63).astype(np.uint64)) & np.uint64(1)).astype(bool)]
+            else:
+                words_a = a if a.dtype == np.uint64 else array_to_words(a)
+                words_b = b if b.dtype == np.uint64 else array_to_words(b)
+                if op == 'and':
+                    container = optimize_container(words_a & words_b)
+                elif op == 'or':
+                    container = words_a | words_b
+                else:
+                    container = optimize_container(words_a & ~words_b)
+            if container_len(container):
+                keys.append(key)
+                containers.append(container)
+        return RoaringBitmap(keys, containers)
+
+    def __and__(self, other):
+        return self._combine(other, 'and')
+
+    def __or__(self, other):
+        return self._combine(other, 'or')
+
+    def __sub__(self, other):
+        return self._combine(other, 'andnot')
+
+    def to_arrays(self):
+        """
+        :return: dict of NumPy arrays to save: keys, is_words flags, offsets into data, data (all containers as uint16)
+        """
+        data_lst = [container.view(np.uint16) for container in self.containers]
+        lengths = [len(data) for data in data_lst]
+        return {'keys': np.array(self.keys, dtype=np.int64),
+                'is_words': np.array([container.dtype == np.uint64 for container in self.containers], dtype=bool),
+                'offsets': np.r_[0, np.cumsum(lengths)].astype(np.int64),
+                'data': np.concatenate(data_lst) if data_lst else np.zeros(0, dtype=np.uint16)}
+
+    @classmethod
+    def from_arrays(cls, keys, is_words, offsets, data):
+        containers = []
+        for ind, words in enumerate(is_words):
+            container = np.asarray(data[offsets[ind]: offsets[ind + 1]])
+            containers.append(container.view(np.uint64) if words else container)
+        return cls(keys.tolist(), containers)
+
+
+def build_kws_index(kws_lst, db_name=DB_NAME, collection_name=TW_NT_TXT_IBM_TAG_COL, index_dir=None, chunk_size=100000):
+    """
+    Build the keyword index of a tag collection and save it into index_dir.
+    Reads the 'kws_mask' field, or the 'X_<i>' fields of collections tagged before the masks.
+
+    :param kws_lst: the list of keywords the collection was tagged with, in the same order
+    :param db_name: the name of the MongoDB database
+    :param collection_name: the name of the tag collection
+    :param index_dir: directory of the index files, os.path.join(KWS_INDEX_DIR, collection_name) by default
+    :param chunk_size: number of documents per chunk
+    :return: KeywordsIndex obj (memory-mapped)
+    """
+    if len(kws_lst) > MAX_MASK_KWS:
+        raise ValueError('At most {} keywords per index, got {}'.format(MAX_MASK_KWS, len(kws_lst)))
+    index_dir = index_dir or os.path.join(KWS_INDEX_DIR, collection_name)
+    collection = mongodb.initialize(db_name=db_name, collection_name=collection_name)
+    tag_fields_lst = ['X_' + str(ind) for ind in range(len(kws_lst))]
+    projection = {'_id': 0, 'id': 1, 'user_id': 1, 'kws_mask': 1}
+    projection.update((field, 1) for field in tag_fields_lst)
+    cursor = collection.find(projection=projection)
+    if mongodb.CURSOR_BATCH_SIZE:
+        cursor = cursor.batch_size(mongodb.CURSOR_BATCH_SIZE)
+
+    tweet_ids_lst, user_ids_lst, masks_lst = [], [], []
+    for docs_lst in utilities.iter_chunks(cursor, chunk_size):
+        tweet_ids_lst.append(np.array([doc['id'] for doc in docs_lst], dtype=np.int64))
+        user_ids_lst.append(np.array([doc['user_id'] for doc in docs_lst], dtype=np.int64))
+        masks_lst.append(np.array([doc['kws_mask'] if 'kws_mask' in doc else
+                                   sum(1 << ind for ind, field in enumerate(tag_fields_lst) if doc.get(field))
+                                   for doc in docs_lst], dtype=np.int64))
+    if tweet_ids_lst:
+        tweet_ids, user_ids, masks = [np.concatenate(arrs) for arrs in [tweet_ids_lst, user_ids_lst, masks_lst]]
+    else:
+        tweet_ids = user_ids = masks = np.zeros(0, dtype=np.int64)
+    print('Read {} tagged tweets from {}.{}'.format(len(tweet_ids), db_name, collection_name))
+
+    order = np.argsort(tweet_ids, kind='stable')
+    tweet_ids, user_ids, masks = tweet_ids[order], user_ids[order], masks[order]
+    users, user_inds = np.unique(user_ids, return_inverse=True)
+    arrays = {'tweet_ids': tweet_ids, 'user_inds': user_inds.astype(np.int64), 'users': users, 'masks': masks}
+
+    if not os.path.exists(index_dir):
+        os.makedirs(index_dir)
+    for name, arr in arrays.items():
+        np.save(os.path.join(index_dir, name + '.npy'), arr)
+    bitmaps_arrays = {}
+    for kw_ind in range(len(kws_lst)):
+        bitmap = RoaringBitmap.from_ordinals(np.flatnonzero((masks >> kw_ind) & 1))
+        bitmaps_arrays.update(('{}_{}'.format(name, kw_ind), arr) for name, arr in bitmap.to_arrays().items())
+    np.savez(os.path.join(index_dir, 'bitmaps.npz'), **bitmaps_arrays)
+    with open(os.path.join(index_dir, 'kws.json'), 'w') as f:
+        json.dump(list(kws_lst), f)
+    print('Saved keyword index of {} tweets, {} users, {} keywords to {}'.format(len(tweet_ids), len(users),
+                                                                                 len(kws_lst), index_dir))
+    return KeywordsIndex(index_dir)
+
+
+class KeywordsIndex(object):
+    """
+    Read-only keyword index, see build_kws_index.
+    Queries take keywords (or their indices in kws_lst) in all_of (AND), any_of (OR) and none_of (NOT),
+    e.g. all_of=['ibm'], none_of=['#AI'] for tweets with 'ibm' but not '#AI'.
+    """
+
+    def __init__(self, index_dir, mmap=True):
+        """
+        :param index_dir: directory of the index files
+        :param mmap: bool value indicates whether to memory-map the arrays instead of reading them into memory
+        """
+        self.index_dir = index_dir
+        for name in INDEX_ARRAYS:
+            setattr(self, name, np.load(os.path.join(index_dir, name + '.npy'), mmap_mode='r' if mmap else None))
+        with open(os.path.join(index_dir, 'kws.json')) as f:
+            self.kws_lst = json.load(f)
+        with np.load(os.path.join(index_dir, 'bitmaps.npz')) as arrays:
+            self.bitmaps = [RoaringBitmap.from_arrays(*[arrays['{}_{}'.format(name, kw_ind)] for name in
+                                                        ['keys', 'is_words', 'offsets', 'data']])
+                            for kw_ind in range(len(self.kws_lst))]
+
+    def __len__(self):
+        return len(self.tweet_ids)
+
+    def kw_ind(self, kw):
+        """
+        :param kw: a keyword of kws_lst, or its index
+        :return: index of the keyword
+        """
+        return kw if isinstance(kw, int) else self.kws_lst.index(kw)
+
+    def select(self, all_of=(), any_of=(), none_of=()):
+        """
+        :return: RoaringBitmap obj of the ordinals of the matched tweets
+        """
+        bitmap = None
+        for kw in all_of:
+            bitmap = self.bitmaps[self.kw_ind(kw)] if bitmap is None else bitmap & self.bitmaps[self.kw_ind(kw)]
+        if any_of:
+            any_bitmap = RoaringBitmap()
+            for kw in any_of:
+                any_bitmap = any_bitmap | self.bitmaps[self.kw_ind(kw)]
+            bitmap = any_bitmap if bitmap is None else bitmap & any_bitmap
+        if bitmap is None:
+            bitmap = RoaringBitmap.from_range(len(self))
+        for kw in none_of:
+            bitmap = bitmap - self.bitmaps[self.kw_ind(kw)]
+        return bitmap
+
+    def count(self, all_of=(), any_of=(), none_of=()):
+        """
+        :return: number of matched tweets
+        """
+        return len(self.select(all_of, any_of, none_of))
+
+    def ids(self, all_of=(), any_of=(), none_of=()):
+        """
+        :return: NumPy int64 array of the sorted ids of the matched tweets
+        """
+        return np.asarray(self.tweet_ids[self.select(all_of, any_of, none_of).to_ordinals()])
+
+    def match_masks(self, all_of=(), any_of=(), none_of=()):
+        """
+        Vectorized test of the query on the bitmask of every tweet
+
+        :return: NumPy bool array, one value per ordinal
+        """
+        bits = lambda kws: sum(1 << self.kw_ind(kw) for kw in kws)
+        all_bits, any_bits, none_bits = bits(all_of), bits(any_of), bits(none_of)
+        masks = np.asarray(self.masks)
+        matched = (masks & all_bits) == all_bits
+        if any_bits:
+            matched &= (masks & any_bits) != 0
+        if none_bits:
+            matched &= (masks & none_bits) == 0
+        return matched
+
+    def user_rollup(self, all_of=(), any_of=(), none_of=(), user_ids=None):
+        """
+        Per user, number of tweets and number of matched tweets
+
+        :param user_ids: array-like of user ids to keep, None for all users
+        :return: pandas dataframe with columns user_id, tweets_num, matched_num
+        """
+        import pandas as pd # imported on first use, so that worker processes importing this module do not load it
+        user_inds = np.asarray(self.user_inds)
+        tweets_num = np.bincount(user_inds, minlength=len(self.users))
+        matched_num = np.bincount(user_inds, weights=self.match_masks(all_of, any_of, none_of),
+                                  minlength=len(self.users)).astype(np.int64)
+        df = pd.DataFrame({'user_id': np.asarray(self.users), 'tweets_num': tweets_num, 'matched_num': matched_num})
+        if user_ids is not None:
+            df = df[ids_store.isin(ids_store.to_ids_array(user_ids), df['user_id'].values)]
+        return df
@@ -2,22 +2,178 @@
 Get connection to (local) MongoDB database
 """
 
+import atexit
+import os
+import threading
+
 import pymongo
 from pymongo import MongoClient
 from pymongo import errors
 
 
-def initialize(db_name: object, collection_name: object, host: object = 'localhost', port: object = 27017) -> object:
+# default settings of pooled clients, None means the pymongo default; change them with configure()
+CLIENT_SETTINGS = {'maxPoolSize': None, # max number of connections per client (i.e. per process)
+                   'readPreference': None, # e.g. 'secondaryPreferred' to spread reads on a replica set
+                   'compressors': None} # e.g. 'zstd,zlib' to compress traffic with the server
+
+# number of documents per cursor batch used by the workers, None means the server default
+CURSOR_BATCH_SIZE = None
+
+# function creating the clients, MongoClient unless changed with set_client_factory()
+client_factory = MongoClient
+
+# one pooled client per (host, port, options) in each process, rebuilt after fork
+clients = {}
+clients_pid = os.getpid()
+clients_lock = threading.Lock()
+
+
+def configure(max_pool_size=None, read_preference=None, compressors=None, batch_size=None):
+    """
+    Change the settings of clients created from now on, and the cursor batch size used by the workers
+    
+    :param max_pool_size: max number of connections per client
+    :param read_preference: read preference mode name, e.g. 'secondaryPreferred'
+    :param compressors: comma separated compressors, e.g. 'zstd,zlib'
+    :param batch_size: number of documents per cursor batch
+    """
+    global CURSOR_BATCH_SIZE
+    if max_pool_size is not None:
+        CLIENT_SETTINGS['maxPoolSize'] = max_pool_size
+    if read_preference is not None:
+        CLIENT_SETTINGS['readPreference'] = read_preference
+    if compressors is not None:
+        CLIENT_SETTINGS['compressors'] = compressors
+    if batch_size is not None:
+        CURSOR_BATCH_SIZE = batch_size
+
+
+def reset_clients_after_fork():
+    """
+    Forget clients inherited from the parent process: MongoClient is not fork-safe,
+    so a child process has to create its own clients (see get_client)
+    """
+    global clients, clients_pid, clients_lock
+    clients = {}
+    clients_pid = os.getpid()
+    clients_lock = threading.Lock()
+
+
+def get_client(host='localhost', port=27017, **client_options):
+    """
+    Get the pooled client of this process for host, port and options, creating it on first use.
+    
+    :param host: MongoDB host
+    :param port: MongoDB port
+    :param client_options: extra MongoClient options, overriding CLIENT_SETTINGS
+    :return: MongoClient obj
+    """
+    if clients_pid != os.getpid(): # forked without going through os.register_at_fork hooks
+        reset_clients_after_fork()
+    
+    options = dict(CLIENT_SETTINGS)
+    options.update(client_options)
+    options = {key: value for key, value in options.items() if value is not None}
+    client_key = (host, port, tuple(sorted((key, repr(value)) for key, value in options.items())))
+    
+    with clients_lock:
+        client = clients.get(client_key)
+        if client is None:
+            client = client_factory(host, port, **options)
+            clients[client_key] = client
+    return client
+
+
+def close_clients():
+    """
+    Close all pooled clients created by this process
+    """
+    with clients_lock:
+        if clients_pid == os.getpid():
+            for client in clients.values():
+                client.close()
+        clients.clear()
+
+
+def set_client_factory(factory=None):
+    """
+    Create clients with another function from now on, e.g. to point all connections of the workers
+    to a throwaway server or to an in-process stand-in (see benchmarks.py). Closes the existing clients.
+    
+    :param factory: function taking (host, port, **options) and returning a client obj, None to restore MongoClient
+    """
+    global client_factory
+    close_clients()
+    client_factory = factory or MongoClient
+
+
+os.register_at_fork(after_in_child=reset_clients_after_fork)
+atexit.register(close_clients)
+
+
+# function creating asyncio clients, see get_async_client_factory() and set_async_client_factory()
+async_client_factory = None
+
+
+def get_async_client_factory():
+    """
+    Get the function creating asyncio clients: the one set with set_async_client_factory(),
+    otherwise pymongo.AsyncMongoClient (pymongo >= 4.10), otherwise motor's AsyncIOMotorClient
+    """
+    if async_client_factory is not None:
+        return async_client_factory
+    try:
+        from pymongo import AsyncMongoClient
+        return AsyncMongoClient
+    except ImportError:
+        pass
+    try:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        return AsyncIOMotorClient
+    except ImportError:
+        raise ImportError('An asyncio MongoDB driver is needed: pymongo >= 4.10 or motor')
+
+
+def get_async_client(host='localhost', port=27017, **client_options):
+    """
+    Create an asyncio client for host, port and options (see async_queries.py).
+    Asyncio clients are bound to the event loop they are used in, so they are not pooled: close them when done.
+
+    :param host: MongoDB host
+    :param port: MongoDB port
+    :param client_options: extra client options, overriding CLIENT_SETTINGS
+    :return: asyncio client obj
+    """
+    options = dict(CLIENT_SETTINGS)
+    options.update(client_options)
+    options = {key: value for key, value in options.items() if value is not None}
+    return get_async_client_factory()(host, port, **options)
+
+
+def set_async_client_factory(factory=None):
+    """
+    Create asyncio clients with another function from now on, e.g. an in-process stand-in
+
+    :param factory: function taking (host, port, **options) and returning an asyncio client obj, None for the default
+    """
+    global async_client_factory
+    async_client_factory = factory
+
+
+def initialize(db_name: object, collection_name: object, host: object = 'localhost', port: object = 27017,
+               **client_options) -> object:
     """
     Initialize connection to MongoDB database and get collection object
+    The connection comes from the pooled client of this process (see get_client).
     :param db_name:
     :param collection_name:
     :param host:
     :param port:
+    :param client_options: extra MongoClient options
     :return: collection obj
     """
     try:
-        client = MongoClient(host, port)
+        client = get_client(host, port, **client_options)
         db = client[db_name]
         collection = db[collection_name]
         print('MongoDB on {}:{}/{}.{} connected successfully!'.format(host, port, db_name, collection_name))
@@ -26,17 +182,19 @@ def initialize(db_name: object, collection_name: object, host: object = 'localho
         print('MongoDB on {}:{} connection failed: {}'.format(host, port, e))
 
         
-def initialize_db(db_name: object, host: object = 'localhost', port: object = 27017) -> object:
+def initialize_db(db_name: object, host: object = 'localhost', port: object = 27017, **client_options) -> object:
     """
     Initialize connection to MongoDB database and get database object
+    The connection comes from the pooled client of this process (see get_client).
     :param db_name:
     :param collection_name:
     :param host:
     :param port:
+    :param client_options: extra MongoClient options
     :return: db obj
     """
     try:
-        client = MongoClient(host, port)
+        client = get_client(host, port, **client_options)
         db = client[db_name]
         print('MongoDB on {}:{}/{} connected successfully!'.format(host, port, db_name))
         return db
@@ -44,6 +202,67 @@ def initialize_db(db_name: object, host: object = 'localhost', port: object = 27
         print('MongoDB on {}:{} connection failed: {}'.format(host, port, e))
 
 
+def gen_id_ranges(collection, ranges_n, sample_size=None, field='_id', filter=None):
+    """
+    Split a collection into contiguous '_id' (or any other field) ranges of (roughly) equal number of documents.
+    By default split points are computed exactly by a '$bucketAuto' aggregation over the field;
+    if sample_size is given, split points are estimated from a '$sample' of that many documents instead,
+    which is much cheaper on very large collections.
+    The first range has no lower bound and the last range has no upper bound,
+    so the ranges always cover the whole collection.
+    
+    :param collection: the collection obj to split
+    :param ranges_n: the (maximum) number of ranges to split into
+    :param sample_size: number of sampled documents to estimate split points from, None for exact split points
+    :param field: the field to split on, e.g. 'user.id'
+    :param filter: optional filter dict, only split the matched documents
+    :return: a list of (lower, upper) field bounds, lower inclusive and upper exclusive, None for unbounded
+    """
+    if ranges_n <= 1:
+        return [(None, None)]
+    
+    match_lst = [{'$match': filter}] if filter else []
+    if sample_size:
+        cursor = collection.aggregate(pipeline=match_lst + [{'$sample': {'size': sample_size}},
+                                                {'$project': {'_id': 0, 'key': '$' + field}}],
+                                      allowDiskUse=True)
+        sampled_ids = sorted(doc['key'] for doc in cursor)
+        if not sampled_ids: # empty (or fully filtered) collection, as with exact split points
+            return [(None, None)]
+        step = len(sampled_ids) / ranges_n
+        split_ids = [sampled_ids[int(step * range_i)] for range_i in range(1, ranges_n)]
+    else:
+        cursor = collection.aggregate(pipeline=match_lst + [{'$project': {'_id': 0, 'key': '$' + field}},
+                                                {'$bucketAuto': {'groupBy': '$key', 'buckets': ranges_n}}],
+                                      allowDiskUse=True)
+        split_ids = [doc['_id']['min'] for doc in cursor][1:] # lower bound of each bucket except the first one
+    
+    # drop duplicated split points (possible when sampling few documents)
+    split_ids = sorted(set(split_ids))
+    
+    bounds = [None] + split_ids + [None]
+    return [(bounds[ind], bounds[ind + 1]) for ind in range(len(bounds) - 1)]
+
+
+def gen_id_range_filter(id_range, field='_id'):
+    """
+    Generate query filter selecting documents within an '_id' (or any other field) range
+    
+    :param id_range: (lower, upper) field bounds as returned by gen_id_ranges(),
+                     or (lower, upper, upper_inclusive) to also include the upper bound (see checkpoints.py)
+    :param field: the field the range is on
+    :return: filter dict
+    """
+    lower, upper = id_range[:2]
+    upper_inclusive = len(id_range) > 2 and id_range[2]
+    id_cond = {}
+    if lower is not None:
+        id_cond['$gte'] = lower
+    if upper is not None:
+        id_cond['$lte' if upper_inclusive else '$lt'] = upper
+    return {field: id_cond} if id_cond else {}
+
+
 def test_connection():
     print('Test MongoDB connection successful!')
 
@@ -2,6 +2,7 @@
 Worker functions for multiprocessing.
 """
 
+import functools
 import json
 import multiprocessing
 import codecs
@@ -9,103 +10,244 @@ import sys
 import logging
 import time
 import pymongo
-import shelve
 import pickle
 import os
 import glob
-from textblob import TextBlob
 
+import numpy as np
+
+try:
+    import orjson # fast JSON decoder, optional
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+import async_queries
+import ids_store
+import instrumentation
+import keywords_matcher
 import mongodb
+import queries
+import rollup_cube
+import sentiment_cache
+import shared_ids
+import sinks
+import sketches
+import tweet_text
 import utilities
+from kws_index import MAX_MASK_KWS # only the constant, the index itself is not used by the workers
+
+
+# largest set of ids pushed to the server as '$in' filters, larger sets are tested by the workers
+MAX_IN_FILTER_IDS = 100000
+# maximum number of ids per '$in' query, see queries.find_in
+IN_FILTER_CHUNK_SIZE = 10000
+
+
+def check_id_ranges_queue(id_ranges_queue):
+    """
+    Fail as soon as a worker starts if it was given no queue of id ranges, rather than once it iterates over them
+    
+    :param id_ranges_queue: multiprocessing.Queue obj of (range index, (lower, upper)) items
+    """
+    if id_ranges_queue is None:
+        raise ValueError('No queue of id ranges given; split the collection in the parent with mongodb.gen_id_ranges '
+                         'and pass utilities.gen_id_ranges_queue(id_ranges, process_n) to every process')
+
+
+def iter_batch_id_ranges(id_ranges_queue):
+    """
+    Iterate over the '_id' ranges a process is responsible for, taking ranges from a shared queue until the None sentinel.
+    The ranges are computed once in the parent (see mongodb.gen_id_ranges and utilities.gen_id_ranges_queue),
+    so that all processes work on the same consistent split of the collection.
+    
+    :param id_ranges_queue: multiprocessing.Queue obj of (range index, (lower, upper)) items
+    :return: generator of (range index, (lower, upper)) tuples
+    """
+    check_id_ranges_queue(id_ranges_queue)
+    return _iter_queue(id_ranges_queue)
+
 
+def _iter_queue(id_ranges_queue):
+    while True:
+        item = id_ranges_queue.get()
+        if item is None:
+            return
+        yield item
 
-def worker_parse_created_at(db_name, collection_name, batch_i, process_n, output_file):
+
+def iter_batch_cursors(collection, batch_i, process_n, projection, id_ranges_queue=None, filter=None):
     """
-    Parse the 'created_at' field of (a batch of) tweets in MongoDB database
+    Query the documents of (a batch of) '_id' ranges, each range with its own cursor sorted by '_id'.
+    A range is fully processed once its cursor is exhausted, which is when checkpointed workers commit it.
+    
+    :param collection: the collection obj to work on
+    :param batch_i: the index of this batch, from 0 to processes number minus 1
+    :param process_n: the total nubmer of processes working together
+    :param projection: projection dict passed to find()
+    :param id_ranges_queue: multiprocessing.Queue obj of (range index, (lower, upper)) items, see iter_batch_id_ranges
+    :param filter: extra filter dict evaluated by the server within each range, None for all documents
+    :return: generator of (range index, cursor) tuples
+    """
+    check_id_ranges_queue(id_ranges_queue)
+    return _iter_range_cursors(collection, batch_i, process_n, projection, iter_batch_id_ranges(id_ranges_queue), filter)
+
+
+def _iter_range_cursors(collection, batch_i, process_n, projection, id_ranges, filter):
+    for range_i, id_range in id_ranges:
+        print('Process{}/{} handling range {}: {}...'.format(batch_i, process_n, range_i, id_range))
+        range_filter = mongodb.gen_id_range_filter(id_range)
+        if filter:
+            range_filter = dict(filter, **range_filter)
+        cursor = collection.find(filter=range_filter,
+                                 sort=[('_id', pymongo.ASCENDING)], # sort by default '_id' ascending
+                                 projection=projection)
+        if mongodb.CURSOR_BATCH_SIZE:
+            cursor = cursor.batch_size(mongodb.CURSOR_BATCH_SIZE)
+        yield range_i, cursor
+
+
+@instrumentation.instrumented
+def worker_parse_created_at(db_name, collection_name, batch_i, process_n, output_file, id_ranges_queue=None,
+                            chunk_size=10000, checkpointer=None, instrument=None):
+    """
+    Parse the 'created_at' field of (a batch of) tweets in MongoDB database.
+    Tweets are parsed in chunks with the vectorized utilities.get_tweets_timestamps,
+    which reads the 'timestamp_ms' field directly when a tweet has it.
     
     :param db_name: the name of the MongoDB database (local) to work on
     :param collection_name: the name of the collection in the database to work on
     :param batch_i: the index of this batch, from 0 to processes number minus 1
     :param process_n: the total nubmer of processes working together
-    :param output_file: the name/path of the intermediate output file this processing writes into
+    :param output_file: the name/path of the intermediate output file this processing writes into, or a sink obj (see sinks.py)
+    :param id_ranges_queue: shared queue of '_id' ranges (see utilities.gen_id_ranges_queue), required
+    :param chunk_size: number of tweets parsed at a time
+    :param checkpointer: checkpoints.Checkpointer obj to commit each finished range to, None for no checkpoints;
+                         the ranges have to come from its gen_pending_id_ranges_queue, and output files
+                         become one file per range (see sinks.RangeFilesSink)
+    :param instrument: instrumentation.Instrument obj collecting stats of this process, None for no instrumentation
     """
     #logging.debug('Start')
+    check_id_ranges_queue(id_ranges_queue)
+    stats = instrumentation.start(instrument, batch_i, process_n)
     # initialize a new connection to MongoDB database
     collection = mongodb.initialize(db_name=db_name, collection_name=collection_name)
     
     # query the batch of tweets
-    collection_size = collection.count()
-    batch_size = collection_size//process_n
-    skip = batch_i * batch_size
-    limit = batch_size
-    if batch_i == (process_n - 1): # if this is the last batch, process all left
-        limit = collection_size - skip + 1
-    
-    time.sleep(batch_i * 0.5) # sleep few seconds to reduce the peak burden of MongoDB database
-    
-    cursor = collection.find(sort=[('_id', pymongo.ASCENDING)], # sort by default '_id' ascending
-                             projection={'_id': 0, 'id': 1, 'created_at': 1}, # minimize I/O bandwidth
-                             skip=skip,
-                             limit=limit) 
-    print('Process{}/{} handling documents {} to {}...'.format(batch_i, process_n, skip, skip + limit - 1))
-    
-    # process the 'created_at' field of each tweet and write to output file
-    with codecs.open(output_file, 'w', 'utf-8') as f:
-        for document in cursor:
-            id_int64 = int(document['id'])
-            created_at_str = document['created_at']
-            created_at_timestamp = utilities.parse_tweet_created_at_str(created_at_str)
-            #output_dic = {'id': id_int64, 'created_at_parsed': {'$date': created_at_timestamp_ms}}
-            output_dic = {'id': id_int64, 'created_at_parsed': created_at_timestamp}
-            f.write(json.dumps(output_dic) + '\n')
+    cursors = iter_batch_cursors(collection, batch_i, process_n,
+                                 projection={'_id': 0, 'id': 1, 'created_at': 1, 'timestamp_ms': 1}, # minimize I/O bandwidth
+                                 id_ranges_queue=id_ranges_queue)
+    
+    # process the 'created_at' field of each chunk of tweets and write to output file
+    with stats.wrap_sink(sinks.open_sink(output_file, checkpointer)) as sink:
+        for range_i, cursor in cursors:
+            for documents_lst in utilities.iter_chunks(stats.iter_docs(cursor), chunk_size):
+                created_at_timestamps = utilities.get_tweets_timestamps(documents_lst).tolist()
+                for document, created_at_timestamp in zip(documents_lst, created_at_timestamps):
+                    #output_dic = {'id': id_int64, 'created_at_parsed': {'$date': created_at_timestamp_ms}}
+                    output_dic = {'id': int(document['id']), 'created_at_parsed': created_at_timestamp}
+                    sink.write(output_dic)
+            if checkpointer is not None:
+                checkpointer.commit_range(range_i, sink)
+    stats.finish()
     #logging.debug('Done')
 
     
-def worker_get_unique_user(db_name, collection_name, batch_i, process_n, output_file, unique_user_ids_shl, unique_user_ids_key):
+def gen_latest_users_pipeline(match):
+    """
+    Aggregation pipeline getting the latest user object (i.e. from the user's most recent tweet) of each user
+    among matched tweets, in one '$sort'/'$group' pass
+    
+    :param match: filter dict selecting the tweets, e.g. on 'user.id'
+    :return: a list of pipeline stages
+    """
+    return [{'$match': match},
+            {'$project': {'_id': 0, 'id': 1, 'user': 1}}, # minimize memory used by '$sort'
+            {'$sort': {'user.id': 1, 'id': -1}}, # tweet ids increase over time, so latest tweet of each user first
+            {'$group': {'_id': '$user.id', 'user': {'$first': '$user'}}},
+            {'$replaceRoot': {'newRoot': '$user'}}]
+
+
+def aggregate_latest_users(collection, match):
+    """
+    Get the latest user object of each user among matched tweets (see gen_latest_users_pipeline)
+    
+    :param collection: the collection obj of tweets
+    :param match: filter dict selecting the tweets, e.g. on 'user.id'
+    :return: cursor of user objects
+    """
+    return collection.aggregate(pipeline=gen_latest_users_pipeline(match),
+                                allowDiskUse=True) # Exceeded memory limit for $group, but didn't allow external sort. Pass allowDiskUse:true to opt in.
+
+
+async def async_aggregate_latest_users(db, match, collection_name):
+    """
+    Asyncio version of aggregate_latest_users, see async_queries.py
+    
+    :return: a list of user objects
+    """
+    return await async_queries.aggregate_list(db[collection_name], gen_latest_users_pipeline(match), allowDiskUse=True)
+
+
+@instrumentation.instrumented
+def worker_get_unique_user(db_name, collection_name, batch_i, process_n, output_file, unique_user_ids=None,
+                           chunk_size=1000, id_ranges_queue=None, instrument=None, async_concurrency=None):
     """
-    Query the user object of (a batch of) unique user ids in MongoDB database
+    Query the latest user object of (a batch of) unique user ids in MongoDB database
+    
+    If unique user ids are given in shared memory, this process takes its contiguous slice of them, without copy,
+    and resolves them in chunks of '$in' queries. Load ids kept in a shelve once in the parent:
+        with shelve.open(unique_user_ids_shl, flag='r') as s:
+            unique_user_ids = shared_ids.SharedIds(s[unique_user_ids_key])
+    Otherwise the unique users are resolved directly from the tweets, by one aggregation pass per 'user.id' range
+    (see mongodb.gen_id_ranges with field='user.id'), without building the ids set at all.
+    With async_concurrency, the queries (chunks or ranges) are run concurrently on an asyncio client
+    (see async_queries.py) instead of one after the other, so that a few processes keep the server busy.
     
     :param db_name: the name of the MongoDB database (local) to work on
     :param collection_name: the name of the collection in the database to work on
     :param batch_i: the index of this batch, from 0 to processes number minus 1
     :param process_n: the total nubmer of processes working together
-    :param output_file: the name/path of the intermediate output file this processing writes into
+    :param output_file: the name/path of the intermediate output file this processing writes into, or a sink obj (see sinks.py)
+    :param unique_user_ids: shared_ids.SharedIds obj of unique user ids, None to aggregate over 'user.id' ranges
+    :param chunk_size: number of user ids per '$in' query
+    :param id_ranges_queue: shared queue of 'user.id' ranges (see utilities.gen_id_ranges_queue), required to aggregate over ranges
+    :param instrument: instrumentation.Instrument obj collecting stats of this process, None for no instrumentation
+    :param async_concurrency: max number of queries in flight on an asyncio client, None to query synchronously
     """
+    if unique_user_ids is None:
+        check_id_ranges_queue(id_ranges_queue)
+    stats = instrumentation.start(instrument, batch_i, process_n)
     
     # initialize a new connection to MongoDB database
     collection = mongodb.initialize(db_name=db_name, collection_name=collection_name)
     
-    time.sleep(batch_i * 0.5) # sleep few seconds to reduce the peak burden
-    
-    # read in unique user ids set from shelve
-    unique_user_ids_int64_set = set()
-    with shelve.open(unique_user_ids_shl, flag='r') as s:
-        unique_user_ids_int64_set = s[unique_user_ids_key]
-    #print('Successfully readin unique user ids set from shelve {}'.format(unique_user_ids_shl))
-    
-    # turn set obj into sorted list obj in order to split workload using multiprocessing
-    unique_user_ids_int64_list = sorted(list(unique_user_ids_int64_set))
-    
-    # query the batch of users
-    unique_user_ids_int64_set_size = len(unique_user_ids_int64_set)
-    batch_size = unique_user_ids_int64_set_size//process_n
-    skip = batch_i * batch_size
-    reach = skip + batch_size
-    if batch_i == (process_n - 1): # if this is the last batch, process all left
-        reach = unique_user_ids_int64_set_size
-        
-    print('Process{}/{} querying users {} to {}...'.format(batch_i, process_n, skip, reach - 1))
-    
-    with codecs.open(output_file, 'w', 'utf-8') as f:
-        for list_index in range(skip, reach):
-            unique_user_id = unique_user_ids_int64_list[list_index]
-            user_obj = collection.find_one(filter={'user.id': unique_user_id},
-                                           projection={'_id': 0, 'user': 1}) # minimize I/O bandwidth
-            #output_list = [(field: user_obj['user'][field]) for field in user_obj['user']]
-            #output_dic = dict(output_list)
-            output_dic = user_obj['user']
-            f.write(json.dumps(output_dic) + '\n')
+    def gen_range_matches():
+        for range_i, id_range in iter_batch_id_ranges(id_ranges_queue):
+            print('Process{}/{} querying users of range {}: {}...'.format(batch_i, process_n, range_i, id_range))
+            yield mongodb.gen_id_range_filter(id_range, field='user.id')
+    
+    if unique_user_ids is not None:
+        batch_user_ids_lst = unique_user_ids.split(batch_i, process_n)
+        print('Process{}/{} querying {} users...'.format(batch_i, process_n, len(batch_user_ids_lst)))
+        matches = (queries.gen_in_filter('user.id', chunk_user_ids_lst)
+                   for chunk_user_ids_lst in queries.chunk_ids(batch_user_ids_lst, chunk_size))
+    else:
+        matches = gen_range_matches()
+    
+    if async_concurrency:
+        query_fn = functools.partial(async_aggregate_latest_users, collection_name=collection_name)
+        users = (user_obj for _, users_lst in async_queries.stream(db_name, query_fn, matches, ordered=False,
+                                                                   concurrency=async_concurrency)
+                 for user_obj in users_lst)
+    else:
+        users = (user_obj for match in matches for user_obj in aggregate_latest_users(collection, match=match))
+    
+    with stats.wrap_sink(sinks.open_sink(output_file)) as sink:
+        for user_obj in stats.iter_docs(users):
+            sink.write(user_obj)
      
+    stats.finish()
     print('Process{}/{} Done'.format(batch_i, process_n))
 
     
@@ -116,52 +258,55 @@ Tag 'text' filed of all tweets for different topics/keywords
 20170504-user_affiliation_2
 Tag all tweets for keyword 'ibm' in 'text' field (multiprocessing)
 '''
-def worker_tag_kws_in_tw(db_name, collection_name, batch_i, process_n, output_file, kws_lst):
+@instrumentation.instrumented
+def worker_tag_kws_in_tw(db_name, collection_name, batch_i, process_n, output_file, kws_lst, id_ranges_queue=None,
+                         checkpointer=None, instrument=None):
     """
-    Tag whether a list of keywords appears in (a bath of) tweets in MongoDB database
+    Tag whether a list of keywords appears in (a bath of) tweets in MongoDB database.
+    Each output document only holds the ids and the packed keywords bitmask 'kws_mask' (bit i set if kws_lst[i]
+    appears), e.g. {'kws_mask': {'$bitsAllSet': [0]}} matches the tweets with the first keyword;
+    build a kws_index.KeywordsIndex on the output for fast boolean keyword queries.
     
     :param db_name: the name of the MongoDB database (local) to work on
     :param collection_name: the name of the collection in the database to work on
     :param batch_i: the index of this batch, from 0 to processes number minus 1
     :param process_n: the total nubmer of processes working together
-    :param output_file: the name/path of the intermediate output file this processing writes into
-    :param kws_lst: a list of keywords
+    :param output_file: the name/path of the intermediate output file this processing writes into, or a sink obj (see sinks.py)
+    :param kws_lst: a list of keywords, at most kws_index.MAX_MASK_KWS
+    :param id_ranges_queue: shared queue of '_id' ranges (see utilities.gen_id_ranges_queue), required
+    :param checkpointer: checkpoints.Checkpointer obj to commit each finished range to, None for no checkpoints;
+                         the ranges have to come from its gen_pending_id_ranges_queue, and output files
+                         become one file per range (see sinks.RangeFilesSink)
+    :param instrument: instrumentation.Instrument obj collecting stats of this process, None for no instrumentation
     """
+    if len(kws_lst) > MAX_MASK_KWS:
+        raise ValueError('At most {} keywords per bitmask, got {}'.format(MAX_MASK_KWS, len(kws_lst)))
     
     '''
     Establish connection to MongoDB database and query batch of tweets
     '''
+    check_id_ranges_queue(id_ranges_queue)
+    stats = instrumentation.start(instrument, batch_i, process_n)
     collection = mongodb.initialize(db_name=db_name, collection_name=collection_name)
     
-    collection_size = collection.count()
-    batch_size = collection_size//process_n
-    skip = batch_i * batch_size
-    limit = batch_size
-    if batch_i == (process_n - 1): # if this is the last batch, process all left
-        limit = collection_size - skip + 1
-    
-    time.sleep(batch_i * 0.5) # sleep few seconds to reduce the peak burden of MongoDB database
-    
-    print('Process{}/{} handling documents {} to {}...'.format(batch_i, process_n, skip, skip + limit - 1))
-    cursor = collection.find(sort=[('_id', pymongo.ASCENDING)], # sort by default '_id' ascending
-                             projection={'_id': 0, 'id': 1, 'user.id': 1, 'text': 1}, # minimize I/O bandwidth
-                             skip=skip,
-                             limit=limit)
+    cursors = iter_batch_cursors(collection, batch_i, process_n,
+                                 projection={'_id': 0, 'id': 1, 'user.id': 1, 'text': 1}, # minimize I/O bandwidth
+                                 id_ranges_queue=id_ranges_queue)
     
     '''
     Tag the 'text' field for each keyword in the list
     '''   
-    with codecs.open(output_file, 'w', 'utf-8') as f:
-        for doc in cursor:
-            id_int = int(doc['id'])
-            user_id_int = int(doc['user']['id'])
-            text = doc['text']
-            output_dict = {'id': id_int, 'user_id': user_id_int, 'text': text}
-            
-            for ind, kw in enumerate(kws_lst):
-                res = utilities.simple_test_keyword_in_text(text=text, keyword=kw)
-                output_dict['X_' + str(ind)] = res
-            f.write(json.dumps(output_dict) + '\n')
+    matcher = keywords_matcher.get_matcher(kws_lst) # compile all keywords once per process
+    with stats.wrap_sink(sinks.open_sink(output_file, checkpointer)) as sink:
+        for range_i, cursor in cursors:
+            for doc in stats.iter_docs(cursor):
+                id_int = int(doc['id'])
+                user_id_int = int(doc['user']['id'])
+                output_dict = {'id': id_int, 'user_id': user_id_int, 'kws_mask': matcher.mask(doc['text'])}
+                sink.write(output_dict)
+            if checkpointer is not None:
+                checkpointer.commit_range(range_i, sink)
+    stats.finish()
 
 """
 20170507-compare_influence_inside_outside
@@ -169,7 +314,9 @@ def worker_tag_kws_in_tw(db_name, collection_name, batch_i, process_n, output_fi
 Filter out retweets of IBM tweets
 """
 
-def worker_filter_rt_ibm_tweets(db_name, collection_name, batch_i, process_n, output_file, ibm_user_ids_lst):
+@instrumentation.instrumented
+def worker_filter_rt_ibm_tweets(db_name, collection_name, batch_i, process_n, output_file, ibm_user_ids_lst,
+                                id_ranges_queue=None, checkpointer=None, instrument=None):
     """
     Filter out all retweets of IBM tweets in specified collection
     
@@ -177,11 +324,19 @@ def worker_filter_rt_ibm_tweets(db_name, collection_name, batch_i, process_n, ou
     :param collection_name: the name of the collection in the database to work on
     :param batch_i: the index of this batch, from 0 to processes number minus 1
     :param process_n: the total nubmer of processes working together
-    :param output_file: the output file thie thread writting results to
-    :param ibm_user_ids_lst: the list of identified IBM users' ids
+    :param output_file: the output file thie thread writting results to, or a sink obj (see sinks.py)
+    :param ibm_user_ids_lst: the list of identified IBM users' ids, or a shared_ids.SharedIds obj of them;
+                             sets larger than MAX_IN_FILTER_IDS are tested by the workers instead of the server
+    :param id_ranges_queue: shared queue of '_id' ranges (see utilities.gen_id_ranges_queue), required
+    :param checkpointer: checkpoints.Checkpointer obj to commit each finished range to, None for no checkpoints;
+                         the ranges have to come from its gen_pending_id_ranges_queue, and output files
+                         become one file per range (see sinks.RangeFilesSink)
+    :param instrument: instrumentation.Instrument obj collecting stats of this process, None for no instrumentation
     
     :return: None
     """
+    check_id_ranges_queue(id_ranges_queue)
+    stats = instrumentation.start(instrument, batch_i, process_n)
 
     '''
     Initialize a new connection to MongoDB database
@@ -189,32 +344,49 @@ def worker_filter_rt_ibm_tweets(db_name, collection_name, batch_i, process_n, ou
     collection = mongodb.initialize(db_name=db_name, collection_name=collection_name)
     
     '''
-    Query the batch of tweets
+    Query the batch of retweets of IBM tweets, filtered by the server on the indexed 'retweeted_status.user.id'
+    if the set of IBM users is small enough for an '$in' query, otherwise by vectorized lookups in the shared set
     '''
-    collection_size = collection.count()
-    batch_size = collection_size//process_n
-    skip = batch_i * batch_size
-    limit = batch_size
-    if batch_i == (process_n - 1): # if this is the last batch, process all left
-        limit = collection_size - skip + 1
-    
-    time.sleep(batch_i * 0.5) # sleep few seconds to reduce the peak burden of MongoDB database
-    
-    cursor = collection.find(sort=[('_id', pymongo.ASCENDING)], # sort by default '_id' ascending
-                             projection={'_id': False},
-                             skip=skip,
-                             limit=limit)
-    print('Process{}/{} handling documents {} to {}...'.format(batch_i, process_n, skip, skip + limit - 1))
+    is_shared = isinstance(ibm_user_ids_lst, shared_ids.SharedIds)
+    server_filter = len(ibm_user_ids_lst) <= MAX_IN_FILTER_IDS
+    if server_filter:
+        ibm_user_ids_lst = queries.to_in_list(ibm_user_ids_lst.array if is_shared else ibm_user_ids_lst)
+        
+        def gen_range_cursors():
+            # the ids go in '$in' batches of IN_FILTER_CHUNK_SIZE, each queried within the range
+            for range_i, id_range in iter_batch_id_ranges(id_ranges_queue):
+                print('Process{}/{} handling range {}: {}...'.format(batch_i, process_n, range_i, id_range))
+                yield range_i, queries.find_in(collection, 'retweeted_status.user.id', ibm_user_ids_lst,
+                                               filter=mongodb.gen_id_range_filter(id_range), projection={'_id': False},
+                                               chunk_size=IN_FILTER_CHUNK_SIZE)
+        
+        cursors = gen_range_cursors()
+    else:
+        if is_shared:
+            is_ibm_user = ibm_user_ids_lst.isin
+        else:
+            is_ibm_user = functools.partial(ids_store.isin, ids_store.to_ids_array(ibm_user_ids_lst))
+        cursors = iter_batch_cursors(collection, batch_i, process_n,
+                                     projection={'_id': False},
+                                     id_ranges_queue=id_ranges_queue)
     
     '''
-    Filter retweets of IBM tweets and write to output file
+    Write retweets of IBM tweets to output file
     '''
-    ibm_user_ids_set = set(ibm_user_ids_lst)
-    with codecs.open(output_file, 'w', 'utf-8') as f:
-        for doc in cursor:
-            retweeted_status_user_id_int = int(doc['retweeted_status']['user']['id'])
-            if retweeted_status_user_id_int in ibm_user_ids_set:
-                f.write(json.dumps(doc) + '\n')
+    with stats.wrap_sink(sinks.open_sink(output_file, checkpointer)) as sink:
+        for range_i, cursor in cursors:
+            if server_filter:
+                for doc in stats.iter_docs(cursor):
+                    sink.write(doc)
+            else:
+                for docs_lst in utilities.iter_chunks(stats.iter_docs(cursor), 10000):
+                    is_ibm = is_ibm_user([doc['retweeted_status']['user']['id'] for doc in docs_lst])
+                    for doc, doc_is_ibm in zip(docs_lst, is_ibm):
+                        if doc_is_ibm:
+                            sink.write(doc)
+            if checkpointer is not None:
+                checkpointer.commit_range(range_i, sink)
+    stats.finish()
     logging.debug('Done')
 
 """
@@ -223,130 +395,417 @@ def worker_filter_rt_ibm_tweets(db_name, collection_name, batch_i, process_n, ou
 Get IBM users' IBM/non-IBM followers count
 """
 
-def worker_count_ibm_followers_ibm_users(hydrated_uids_dir, batch_i, process_n, output_file, hydrated_uids_lst):
+@instrumentation.instrumented
+def worker_count_ibm_followers_ibm_users(hydrated_uids_dir, batch_i, process_n, output_file, hydrated_uids_lst,
+                                         hydrated_uids_queue=None, instrument=None):
     """
-    Count how many followers have keyword 'ibm' in 'description' field
+    Count how many followers have keyword 'ibm' in 'description' field.
+    Files are read in binary and each follower obj is parsed with orjson when installed (json otherwise).
     
     :param hydrated_uids_dir: dir of hydrated followers objs for each IBM user
     :param batch_i: the index of this batch, from 0 to processes number minus 1
     :param process_n: the total nubmer of processes working together
-    :param output_file: the output file thie thread writting results to
-    :param ibm_user_ids_lst: the list of identified IBM users' ids
+    :param output_file: the output file thie thread writting results to, or a sink obj (see sinks.py)
+    :param hydrated_uids_lst: the list of hydrated IBM users' ids, sliced evenly when no queue is given
+    :param hydrated_uids_queue: shared queue of (uid, file size) items, largest files first
+                                (see utilities.gen_files_queue_by_size), None to slice hydrated_uids_lst
+    :param instrument: instrumentation.Instrument obj collecting stats of this process, None for no instrumentation
     
     :return: None
     """
+    stats = instrumentation.start(instrument, batch_i, process_n)
 
     '''
-    Slice the batch of hydrated follower uids
+    Slice the batch of hydrated follower uids, or take them from the shared queue
     '''
-    batch_size = len(hydrated_uids_lst) // process_n
-    s_ind = batch_i * batch_size # starting index of the batch
-    e_ind = s_ind + batch_size - 1 # ending index of the batch
-    if batch_i == (process_n - 1): # if this is the last batch, process all left
-        e_ind = len(hydrated_uids_lst) - 1
-    
-    batch_hydrated_uids_lst = hydrated_uids_lst[s_ind: (e_ind + 1)]
-    print('Process ({}/{}) handling files: {}-{}...'.format((batch_i + 1), process_n, s_ind, e_ind))
+    if hydrated_uids_queue is None:
+        batch_size = len(hydrated_uids_lst) // process_n
+        s_ind = batch_i * batch_size # starting index of the batch
+        e_ind = s_ind + batch_size - 1 # ending index of the batch
+        if batch_i == (process_n - 1): # if this is the last batch, process all left
+            e_ind = len(hydrated_uids_lst) - 1
+        
+        batch_hydrated_uids = iter(hydrated_uids_lst[s_ind: (e_ind + 1)])
+        print('Process ({}/{}) handling files: {}-{}...'.format((batch_i + 1), process_n, s_ind, e_ind))
+    else:
+        batch_hydrated_uids = (item[0] for item in iter(hydrated_uids_queue.get, None))
+        print('Process ({}/{}) handling files from queue...'.format((batch_i + 1), process_n))
     
     '''
     Count how many followers have keyword "ibm" in "description" field
     '''
     keyword = 'ibm'
-    with open(output_file, 'w') as out_f:
-        for hydrated_uid in batch_hydrated_uids_lst:
+    start_time = time.perf_counter()
+    files_n = 0
+    total_bytes = 0
+    total_followers_count = 0
+    with stats.wrap_sink(sinks.open_sink(output_file)) as sink:
+        for hydrated_uid in batch_hydrated_uids:
             output_dict = {'uid': hydrated_uid}
             follower_objs_file = os.path.join(hydrated_uids_dir, '{}.json'.format(hydrated_uid))
 
+            file_start_time = time.perf_counter()
+            file_bytes = 0
             followers_count = 0
             ibm_followers_count = 0
-            with codecs.open(follower_objs_file, 'r', 'utf-8') as in_f:
+            with open(follower_objs_file, 'rb', buffering=1 << 20) as in_f:
                 for line in in_f:
-                    follower_obj = json.loads(line)
-                    follower_desc_ibm = utilities.simple_test_keyword_in_text(follower_obj['description'], keyword)
+                    file_bytes += len(line)
+                    if not line.strip():
+                        continue
+                    follower_desc = json_loads(line).get('description')
+                    follower_desc_ibm = bool(follower_desc) and keyword in follower_desc.lower()
                     followers_count += 1
                     if follower_desc_ibm:
                         ibm_followers_count += 1
             output_dict['followers_count'] = followers_count
             output_dict['ibm_followers_count'] = ibm_followers_count
-            out_f.write(json.dumps(output_dict) + '\n')
+            output_dict['file_bytes'] = file_bytes
+            output_dict['scan_seconds'] = time.perf_counter() - file_start_time
+            sink.write(output_dict)
+            stats.add('docs_read', followers_count)
+            stats.add('bytes_read', file_bytes)
+            stats.add('files_read')
+            
+            files_n += 1
+            total_bytes += file_bytes
+            total_followers_count += followers_count
+    
+    elapsed_seconds = time.perf_counter() - start_time
+    print('Process ({}/{}) scanned {} files, {} followers, {:.1f} MB in {:.1f}s ({:.1f} MB/s, {:.0f} followers/s)'.format(
+        (batch_i + 1), process_n, files_n, total_followers_count, total_bytes / 1e6, elapsed_seconds,
+        total_bytes / 1e6 / max(elapsed_seconds, 1e-9), total_followers_count / max(elapsed_seconds, 1e-9)))
+    stats.finish()
     logging.debug('Done')
 
 '''
 20170911-quote_tweets_sentiment
 Perform sentiment analysis on quote tweets in 'text' and 'quoted_status.text' field (multiprocessing)
 '''
-def worker_qt_sentiment(db_name, collection_name, batch_i, process_n, output_file):
+@instrumentation.instrumented
+def worker_qt_sentiment(db_name, collection_name, batch_i, process_n, output_file, id_ranges_queue=None,
+                        sentiment_cache_db=None, chunk_size=1000, checkpointer=None, instrument=None):
     """
-    Get sentiment score for quote tweet text and corresponding original tweet text
+    Get sentiment score for quote tweet text and corresponding original tweet text.
+    Scores are memoized by text (see sentiment_cache.py), so repeated texts are scored once.
     
     :param db_name: the name of the MongoDB database (local) to work on
     :param collection_name: the name of the collection in the database to work on
     :param batch_i: the index of this batch, from 0 to processes number minus 1
     :param process_n: the total nubmer of processes working together
-    :param output_file: the name/path of the intermediate output file this processing writes into
+    :param output_file: the name/path of the intermediate output file this processing writes into, or a sink obj (see sinks.py)
+    :param id_ranges_queue: shared queue of '_id' ranges (see utilities.gen_id_ranges_queue), required
+    :param sentiment_cache_db: the sqlite file of scores shared across processes and runs, e.g. SENTIMENT_CACHE_DB,
+                               None to only cache in this process
+    :param chunk_size: number of quote tweets scored at a time
+    :param checkpointer: checkpoints.Checkpointer obj to commit each finished range to, None for no checkpoints;
+                         the ranges have to come from its gen_pending_id_ranges_queue, and output files
+                         become one file per range (see sinks.RangeFilesSink)
+    :param instrument: instrumentation.Instrument obj collecting stats of this process, None for no instrumentation
     """
+    check_id_ranges_queue(id_ranges_queue)
+    stats = instrumentation.start(instrument, batch_i, process_n)
     
     '''
     Establish connection to MongoDB database and query batch of tweets
     '''
     collection = mongodb.initialize(db_name=db_name, collection_name=collection_name)
     
-    collection_size = collection.count()
-    batch_size = collection_size//process_n
-    skip = batch_i * batch_size
-    limit = batch_size
-    if batch_i == (process_n - 1): # if this is the last batch, process all left
-        limit = collection_size - skip + 1
-    
-    time.sleep(batch_i * 0.5) # sleep few seconds to reduce the peak burden of MongoDB database
-    
-    print('Process{}/{} handling documents {} to {}...'.format(batch_i, process_n, skip, skip + limit - 1))
-    cursor = collection.find(sort=[('_id', pymongo.ASCENDING)], # sort by default '_id' ascending
-                             projection={'_id': 0, 
-                                         'id': 1, 
-                                         'user.id': 1, 
-                                         'user.followers_count': 1, 
-                                         'text': 1,
-                                         'retweet_count': 1,
-                                         'quoted_status.id': 1, 
-                                         'quoted_status.user.id': 1,
-                                         'quoted_status.user.followers_count': 1,
-                                         'quoted_status.text': 1, 
-                                         'quoted_status.retweet_count': 1}, # minimize I/O bandwidth
-                             skip=skip,
-                             limit=limit)
+    cursors = iter_batch_cursors(collection, batch_i, process_n,
+                                 projection={'_id': 0, 
+                                             'id': 1, 
+                                             'user.id': 1, 
+                                             'user.followers_count': 1, 
+                                             'text': 1,
+                                             'retweet_count': 1,
+                                             'quoted_status.id': 1, 
+                                             'quoted_status.user.id': 1,
+                                             'quoted_status.user.followers_count': 1,
+                                             'quoted_status.text': 1, 
+                                             'quoted_status.retweet_count': 1}, # minimize I/O bandwidth
+                                 id_ranges_queue=id_ranges_queue)
     
     '''
     Perform sentiment analysis on quote tweets in 'text' and 'quoted_status.text' field
     '''   
-    with codecs.open(output_file, 'w', 'utf-8') as f:
-        for doc in cursor:
-            id_int = int(doc['id'])
-            user_id_int = int(doc['user']['id'])
-            user_followers_count_int = int(doc['user']['followers_count'])
-            retweet_count_int = int(doc['retweet_count'])
-            text = doc['text']
+    polarity_cache = sentiment_cache.get_cache(sentiment_cache_db) # kept warm across calls in the same process
+    hits_n, misses_n = polarity_cache.hits_n, polarity_cache.misses_n
+    with stats.wrap_sink(sinks.open_sink(output_file, checkpointer)) as sink:
+        for range_i, cursor in cursors:
+            for docs_lst in utilities.iter_chunks(stats.iter_docs(cursor), chunk_size):
+                output_dicts_lst = []
+                for doc in docs_lst:
+                    id_int = int(doc['id'])
+                    user_id_int = int(doc['user']['id'])
+                    user_followers_count_int = int(doc['user']['followers_count'])
+                    retweet_count_int = int(doc['retweet_count'])
+                    text = doc['text']
+                
+                    qt_id_int = int(doc['quoted_status']['id'])
+                    qt_user_id_int = int(doc['quoted_status']['user']['id'])
+                    qt_user_followers_count_int = int(doc['quoted_status']['user']['followers_count'])
+                    qt_retweet_count_int = int(doc['quoted_status']['retweet_count'])
+                    qt_text = doc['quoted_status']['text']
+                
+                    output_dict = {'id': id_int,
+                                   'user_id': user_id_int,
+                                   'user_followers_count': user_followers_count_int,
+                                   'retweet_count': retweet_count_int,
+                                   'text': text, 
+                                   'quoted_status_id': qt_id_int, 
+                                   'quoted_status_user_id': qt_user_id_int, 
+                                   'quoted_status_user_followers_count': qt_user_followers_count_int, 
+                                   'quoted_status_retweet_count': qt_retweet_count_int,
+                                   'quoted_status_text': qt_text}
+                    output_dicts_lst.append(output_dict)
             
-            qt_id_int = int(doc['quoted_status']['id'])
-            qt_user_id_int = int(doc['quoted_status']['user']['id'])
-            qt_user_followers_count_int = int(doc['quoted_status']['user']['followers_count'])
-            qt_retweet_count_int = int(doc['quoted_status']['retweet_count'])
-            qt_text = doc['quoted_status']['text']
-            
-            output_dict = {'id': id_int,
-                           'user_id': user_id_int,
-                           'user_followers_count': user_followers_count_int,
-                           'retweet_count': retweet_count_int,
-                           'text': text, 
-                           'quoted_status_id': qt_id_int, 
-                           'quoted_status_user_id': qt_user_id_int, 
-                           'quoted_status_user_followers_count': qt_user_followers_count_int, 
-                           'quoted_status_retweet_count': qt_retweet_count_int,
-                           'quoted_status_text': qt_text}
-            
-            text_polarity = TextBlob(text).sentiment.polarity
-            output_dict['X_text_polarity'] = text_polarity
-            qt_text_polarity = TextBlob(qt_text).sentiment.polarity
-            output_dict['X_qt_text_polarity'] = qt_text_polarity
-            
-            f.write(json.dumps(output_dict) + '\n')
+                # score texts and quoted texts of the chunk in one batch, duplicated texts are scored once
+                texts_lst = [output_dict['text'] for output_dict in output_dicts_lst]
+                qt_texts_lst = [output_dict['quoted_status_text'] for output_dict in output_dicts_lst]
+                polarities_lst = polarity_cache.get_polarities(texts_lst + qt_texts_lst)
+                for ind, output_dict in enumerate(output_dicts_lst):
+                    output_dict['X_text_polarity'] = polarities_lst[ind]
+                    output_dict['X_qt_text_polarity'] = polarities_lst[len(output_dicts_lst) + ind]
+                    sink.write(output_dict)
+            if checkpointer is not None:
+                checkpointer.commit_range(range_i, sink)
+    polarity_cache.close()
+    hits_n, misses_n = polarity_cache.hits_n - hits_n, polarity_cache.misses_n - misses_n
+    stats.add('cache_hits', hits_n)
+    stats.add('cache_misses', misses_n)
+    stats.finish()
+    print('Process{}/{} sentiment cache hits: {}, misses: {}'.format(batch_i, process_n, hits_n, misses_n))
+
+
+'''
+Streaming sketch statistics of tweets and users (see sketches.py)
+'''
+@instrumentation.instrumented
+def worker_sketch_tweets(db_name, collection_name, batch_i, process_n, output_file, kws_lst, id_ranges_queue=None,
+                         user_groups=None, chunk_size=10000, instrument=None):
+    """
+    Summarize (a batch of) tweets into mergeable sketches in one streaming pass, in bounded memory:
+    distinct users overall and per keyword (HyperLogLog), quantiles of followers_count per user,
+    of retweet_count per tweet and of the proportion of tweets of each user with each keyword (KLLSketch).
+    Every sketch is kept for scope 'all' and for each group of users, e.g. '<scope>/users/<kw>'.
+    Tweets are read by 'user.id' ranges sorted by 'user.id', so that all tweets of a user are seen in a row
+    and per-user values are complete without any per-user table.
+    The parent merges the saved sketches with sketches.merge_sketch_files.
+    
+    :param db_name: the name of the MongoDB database (local) to work on
+    :param collection_name: the name of the collection in the database to work on, e.g. TW_NT_COL or TW_RT_COL
+    :param batch_i: the index of this batch, from 0 to processes number minus 1
+    :param process_n: the total nubmer of processes working together
+    :param output_file: the .npz file this processing saves its sketches into
+    :param kws_lst: a list of keywords matched in the 'text' field, at most kws_index.MAX_MASK_KWS
+    :param id_ranges_queue: shared queue of 'user.id' ranges (see utilities.gen_id_ranges_queue), required
+    :param user_groups: dict of {group name: shared_ids.SharedIds obj of the user ids of the group}, e.g. IBM users
+    :param chunk_size: number of tweets buffered before being added to the sketches
+    :param instrument: instrumentation.Instrument obj collecting stats of this process, None for no instrumentation
+    """
+    if len(kws_lst) > MAX_MASK_KWS:
+        raise ValueError('At most {} keywords per bitmask, got {}'.format(MAX_MASK_KWS, len(kws_lst)))
+    
+    check_id_ranges_queue(id_ranges_queue)
+    stats = instrumentation.start(instrument, batch_i, process_n)
+    collection = mongodb.initialize(db_name=db_name, collection_name=collection_name)
+    matcher = keywords_matcher.get_matcher(kws_lst)
+    user_groups = user_groups or {}
+    sketch_set = sketches.SketchSet()
+    
+    # per tweet: user id, retweet_count, keywords mask; per user (once all its tweets are seen): id, followers_count,
+    # number of tweets and number of tweets with each keyword
+    tweet_rows_lst, user_rows_lst = [], []
+    
+    def flush():
+        if not tweet_rows_lst and not user_rows_lst:
+            return
+        tweet_rows = np.array(tweet_rows_lst, dtype=np.int64).reshape(-1, 3)
+        user_rows = np.array(user_rows_lst, dtype=np.int64).reshape(-1, 3 + len(kws_lst))
+        scopes = [('all', np.ones(len(tweet_rows), dtype=bool), np.ones(len(user_rows), dtype=bool))]
+        scopes += [(group, group_ids.isin(tweet_rows[:, 0]), group_ids.isin(user_rows[:, 0]))
+                   for group, group_ids in user_groups.items()]
+        for scope, tweets_mask, users_mask in scopes:
+            tweets, users = tweet_rows[tweets_mask], user_rows[users_mask]
+            sketch_set.incr(scope + '/tweets', len(tweets))
+            sketch_set.hll(scope + '/users').add(users[:, 0])
+            sketch_set.kll(scope + '/retweet_count').add(tweets[:, 1])
+            sketch_set.kll(scope + '/followers_count').add(users[:, 1])
+            for kw_ind, kw in enumerate(kws_lst):
+                kw_tweets_n = users[:, 3 + kw_ind]
+                sketch_set.incr('{}/tweets/{}'.format(scope, kw), ((tweets[:, 2] >> kw_ind) & 1).sum())
+                sketch_set.hll('{}/users/{}'.format(scope, kw)).add(users[kw_tweets_n > 0, 0])
+                sketch_set.kll('{}/kw_prop/{}'.format(scope, kw)).add(kw_tweets_n / users[:, 2])
+        del tweet_rows_lst[:], user_rows_lst[:]
+    
+    for range_i, id_range in iter_batch_id_ranges(id_ranges_queue):
+        print('Process{}/{} sketching range {}: {}...'.format(batch_i, process_n, range_i, id_range))
+        cursor = collection.find(filter=mongodb.gen_id_range_filter(id_range, field='user.id'),
+                                 sort=[('user.id', pymongo.ASCENDING)],
+                                 projection={'_id': 0, 'id': 1, 'user.id': 1, 'user.followers_count': 1,
+                                             'retweet_count': 1, 'text': 1}) # minimize I/O bandwidth
+        if mongodb.CURSOR_BATCH_SIZE:
+            cursor = cursor.batch_size(mongodb.CURSOR_BATCH_SIZE)
+        user_row = None
+        latest_id = None
+        for doc in stats.iter_docs(cursor):
+            user_id_int = int(doc['user']['id'])
+            if user_row is None or user_row[0] != user_id_int:
+                if user_row is not None:
+                    user_rows_lst.append(user_row)
+                    if len(tweet_rows_lst) >= chunk_size:
+                        flush()
+                user_row = [user_id_int, 0, 0] + [0] * len(kws_lst)
+                latest_id = None
+            id_int = int(doc['id'])
+            if latest_id is None or id_int > latest_id: # followers_count of the latest tweet of the user
+                latest_id = id_int
+                user_row[1] = int(doc['user'].get('followers_count') or 0)
+            kws_mask = matcher.mask(doc.get('text'))
+            user_row[2] += 1
+            for kw_ind in range(len(kws_lst)):
+                user_row[3 + kw_ind] += (kws_mask >> kw_ind) & 1
+            tweet_rows_lst.append((user_id_int, int(doc.get('retweet_count') or 0), kws_mask))
+        if user_row is not None:
+            user_rows_lst.append(user_row)
+    flush()
+    
+    sketch_set.save(output_file)
+    stats.finish()
+    print('Process{}/{} Done'.format(batch_i, process_n))
+
+
+'''
+Rollup cube of tweet counts by hour, keyword, tweet type and affiliation (see rollup_cube.py)
+'''
+@instrumentation.instrumented
+def worker_rollup_tweets(db_name, collection_name, batch_i, process_n, output_file, kws_lst, id_ranges_queue=None,
+                         filter=None, aff_kw='ibm', chunk_size=10000, instrument=None):
+    """
+    Count (a batch of) tweets into a partial rollup_cube.RollupCube, merged by the parent.
+    Times come from utilities.get_tweets_timestamps, keywords are matched in the 'text' field
+    and the affiliation keyword in the 'user.description' field.
+    
+    :param db_name: the name of the MongoDB database (local) to work on
+    :param collection_name: the name of the collection in the database to work on, e.g. TW_RAW_COL
+    :param batch_i: the index of this batch, from 0 to processes number minus 1
+    :param process_n: the total nubmer of processes working together
+    :param output_file: the directory this processing saves its partial cube into
+    :param kws_lst: a list of keywords, at most kws_index.MAX_MASK_KWS
+    :param id_ranges_queue: shared queue of '_id' ranges (see utilities.gen_id_ranges_queue), required
+    :param filter: extra filter dict of the tweets to count, e.g. the tweets not counted yet (see RollupCube.pending_filter)
+    :param aff_kw: the keyword of the affiliation
+    :param chunk_size: number of tweets counted at a time
+    :param instrument: instrumentation.Instrument obj collecting stats of this process, None for no instrumentation
+    """
+    if len(kws_lst) > MAX_MASK_KWS:
+        raise ValueError('At most {} keywords per bitmask, got {}'.format(MAX_MASK_KWS, len(kws_lst)))
+    
+    check_id_ranges_queue(id_ranges_queue)
+    stats = instrumentation.start(instrument, batch_i, process_n)
+    collection = mongodb.initialize(db_name=db_name, collection_name=collection_name)
+    cursors = iter_batch_cursors(collection, batch_i, process_n, projection=rollup_cube.ROLLUP_PROJECTION,
+                                 id_ranges_queue=id_ranges_queue, filter=filter)
+    
+    matcher = keywords_matcher.get_matcher(kws_lst)
+    aff_matcher = keywords_matcher.get_matcher([aff_kw])
+    cube = rollup_cube.RollupCube(kws_lst, aff_kw=aff_kw)
+    for range_i, cursor in cursors:
+        for docs_lst in utilities.iter_chunks(stats.iter_docs(cursor), chunk_size):
+            timestamps = utilities.get_tweets_timestamps(docs_lst)
+            kws_masks = np.array([matcher.mask(doc.get('text')) for doc in docs_lst], dtype=np.int64)
+            types = np.array([rollup_cube.tweet_type(doc) for doc in docs_lst], dtype=np.int64)
+            affs = np.array([aff_matcher.test(doc.get('user', {}).get('description')) for doc in docs_lst],
+                            dtype=np.int64)
+            cube.add(timestamps, kws_masks, types, affs)
+    
+    cube.save(output_file)
+    stats.finish()
+    print('Process{}/{} Done'.format(batch_i, process_n))
+
+
+'''
+20170921-user_tweets_sentiment
+Build the (preprocessed) documents of all tweets of each user, with term frequencies
+'''
+@instrumentation.instrumented
+def worker_build_user_corpora(db_name, collection_name, batch_i, process_n, output_file, user_ids=None,
+                              id_ranges_queue=None, stopwords=None, chunk_size=10000, instrument=None):
+    """
+    Build the corpus of (a batch of) users in one scan of their tweets: tweets are read by 'user.id' ranges
+    sorted by 'user.id', so that all tweets of a user come in a row, and the documents of a chunk of users
+    are preprocessed as one batch (see tweet_text.preprocess_tweets).
+    One document is written per user: {'user_id', 'tweets_num', 'tokens_num', 'text', 'tf'}, where 'text' is
+    the preprocessed user document and 'tf' the frequencies of its terms (see tweet_text.term_frequencies).
+    
+    :param db_name: the name of the MongoDB database (local) to work on
+    :param collection_name: the name of the collection in the database to work on, e.g. TW_NT_COL
+    :param batch_i: the index of this batch, from 0 to processes number minus 1
+    :param process_n: the total nubmer of processes working together
+    :param output_file: the name/path of the intermediate output file this processing writes into, or a sink obj (see sinks.py)
+    :param user_ids: shared_ids.SharedIds obj of the users to build corpora for, None for all users;
+                     the ids of each range are filtered by the server if there are at most MAX_IN_FILTER_IDS of them
+    :param id_ranges_queue: shared queue of 'user.id' ranges (see utilities.gen_id_ranges_queue), required
+    :param stopwords: set of lowercase words left out of 'tf', e.g. wordcloud.STOPWORDS
+    :param chunk_size: number of tweets of the users preprocessed at a time
+    :param instrument: instrumentation.Instrument obj collecting stats of this process, None for no instrumentation
+    """
+    check_id_ranges_queue(id_ranges_queue)
+    stats = instrumentation.start(instrument, batch_i, process_n)
+    collection = mongodb.initialize(db_name=db_name, collection_name=collection_name)
+    
+    projection = queries.covering_projection(['user.id', 'text']) # minimize I/O bandwidth
+    
+    def gen_range_docs():
+        # the tweets of each range, sorted by 'user.id'
+        for range_i, id_range in iter_batch_id_ranges(id_ranges_queue):
+            print('Process{}/{} reading tweets of range {}: {}...'.format(batch_i, process_n, range_i, id_range))
+            if user_ids is not None:
+                # ids of the users within the range: a contiguous slice of the sorted shared ids
+                lower, upper = id_range[:2]
+                ids = user_ids.array
+                range_ids = ids[np.searchsorted(ids, lower) if lower is not None else 0:
+                                np.searchsorted(ids, upper) if upper is not None else len(ids)]
+                if not len(range_ids):
+                    continue
+                if len(range_ids) <= MAX_IN_FILTER_IDS:
+                    yield stats.iter_docs(queries.find_in(collection, 'user.id', range_ids, projection=projection,
+                                                          chunk_size=IN_FILTER_CHUNK_SIZE))
+                    continue
+            cursor = collection.find(filter=mongodb.gen_id_range_filter(id_range, field='user.id'),
+                                     sort=[('user.id', pymongo.ASCENDING)], projection=projection)
+            if mongodb.CURSOR_BATCH_SIZE:
+                cursor = cursor.batch_size(mongodb.CURSOR_BATCH_SIZE)
+            if user_ids is None:
+                yield stats.iter_docs(cursor)
+            else: # too many ids for the server, tested here
+                yield (doc for docs_lst in utilities.iter_chunks(stats.iter_docs(cursor), chunk_size)
+                       for doc, doc_is_user in zip(docs_lst, user_ids.isin([doc['user']['id'] for doc in docs_lst]))
+                       if doc_is_user)
+    
+    def write_users(users_lst, sink):
+        # preprocess the documents of a chunk of users as one batch
+        texts_lst = tweet_text.preprocess_tweets([tweet_text.raw_user_document(user_texts_lst)
+                                                  for _, user_texts_lst in users_lst])
+        for (user_id, user_texts_lst), text in zip(users_lst, texts_lst):
+            tf = tweet_text.term_frequencies(text)
+            tokens_num = sum(tf.values())
+            for word in stopwords or ():
+                tf.pop(word, None)
+            sink.write({'user_id': user_id, 'tweets_num': len(user_texts_lst), 'tokens_num': tokens_num,
+                        'text': text, 'tf': dict(tf)})
+    
+    with stats.wrap_sink(sinks.open_sink(output_file)) as sink:
+        users_lst = [] # (user id, a list of texts) of the users of the current chunk
+        texts_n = 0
+        for docs in gen_range_docs():
+            for user_id, user_docs_lst in queries.iter_groups(docs, 'user.id'):
+                users_lst.append((int(user_id), [doc.get('text') or '' for doc in user_docs_lst]))
+                texts_n += len(user_docs_lst)
+                if texts_n >= chunk_size: # only flush between users, a user may have more tweets
+                    write_users(users_lst, sink)
+                    users_lst, texts_n = [], 0
+        if users_lst:
+            write_users(users_lst, sink)
+    stats.finish()
+    print('Process{}/{} Done'.format(batch_i, process_n))
@@ -0,0 +1,541 @@
+"""
+Declarative pipeline runner for the chain of derived collections and pickles of config.py
+
+Each stage declares its inputs and outputs (collections or files) and a run function.
+A stage is skipped when the fingerprints of its inputs and outputs are the same as after its last successful run
+(kept in PIPELINE_STATE_FILE), i.e. when its outputs are up to date with its inputs.
+Stages whose inputs are ready run at the same time, and all their worker processes come from one shared pool
+of warm processes (see worker_pool.py), so that a full refresh only does the necessary work with as much parallelism as the pool allows.
+
+Usage: python pipeline.py [--dry-run] [--force STAGE ...] [TARGET_STAGE ...]
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+
+import pandas as pd
+import pymongo
+
+import ids_store
+import influence
+import keywords_matcher
+import kws_index
+import mongodb
+import multiprocessing_workers
+import rollup_cube
+import shared_ids
+import sinks
+import sketches
+import utilities
+import worker_pool
+from config import * # import all global config variables
+
+
+class CollectionArtifact(object):
+    """
+    A MongoDB collection, fingerprinted by its number of documents and its last '_id'
+    """
+
+    def __init__(self, collection_name):
+        self.collection_name = collection_name
+        self.key = 'collection:' + collection_name
+
+    def fingerprint(self, db):
+        """
+        :return: fingerprint string, None if the collection does not exist
+        """
+        if self.collection_name not in db.list_collection_names():
+            return None
+        collection = db[self.collection_name]
+        last_doc = collection.find_one(sort=[('_id', pymongo.DESCENDING)], projection={'_id': 1})
+        return '{}:{}'.format(collection.estimated_document_count(), last_doc['_id'] if last_doc else None)
+
+    def clear(self, db):
+        db[self.collection_name].drop()
+
+
+class FileArtifact(object):
+    """
+    A file (pickle, .npy), fingerprinted by its size and modification time
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.key = 'file:' + path
+
+    def fingerprint(self, db):
+        if not os.path.exists(self.path):
+            return None
+        stat = os.stat(self.path)
+        return '{}:{}'.format(stat.st_size, stat.st_mtime_ns)
+
+    def clear(self, db):
+        pass # overwritten by the stage
+
+
+def col(collection_name):
+    return CollectionArtifact(collection_name)
+
+
+def file(path):
+    return FileArtifact(path)
+
+
+class Stage(object):
+    """
+    One step of a pipeline
+    """
+
+    def __init__(self, name, inputs, outputs, run, params=None):
+        """
+        :param name: the name of the stage
+        :param inputs: a list of artifacts (see col and file) the stage reads
+        :param outputs: a list of artifacts the stage (re)builds; output collections are dropped before running
+        :param run: function taking a StageContext obj
+        :param params: JSON serializable parameters of the stage; changing them makes the stage run again
+        """
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.run = run
+        self.params = params or {}
+
+
+class StageContext(object):
+    """
+    What a stage's run function gets: the database, the shared worker pool, and helpers to fan out workers
+    """
+
+    def __init__(self, pipeline, stage):
+        self.pipeline = pipeline
+        self.stage = stage
+        self.db_name = pipeline.db_name
+        self.db = pipeline.db
+        self.process_n = pipeline.process_n
+
+    def gen_id_ranges_queue(self, collection_name, ranges_per_process=10, field='_id', filter=None):
+        """
+        Queue of ranges shared by the workers of this stage (see utilities.gen_id_ranges_queue),
+        created with the pipeline's manager so that it can be passed to pool tasks
+        """
+        id_ranges = mongodb.gen_id_ranges(self.db[collection_name], self.process_n * ranges_per_process,
+                                          sample_size=self.pipeline.ranges_sample_size, field=field, filter=filter)
+        return utilities.gen_id_ranges_queue(id_ranges, self.process_n, manager=self.pipeline.get_manager())
+
+    def run_workers(self, target, gen_args):
+        """
+        Run a worker function for batch_i in range(process_n) on the shared pool and wait for all of them
+
+        :param target: worker function (see multiprocessing_workers.py)
+        :param gen_args: function taking batch_i and returning the args of the worker
+        """
+        self.pipeline.pool.run(target, gen_args, self.process_n)
+
+    def gen_sink(self, collection_name, **sink_options):
+        """
+        Sink writing straight into an output collection, passed to workers as their output_file
+        """
+        return sinks.MongoBulkSink(self.db_name, collection_name, **sink_options)
+
+
+class Pipeline(object):
+    """
+    Run stages in dependency order, skipping up to date stages and running ready stages in parallel
+    """
+
+    def __init__(self, stages, db_name=DB_NAME, state_file=PIPELINE_STATE_FILE, process_n=None, max_parallel_stages=4,
+                 ranges_sample_size=None, pool=None):
+        """
+        :param stages: a list of Stage objs
+        :param db_name: the name of the MongoDB database
+        :param state_file: JSON file of the fingerprints of the last successful run of each stage
+        :param process_n: number of processes of the shared pool, CPU numbers minus 1 by default
+        :param max_parallel_stages: max number of stages running at the same time
+        :param ranges_sample_size: see mongodb.gen_id_ranges, None for exact split points of '_id' ranges
+        :param pool: worker_pool.WarmPool obj to run the workers on and keep warm across runs,
+                     None to start a pool for each run
+        """
+        self.stages = {stage.name: stage for stage in stages}
+        if len(self.stages) < len(stages):
+            raise ValueError('Stage names are not unique: {}'.format([stage.name for stage in stages]))
+        self.db_name = db_name
+        self.db = mongodb.initialize_db(db_name)
+        self.state_file = state_file
+        self.process_n = process_n or max(multiprocessing.cpu_count() - 1, 1)
+        self.max_parallel_stages = max_parallel_stages
+        self.ranges_sample_size = ranges_sample_size
+        self.pool = pool
+        self.own_pool = pool is None
+        self.manager = None
+        self.state_lock = threading.Lock()
+
+        producers = {}
+        for stage in stages:
+            for artifact in stage.outputs:
+                if artifact.key in producers:
+                    raise ValueError('{} is an output of both {} and {}'.format(artifact.key, producers[artifact.key], stage.name))
+                producers[artifact.key] = stage.name
+        self.deps = {stage.name: {producers[artifact.key] for artifact in stage.inputs if artifact.key in producers}
+                     for stage in stages}
+        self.toposort(set(self.stages)) # fail on dependency cycles before running anything
+
+    def get_manager(self):
+        if self.manager is None:
+            self.manager = multiprocessing.Manager()
+        return self.manager
+
+    def load_state(self):
+        if os.path.exists(self.state_file):
+            with open(self.state_file) as f:
+                return json.load(f)
+        return {}
+
+    def save_stage_state(self, stage_name, stage_state):
+        with self.state_lock:
+            state = self.load_state()
+            state[stage_name] = stage_state
+            tmp_file = self.state_file + '.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump(state, f, indent=2)
+            os.replace(tmp_file, self.state_file)
+
+    def fingerprint_stage(self, stage):
+        """
+        :return: (fingerprint of params and inputs, dict of output fingerprints)
+        """
+        inputs_fp = {artifact.key: artifact.fingerprint(self.db) for artifact in stage.inputs}
+        missing_inputs = [key for key, fp in inputs_fp.items() if fp is None]
+        if missing_inputs:
+            raise RuntimeError('Stage {}: missing inputs {}'.format(stage.name, missing_inputs))
+        key_str = json.dumps({'params': stage.params, 'inputs': inputs_fp}, sort_keys=True, default=str)
+        return (hashlib.sha1(key_str.encode('utf-8')).hexdigest(),
+                {artifact.key: artifact.fingerprint(self.db) for artifact in stage.outputs})
+
+    def is_up_to_date(self, stage):
+        stage_state = self.load_state().get(stage.name)
+        if stage_state is None:
+            return False
+        inputs_fp, outputs_fp = self.fingerprint_stage(stage)
+        return (stage_state['inputs'] == inputs_fp and None not in outputs_fp.values()
+                and stage_state['outputs'] == outputs_fp)
+
+    def select_stages(self, targets=None):
+        """
+        :param targets: names of the stages wanted, None for all
+        :return: set of names of the targets and the stages they depend on
+        """
+        self.check_stage_names(targets or ())
+        selected = set()
+        todo = list(targets or self.stages)
+        while todo:
+            name = todo.pop()
+            if name not in selected:
+                selected.add(name)
+                todo.extend(self.deps[name])
+        return selected
+
+    def check_stage_names(self, names):
+        unknown = sorted(set(names) - set(self.stages))
+        if unknown:
+            raise ValueError('Unknown stages {}, the stages are {}'.format(unknown, sorted(self.stages)))
+
+    def run_stage(self, stage, force=False):
+        """
+        Run one stage unless it is up to date
+
+        :return: True if the stage ran, False if it was skipped
+        """
+        if not force and self.is_up_to_date(stage):
+            print('Stage {}: up to date, skipped'.format(stage.name))
+            return False
+        inputs_fp, _ = self.fingerprint_stage(stage)
+        print('Stage {}: running...'.format(stage.name))
+        start = time.perf_counter()
+        for artifact in stage.outputs:
+            artifact.clear(self.db)
+        stage.run(StageContext(self, stage))
+        _, outputs_fp = self.fingerprint_stage(stage)
+        self.save_stage_state(stage.name, {'inputs': inputs_fp, 'outputs': outputs_fp,
+                                           'seconds': time.perf_counter() - start,
+                                           'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S')})
+        print('Stage {}: done in {:.1f}s'.format(stage.name, time.perf_counter() - start))
+        return True
+
+    def run(self, targets=None, force=(), dry_run=False):
+        """
+        Run the targets and the stages they depend on
+
+        :param targets: names of the stages wanted, None for all
+        :param force: names of stages to run even if up to date (their dependents then run too)
+        :param dry_run: bool value indicates whether to only print which stages are out of date
+        :return: dict of stage name -> 'ran', 'skipped', or 'failed'/'blocked'
+        """
+        selected = self.select_stages(targets)
+        self.check_stage_names(force)
+        if dry_run:
+            for name in self.toposort(selected):
+                deps_stale = any(not self.is_up_to_date(self.stages[dep]) for dep in self.deps[name] if dep in selected)
+                try:
+                    up_to_date = not deps_stale and name not in force and self.is_up_to_date(self.stages[name])
+                except RuntimeError as e:
+                    up_to_date = False
+                    print(e)
+                print('Stage {}: {}'.format(name, 'up to date' if up_to_date else 'to run'))
+            return {}
+
+        results = {}
+        if self.own_pool:
+            self.pool = worker_pool.WarmPool(self.process_n, kws_lsts=[['ibm']])
+        try:
+            with concurrent.futures.ThreadPoolExecutor(self.max_parallel_stages) as executor:
+                running = {}
+                order = self.toposort(selected) # so that a failure is passed down to all its dependents in one pass
+                while len(results) < len(selected):
+                    for name in order:
+                        if name in results or name in running.values():
+                            continue
+                        deps = self.deps[name] & selected
+                        if any(results.get(dep) in ('failed', 'blocked') for dep in deps):
+                            results[name] = 'blocked'
+                        elif all(dep in results for dep in deps):
+                            # an upstream stage that ran changed the inputs, so the fingerprints decide
+                            future = executor.submit(self.run_stage, self.stages[name], name in force)
+                            running[future] = name
+                    if not running:
+                        if len(results) < len(selected): # nothing runnable and nothing running
+                            raise RuntimeError('Stages {} can never run, their dependencies are not met'.format(
+                                sorted(selected - set(results))))
+                        continue
+                    done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        name = running.pop(future)
+                        try:
+                            results[name] = 'ran' if future.result() else 'skipped'
+                        except Exception as e:
+                            print('Stage {}: failed: {!r}'.format(name, e))
+                            results[name] = 'failed'
+        finally:
+            if self.own_pool:
+                self.pool.close()
+                self.pool = None
+            if self.manager is not None:
+                self.manager.shutdown()
+                self.manager = None
+        print('Pipeline: {}'.format(results))
+        return results
+
+    def toposort(self, selected):
+        """
+        :param selected: set of names of stages
+        :return: a list of the names, each stage after the stages it depends on
+        """
+        order = []
+        visited = set()
+        path = [] # stages being visited, each one depending on the next one
+
+        def visit(name):
+            if name in visited:
+                return
+            if name in path:
+                cycle = path[path.index(name):] + [name]
+                raise ValueError('Dependency cycle between stages: {}'.format(' -> '.join(cycle)))
+            path.append(name)
+            for dep in sorted(self.deps[name] & selected):
+                visit(dep)
+            path.pop()
+            visited.add(name)
+            order.append(name)
+
+        for name in sorted(selected):
+            visit(name)
+        return order
+
+
+"""
+Stages of the IBM influence chain:
+TW_RAW_COL -> TW_NT_COL/TW_RT_COL -> TW_NT_TXT_IBM_TAG_COL (-> keyword index), USER_NT_COL -> USER_NT_IBM_DESC_IDS_LST_PKL
+-> TW_RT_IBM_TW_COL -> IBM_CASCADE_PKL -> IBM_INFLUENCE_PKL (with SIMPLE_INFLUENCE_PKL and IBM_FOLLOWERS_PKL)
+TW_NT_COL/TW_RT_COL (with USER_NT_IBM_DESC_IDS_LST_PKL) -> streaming sketches in SKETCHES_DIR
+TW_RAW_COL -> rollup cube of tweet counts in TW_ROLLUP_DIR (updated incrementally)
+"""
+
+
+def run_split_raw(ctx):
+    """
+    Split TW_RAW_COL into native tweets and retweets (see 20170414-clean_raw_data)
+    """
+    tw_raw_col = ctx.db[TW_RAW_COL]
+    for collection_name, match in [(TW_NT_COL, {'retweeted_status': {'$exists': False}}),
+                                   (TW_RT_COL, {'retweeted_status': {'$exists': True}})]:
+        tw_raw_col.aggregate(pipeline=[{'$match': match}, {'$out': collection_name}], allowDiskUse=True)
+        ctx.db[collection_name].create_index([('user.id', pymongo.ASCENDING)])
+    ctx.db[TW_RT_COL].create_index([('retweeted_status.user.id', pymongo.ASCENDING)])
+
+
+def run_tag_nt_txt_ibm(ctx):
+    id_ranges_queue = ctx.gen_id_ranges_queue(TW_NT_COL)
+    sink = ctx.gen_sink(TW_NT_TXT_IBM_TAG_COL)
+    ctx.run_workers(multiprocessing_workers.worker_tag_kws_in_tw,
+                    lambda batch_i: (ctx.db_name, TW_NT_COL, batch_i, ctx.process_n, sink, ['ibm'], id_ranges_queue))
+
+
+def run_kws_index_nt_ibm(ctx):
+    kws_index.build_kws_index(['ibm'], db_name=ctx.db_name, collection_name=TW_NT_TXT_IBM_TAG_COL)
+
+
+def run_user_nt(ctx):
+    id_ranges_queue = ctx.gen_id_ranges_queue(TW_NT_COL, field='user.id')
+    sink = ctx.gen_sink(USER_NT_COL)
+    ctx.run_workers(multiprocessing_workers.worker_get_unique_user,
+                    lambda batch_i: (ctx.db_name, TW_NT_COL, batch_i, ctx.process_n, sink, None, 1000, id_ranges_queue))
+
+
+def run_user_nt_ibm_desc_ids(ctx, keyword='ibm'):
+    """
+    Ids of users of native tweets with/without keyword 'ibm' in their 'description' field (see 20170503-user_affiliation)
+    """
+    matcher = keywords_matcher.get_matcher([keyword])
+    ibm_ids_lst, nonibm_ids_lst = [], []
+    for doc in ctx.db[USER_NT_COL].find(projection={'_id': 0, 'id': 1, 'description': 1}):
+        (ibm_ids_lst if matcher.test(doc.get('description')) else nonibm_ids_lst).append(doc['id'])
+    ids_store.save_ids(ibm_ids_lst, USER_NT_IBM_DESC_IDS_LST_PKL)
+    ids_store.save_ids(nonibm_ids_lst, USER_NT_NONIBM_DESC_IDS_LST_PKL)
+
+
+def run_tw_rt_ibm_tw(ctx):
+    id_ranges_queue = ctx.gen_id_ranges_queue(TW_RT_COL)
+    sink = ctx.gen_sink(TW_RT_IBM_TW_COL)
+    with shared_ids.SharedIds(ids_store.load_ids(USER_NT_IBM_DESC_IDS_LST_PKL)) as ibm_user_ids:
+        ctx.run_workers(multiprocessing_workers.worker_filter_rt_ibm_tweets,
+                        lambda batch_i: (ctx.db_name, TW_RT_COL, batch_i, ctx.process_n, sink, ibm_user_ids, id_ranges_queue))
+    ctx.db[TW_RT_IBM_TW_COL].create_index([('user.id', pymongo.ASCENDING)])
+
+
+def run_sketches(ctx, collection_name, keyword='ibm'):
+    """
+    Sketches of distinct users, followers_count, retweet_count and proportion of keyword tweets, for all users
+    and for IBM/non-IBM users (by 'description'), merged from the sketches of the workers (see sketches.py)
+    """
+    id_ranges_queue = ctx.gen_id_ranges_queue(collection_name, field='user.id')
+    inter_files = utilities.gen_inter_filenames_list('pipeline', 'sketches_' + collection_name, ctx.process_n, 'npz')
+    with shared_ids.SharedIds(ids_store.load_ids(USER_NT_IBM_DESC_IDS_LST_PKL)) as ibm_user_ids, \
+            shared_ids.SharedIds(ids_store.load_ids(USER_NT_NONIBM_DESC_IDS_LST_PKL)) as nonibm_user_ids:
+        user_groups = {'ibm_users': ibm_user_ids, 'nonibm_users': nonibm_user_ids}
+        ctx.run_workers(multiprocessing_workers.worker_sketch_tweets,
+                        lambda batch_i: (ctx.db_name, collection_name, batch_i, ctx.process_n, inter_files[batch_i],
+                                         [keyword], id_ranges_queue, user_groups))
+    sketch_set = sketches.merge_sketch_files(inter_files)
+    os.makedirs(SKETCHES_DIR, exist_ok=True)
+    sketch_set.save(os.path.join(SKETCHES_DIR, collection_name + '.npz'))
+    for inter_file in inter_files:
+        os.remove(inter_file)
+
+
+def run_tw_rollup(ctx, kws_lst=API_QUERY_KWS, aff_kw='ibm'):
+    """
+    Count the tweets of TW_RAW_COL not counted yet into the rollup cube (see rollup_cube.py),
+    from scratch if the keywords changed
+    """
+    cube = rollup_cube.RollupCube.load_or_create(TW_ROLLUP_DIR, kws_lst, aff_kw=aff_kw)
+    pending_filter, last_id = cube.pending_filter(ctx.db[TW_RAW_COL])
+    if pending_filter is None:
+        print('Rollup cube up to date')
+        return
+    id_ranges_queue = ctx.gen_id_ranges_queue(TW_RAW_COL, filter=pending_filter)
+    inter_files = utilities.gen_inter_filenames_list('pipeline', 'tw_rollup', ctx.process_n, 'rollup')
+    ctx.run_workers(multiprocessing_workers.worker_rollup_tweets,
+                    lambda batch_i: (ctx.db_name, TW_RAW_COL, batch_i, ctx.process_n, inter_files[batch_i], kws_lst,
+                                     id_ranges_queue, pending_filter, aff_kw))
+    for inter_file in inter_files:
+        cube.merge(rollup_cube.RollupCube.load(inter_file))
+        shutil.rmtree(inter_file)
+    cube.watermark = last_id
+    cube.save(TW_ROLLUP_DIR)
+
+
+def run_simple_influence(ctx):
+    acc = influence.InfluenceAccumulator()
+    acc.scan_collection(ctx.db[TW_NT_COL], acc.add_native_tweets, influence.NATIVE_PROJECTION)
+    df = influence.influence_table(acc)
+    df = df[['uid', 'fo', 'n_n', 'n_src', 'q_n', 'q_src', 'p_n', 'p_src', 'nr_n', 'nr_src', 'simple_inf']]
+    df.to_pickle(SIMPLE_INFLUENCE_PKL)
+
+
+def run_ibm_cascade(ctx, keyword='ibm'):
+    """
+    Retweets of IBM users' tweets on all/IBM/non-IBM users, per IBM user (see 20170507-compare_influence_inside_outside)
+    """
+    matcher = keywords_matcher.get_matcher([keyword])
+    cursor = ctx.db[TW_RT_IBM_TW_COL].find(projection={'_id': 0, 'user.description': 1, 'retweeted_status.id': 1,
+                                                       'retweeted_status.user.id': 1,
+                                                       'retweeted_status.user.followers_count': 1})
+    rows_lst = [(doc['retweeted_status']['user']['id'], doc['retweeted_status']['user'].get('followers_count', 0),
+                 doc['retweeted_status']['id'], matcher.test(doc['user'].get('description'))) for doc in cursor]
+    df_rt = pd.DataFrame(rows_lst, columns=['uid', 'fo', 'tid', 'ibm'])
+    df = df_rt.groupby('uid').agg(fo=('fo', 'first'), all_n=('tid', 'nunique'), all_srt=('tid', 'size'))
+    for label, mask in [('ibm', df_rt['ibm']), ('nonibm', ~df_rt['ibm'])]:
+        df_sub = df_rt[mask].groupby('uid').agg(**{label + '_n': ('tid', 'nunique'), label + '_srt': ('tid', 'size')})
+        df = df.join(df_sub, how='left')
+    df.reset_index().to_pickle(IBM_CASCADE_PKL)
+
+
+def run_ibm_influence(ctx):
+    """
+    Merge IBM_CASCADE_PKL, IBM_FOLLOWERS_PKL and number of native tweets from SIMPLE_INFLUENCE_PKL
+    (see 20170507-compare_influence_inside_outside)
+    """
+    df = pd.merge(pd.read_pickle(IBM_CASCADE_PKL), pd.read_pickle(IBM_FOLLOWERS_PKL), on='uid', how='left')
+    df_simple = pd.read_pickle(SIMPLE_INFLUENCE_PKL)[['uid', 'n_n']].rename(columns={'n_n': 'native_n'})
+    df = pd.merge(df, df_simple, on='uid', how='left')
+    df.to_pickle(IBM_INFLUENCE_PKL)
+
+
+def build_ibm_influence_pipeline(db_name=DB_NAME, **pipeline_options):
+    """
+    :return: Pipeline obj of the IBM influence chain
+    """
+    user_nt_ibm_desc_ids = file(ids_store.ids_npy_path(USER_NT_IBM_DESC_IDS_LST_PKL))
+    user_nt_nonibm_desc_ids = file(ids_store.ids_npy_path(USER_NT_NONIBM_DESC_IDS_LST_PKL))
+    stages = [Stage('split_raw', [col(TW_RAW_COL)], [col(TW_NT_COL), col(TW_RT_COL)], run_split_raw),
+              Stage('tag_nt_txt_ibm', [col(TW_NT_COL)], [col(TW_NT_TXT_IBM_TAG_COL)], run_tag_nt_txt_ibm,
+                    params={'kws_lst': ['ibm']}),
+              Stage('kws_index_nt_ibm', [col(TW_NT_TXT_IBM_TAG_COL)],
+                    [file(os.path.join(KWS_INDEX_DIR, TW_NT_TXT_IBM_TAG_COL, 'kws.json'))], run_kws_index_nt_ibm),
+              Stage('user_nt', [col(TW_NT_COL)], [col(USER_NT_COL)], run_user_nt),
+              Stage('user_nt_ibm_desc_ids', [col(USER_NT_COL)],
+                    [user_nt_ibm_desc_ids, user_nt_nonibm_desc_ids],
+                    run_user_nt_ibm_desc_ids, params={'keyword': 'ibm'}),
+              Stage('tw_rt_ibm_tw', [col(TW_RT_COL), user_nt_ibm_desc_ids], [col(TW_RT_IBM_TW_COL)], run_tw_rt_ibm_tw),
+              Stage('sketches_nt', [col(TW_NT_COL), user_nt_ibm_desc_ids, user_nt_nonibm_desc_ids],
+                    [file(os.path.join(SKETCHES_DIR, TW_NT_COL + '.npz'))],
+                    lambda ctx: run_sketches(ctx, TW_NT_COL), params={'keyword': 'ibm'}),
+              Stage('sketches_rt', [col(TW_RT_COL), user_nt_ibm_desc_ids, user_nt_nonibm_desc_ids],
+                    [file(os.path.join(SKETCHES_DIR, TW_RT_COL + '.npz'))],
+                    lambda ctx: run_sketches(ctx, TW_RT_COL), params={'keyword': 'ibm'}),
+              Stage('tw_rollup', [col(TW_RAW_COL)], [file(os.path.join(TW_ROLLUP_DIR, 'meta.json'))], run_tw_rollup,
+                    params={'kws_lst': API_QUERY_KWS, 'aff_kw': 'ibm'}),
+              Stage('simple_influence', [col(TW_NT_COL)], [file(SIMPLE_INFLUENCE_PKL)], run_simple_influence),
+              Stage('ibm_cascade', [col(TW_RT_IBM_TW_COL)], [file(IBM_CASCADE_PKL)], run_ibm_cascade,
+                    params={'keyword': 'ibm'}),
+              Stage('ibm_influence', [file(IBM_CASCADE_PKL), file(IBM_FOLLOWERS_PKL), file(SIMPLE_INFLUENCE_PKL)],
+                    [file(IBM_INFLUENCE_PKL)], run_ibm_influence)]
+    return Pipeline(stages, db_name=db_name, **pipeline_options)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Refresh the IBM influence chain of derived collections and pickles')
+    parser.add_argument('targets', nargs='*', help='stages to bring up to date, all by default')
+    parser.add_argument('--force', nargs='*', default=[], help='stages to run even if up to date')
+    parser.add_argument('--process-n', type=int, default=None)
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    build_ibm_influence_pipeline(process_n=args.process_n).run(targets=args.targets or None, force=args.force,
+                                                               dry_run=args.dry_run)
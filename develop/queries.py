@@ -0,0 +1,122 @@
+"""
+Query layer pushing filters on lists of ids to the server
+
+Instead of scanning a collection and filtering in Python, or running one find() per id,
+a list of ids is sorted, split into '$in' batches on an indexed field (e.g. 'user.id', 'retweeted_status.user.id'),
+and each batch is queried sorted by that field, so that documents arrive grouped by id in one pass
+and only the matching documents (with only the projected fields) are transferred.
+See async_queries.find_grouped for the concurrent version.
+"""
+
+import itertools
+
+import numpy as np
+import pymongo
+
+import mongodb
+
+
+def to_in_list(ids):
+    """
+    Turn ids into a sorted list of unique Python ints, as stored in MongoDB ('$in' does not match NumPy ints)
+
+    :param ids: iterable of ids
+    :return: a list of ints
+    """
+    if not isinstance(ids, np.ndarray):
+        ids = list(ids)
+    return np.unique(np.asarray(ids, dtype=np.int64)).tolist() # IMPORTANT force int64 type
+
+
+def chunk_ids(ids, chunk_size=10000):
+    """
+    Split ids into sorted '$in' batches
+
+    :param ids: iterable of ids
+    :param chunk_size: maximum number of ids per batch
+    :return: generator of lists of ints, each batch covering a contiguous range of ids
+    """
+    ids_lst = to_in_list(ids)
+    for s_ind in range(0, len(ids_lst), chunk_size):
+        yield ids_lst[s_ind: s_ind + chunk_size]
+
+
+def gen_in_filter(key, ids_lst, filter=None):
+    """
+    :param key: the (indexed) field the ids are on, e.g. 'user.id'
+    :param ids_lst: a list of ids, see to_in_list
+    :param filter: extra filter dict combined with the '$in' condition
+    :return: filter dict
+    """
+    in_filter = dict(filter) if filter else {}
+    in_filter[key] = {'$in': ids_lst}
+    return in_filter
+
+
+def covering_projection(fields):
+    """
+    Projection of only the given fields, without '_id', so that the query is covered (answered from the index
+    without fetching documents) when an index holds all of them, e.g. ['user.id', 'id']
+
+    :param fields: a list of field names
+    :return: projection dict
+    """
+    projection = {'_id': 0}
+    projection.update((field, 1) for field in fields)
+    return projection
+
+
+def get_field(doc, key):
+    """
+    Get the value of a (dotted) field of a document, e.g. get_field(tweet, 'user.id')
+    """
+    for part in key.split('.'):
+        doc = doc[part]
+    return doc
+
+
+def find_in(collection, key, ids, filter=None, projection=None, chunk_size=10000, hint=None):
+    """
+    Find documents whose key is in a list of ids, in '$in' batches, sorted by key
+
+    :param collection: the collection obj
+    :param key: the (indexed) field the ids are on
+    :param ids: iterable of ids
+    :param filter: extra filter dict
+    :param projection: projection dict, see covering_projection
+    :param chunk_size: maximum number of ids per '$in' query
+    :param hint: index to force, e.g. [('user.id', 1)], None to let the server choose
+    :return: generator of documents, sorted by key across batches
+    """
+    for ids_lst in chunk_ids(ids, chunk_size):
+        cursor = collection.find(filter=gen_in_filter(key, ids_lst, filter), projection=projection,
+                                 sort=[(key, pymongo.ASCENDING)])
+        if hint is not None:
+            cursor = cursor.hint(hint)
+        if mongodb.CURSOR_BATCH_SIZE:
+            cursor = cursor.batch_size(mongodb.CURSOR_BATCH_SIZE)
+        for doc in cursor:
+            yield doc
+
+
+def iter_groups(docs, key):
+    """
+    Group documents sorted by key, e.g. the output of find_in
+
+    :param docs: iterable of documents sorted by key
+    :param key: the (dotted) field to group by
+    :return: generator of (key value, a list of documents) tuples
+    """
+    for value, group in itertools.groupby(docs, key=lambda doc: get_field(doc, key)):
+        yield value, list(group)
+
+
+def find_grouped(collection, key, ids, filter=None, projection=None, chunk_size=10000, hint=None):
+    """
+    Find documents whose key is in a list of ids, grouped by key, e.g. all tweets of each user of a list.
+    Ids without documents are not yielded.
+
+    :return: generator of (id, a list of documents) tuples, in ascending order of ids
+    """
+    return iter_groups(find_in(collection, key, ids, filter=filter, projection=projection,
+                               chunk_size=chunk_size, hint=hint), key)
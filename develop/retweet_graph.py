@@ -0,0 +1,222 @@
+"""
+Compact retweet graph in CSR layout, memory-mapped from disk, for cascade queries without scanning TW_RT_COL
+
+Built once from TW_RT_COL reading only (retweeter id, retweeted tweet id, retweeted author id, timestamp).
+Edges (retweets) are sorted by (author, retweeted tweet, timestamp) and stored as int64 arrays:
+    authors:        sorted unique ids of retweeted authors                              (A)
+    author_indptr:  tweets of authors[a] are tweets[author_indptr[a]:author_indptr[a + 1]] (A + 1)
+    tweets:         ids of retweeted tweets, grouped by author                          (T)
+    tweet_indptr:   retweets of tweets[t] are edges tweet_indptr[t]:tweet_indptr[t + 1]   (T + 1)
+    tweets_order:   argsort of tweets, to look up tweets by id                          (T)
+    retweeters:     ids of the retweeting users                                         (E)
+    timestamps:     Unix timestamps of the retweets                                     (E)
+Retweets of an author are contiguous, so queries on sets of authors or users only touch the slices they need,
+replacing filtered copies of TW_RT_COL such as TW_RT_IBM_TW_COL.
+"""
+
+import os
+
+import numpy as np
+import pymongo
+
+import ids_store
+import mongodb
+import utilities
+from config import * # import all global config variables
+
+
+GRAPH_ARRAYS = ['authors', 'author_indptr', 'tweets', 'tweet_indptr', 'tweets_order', 'retweeters', 'timestamps']
+
+RETWEET_PROJECTION = {'_id': 0, 'user.id': 1, 'retweeted_status.id': 1, 'retweeted_status.user.id': 1,
+                      'timestamp_ms': 1, 'created_at': 1}
+
+
+def ranges_to_inds(starts, ends):
+    """
+    Vectorized concatenation of np.arange(start, end) for each pair of starts/ends
+
+    :param starts: NumPy int array of range starts
+    :param ends: NumPy int array of range ends (exclusive)
+    :return: NumPy int64 array of indices
+    """
+    lengths = ends - starts
+    lengths_sum = int(lengths.sum())
+    if lengths_sum == 0:
+        return np.zeros(0, dtype=np.int64)
+    # each range continues from its own start, i.e. offset by (start - sum of previous lengths)
+    offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return np.arange(lengths_sum, dtype=np.int64) + offsets
+
+
+def build_retweet_graph(db_name=DB_NAME, collection_name=TW_RT_COL, graph_dir=RETWEET_GRAPH_DIR, chunk_size=100000):
+    """
+    Build the retweet graph from a retweets collection and save its arrays into graph_dir
+
+    :param db_name: the name of the MongoDB database
+    :param collection_name: the name of the retweets collection
+    :param graph_dir: directory of the .npy files of the graph
+    :param chunk_size: number of retweets per chunk
+    :return: RetweetGraph obj (memory-mapped)
+    """
+    collection = mongodb.initialize(db_name=db_name, collection_name=collection_name)
+    cursor = collection.find(projection=RETWEET_PROJECTION)
+    if mongodb.CURSOR_BATCH_SIZE:
+        cursor = cursor.batch_size(mongodb.CURSOR_BATCH_SIZE)
+
+    authors_lst, tweets_lst, retweeters_lst, timestamps_lst = [], [], [], []
+    for docs_lst in utilities.iter_chunks(cursor, chunk_size):
+        authors_lst.append(np.array([doc['retweeted_status']['user']['id'] for doc in docs_lst], dtype=np.int64))
+        tweets_lst.append(np.array([doc['retweeted_status']['id'] for doc in docs_lst], dtype=np.int64))
+        retweeters_lst.append(np.array([doc['user']['id'] for doc in docs_lst], dtype=np.int64))
+        timestamps_lst.append(utilities.get_tweets_timestamps(docs_lst, dtype=np.int64))
+    if authors_lst:
+        edge_authors, edge_tweets, retweeters, timestamps = [np.concatenate(arrs) for arrs in
+                                                             [authors_lst, tweets_lst, retweeters_lst, timestamps_lst]]
+    else:
+        edge_authors = edge_tweets = retweeters = timestamps = np.zeros(0, dtype=np.int64)
+    print('Read {} retweets from {}.{}'.format(len(retweeters), db_name, collection_name))
+
+    order = np.lexsort((timestamps, edge_tweets, edge_authors))
+    edge_authors, edge_tweets, retweeters, timestamps = (edge_authors[order], edge_tweets[order],
+                                                         retweeters[order], timestamps[order])
+
+    # first edge of each (author, tweet) group, then first tweet of each author
+    tweet_starts = np.flatnonzero(np.r_[True, (edge_tweets[1:] != edge_tweets[:-1]) |
+                                        (edge_authors[1:] != edge_authors[:-1])]) if len(edge_tweets) else np.zeros(0, dtype=np.int64)
+    tweets = edge_tweets[tweet_starts]
+    tweet_authors = edge_authors[tweet_starts]
+    author_starts = np.flatnonzero(np.r_[True, tweet_authors[1:] != tweet_authors[:-1]]) if len(tweets) else np.zeros(0, dtype=np.int64)
+
+    arrays = {'authors': tweet_authors[author_starts],
+              'author_indptr': np.append(author_starts, len(tweets)).astype(np.int64),
+              'tweets': tweets,
+              'tweet_indptr': np.append(tweet_starts, len(retweeters)).astype(np.int64),
+              'tweets_order': np.argsort(tweets, kind='stable').astype(np.int64),
+              'retweeters': retweeters,
+              'timestamps': timestamps}
+
+    if not os.path.exists(graph_dir):
+        os.makedirs(graph_dir)
+    for name, arr in arrays.items():
+        np.save(os.path.join(graph_dir, name + '.npy'), arr)
+    print('Saved retweet graph of {} authors, {} tweets, {} retweets to {}'.format(len(arrays['authors']), len(tweets),
+                                                                                   len(retweeters), graph_dir))
+    return RetweetGraph(graph_dir)
+
+
+class RetweetGraph(object):
+    """
+    Read-only retweet graph, see build_retweet_graph
+    """
+
+    def __init__(self, graph_dir=RETWEET_GRAPH_DIR, mmap=True):
+        """
+        :param graph_dir: directory of the .npy files of the graph
+        :param mmap: bool value indicates whether to memory-map the arrays instead of reading them into memory
+        """
+        self.graph_dir = graph_dir
+        for name in GRAPH_ARRAYS:
+            setattr(self, name, np.load(os.path.join(graph_dir, name + '.npy'), mmap_mode='r' if mmap else None))
+
+    def author_inds(self, author_ids):
+        """
+        :param author_ids: array-like of author ids
+        :return: NumPy array of the indices of the authors present in the graph
+        """
+        author_ids = ids_store.to_ids_array(author_ids)
+        return np.searchsorted(self.authors, author_ids[ids_store.isin(self.authors, author_ids)])
+
+    def author_edge_ranges(self, author_ids):
+        """
+        :param author_ids: array-like of author ids
+        :return: (author indices, first edges, ends of edges) of the authors present in the graph
+        """
+        inds = self.author_inds(author_ids)
+        return inds, self.tweet_indptr[self.author_indptr[inds]], self.tweet_indptr[self.author_indptr[inds + 1]]
+
+    def edge_inds_of_authors(self, author_ids):
+        """
+        :param author_ids: array-like of author ids
+        :return: NumPy array of the indices of all retweets on tweets of these authors
+        """
+        _, starts, ends = self.author_edge_ranges(author_ids)
+        return ranges_to_inds(starts, ends)
+
+    def retweeters_of(self, author_ids, unique=True):
+        """
+        All retweeters of tweets of an author set
+
+        :param author_ids: array-like of author ids
+        :param unique: bool value indicates whether to return sorted unique ids, or one id per retweet
+        :return: NumPy int64 array of user ids
+        """
+        retweeters = np.asarray(self.retweeters[self.edge_inds_of_authors(author_ids)])
+        return np.unique(retweeters) if unique else retweeters
+
+    def cascade_sizes(self, author_ids=None):
+        """
+        Cascade size (number of retweets) per retweeted tweet
+
+        :param author_ids: array-like of author ids to restrict to, None for all tweets
+        :return: (tweet ids, author ids, cascade sizes) NumPy arrays
+        """
+        if author_ids is None:
+            tweet_inds = np.arange(len(self.tweets))
+            tweet_authors = np.repeat(np.asarray(self.authors), np.diff(self.author_indptr))
+        else:
+            inds = self.author_inds(author_ids)
+            tweet_inds = ranges_to_inds(self.author_indptr[inds], self.author_indptr[inds + 1])
+            tweet_authors = np.repeat(np.asarray(self.authors[inds]), self.author_indptr[inds + 1] - self.author_indptr[inds])
+        sizes = self.tweet_indptr[tweet_inds + 1] - self.tweet_indptr[tweet_inds]
+        return np.asarray(self.tweets[tweet_inds]), tweet_authors, sizes
+
+    def cascade_size(self, tweet_id):
+        """
+        :param tweet_id: id of a retweeted tweet
+        :return: number of retweets of the tweet, 0 if it was never retweeted
+        """
+        ind = np.searchsorted(self.tweets, tweet_id, sorter=self.tweets_order)
+        if ind == len(self.tweets) or self.tweets[self.tweets_order[ind]] != tweet_id:
+            return 0
+        tweet_ind = self.tweets_order[ind]
+        return int(self.tweet_indptr[tweet_ind + 1] - self.tweet_indptr[tweet_ind])
+
+    def in_out_split(self, author_ids, user_ids):
+        """
+        Per author, number of distinct retweeted tweets and of retweets by users inside/outside a user set,
+        as all_n, all_srt, ibm_srt, nonibm_srt of IBM_CASCADE_PKL with the IBM users as user set
+
+        :param author_ids: array-like of author ids
+        :param user_ids: array-like of ids of the users inside
+        :return: dict of NumPy arrays 'uid', 'all_n', 'all_srt', 'in_srt', 'out_srt', one element per author in the graph
+        """
+        inds, starts, ends = self.author_edge_ranges(author_ids)
+        in_mask = ids_store.isin(ids_store.to_ids_array(user_ids), self.retweeters[ranges_to_inds(starts, ends)])
+        all_srt = ends - starts
+        # every author in the graph has at least one retweet, so no empty segments
+        in_srt = np.add.reduceat(in_mask.astype(np.int64), np.cumsum(all_srt) - all_srt) if len(inds) else all_srt
+        return {'uid': np.asarray(self.authors[inds]),
+                'all_n': self.author_indptr[inds + 1] - self.author_indptr[inds],
+                'all_srt': all_srt,
+                'in_srt': in_srt,
+                'out_srt': all_srt - in_srt}
+
+    def retweets_of(self, author_ids):
+        """
+        Retweets of tweets of an author set, as columns
+
+        :param author_ids: array-like of author ids
+        :return: dict of NumPy arrays 'author', 'tweet', 'retweeter', 'timestamp', one element per retweet
+        """
+        inds, starts, ends = self.author_edge_ranges(author_ids)
+        edge_inds = ranges_to_inds(starts, ends)
+        tweet_inds = ranges_to_inds(self.author_indptr[inds], self.author_indptr[inds + 1])
+        tweet_sizes = self.tweet_indptr[tweet_inds + 1] - self.tweet_indptr[tweet_inds]
+        return {'author': np.repeat(np.asarray(self.authors[inds]), ends - starts),
+                'tweet': np.repeat(np.asarray(self.tweets[tweet_inds]), tweet_sizes),
+                'retweeter': np.asarray(self.retweeters[edge_inds]),
+                'timestamp': np.asarray(self.timestamps[edge_inds])}
+
+
+if __name__ == '__main__':
+    build_retweet_graph()
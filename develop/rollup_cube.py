@@ -0,0 +1,265 @@
+"""
+Time-bucketed rollup cube of tweet counts, for time series plots without re-aggregating the tweets
+
+Counts of tweets in an int64 array indexed by (hour, keyword, tweet type, author affiliation):
+    hour:         hours since the Unix epoch, from start_hour on
+    keyword:      ALL_KW (every tweet) then each keyword of kws_lst, e.g. API_QUERY_KWS
+    tweet type:   TWEET_TYPES, native tweet / retweet / quote tweet
+    affiliation:  AFFILIATIONS, whether the author's 'description' mentions the affiliation keyword aff_kw ('ibm')
+The cube is built in parallel by multiprocessing_workers.worker_rollup_tweets (one partial cube per worker,
+merged in the parent) and updated incrementally: the last '_id' counted is kept with the counts,
+so that an update only scans the tweets which arrived since (see pending_filter and pipeline.run_tw_rollup).
+It is saved as counts.npy (memory-mapped when loaded) and meta.json in a directory, e.g.
+    cube = rollup_cube.RollupCube.load(TW_ROLLUP_DIR)
+    cube.series(freq='D')                                   # the tweets collection speed (tw_collection_speed.png)
+    cube.series(kws=['#AI'], types=['rt'], freq='W')        # weekly retweets about '#AI'
+    cube.frame(by='aff', kws=['IBM Watson'], freq='D')      # daily tweets about 'IBM Watson' by IBM/non-IBM authors
+"""
+
+import json
+import os
+
+import bson
+import numpy as np
+import pymongo
+
+from config import * # import all global config variables
+
+
+ALL_KW = '*'
+TWEET_TYPES = ['nt', 'rt', 'qt']
+AFFILIATIONS = ['nonibm', 'ibm']
+
+AXES = ['hour', 'kw', 'type', 'aff']
+
+# pandas resampling rules of query frequencies, applied with closed='left' and label='left'
+# so that each bucket starts on (and is labeled by) its first time, e.g. weeks from Monday to Sunday
+FREQ_RULES = {'H': 'h', 'D': 'D', 'W': 'W-MON'}
+
+ROLLUP_PROJECTION = {'_id': 0, 'created_at': 1, 'timestamp_ms': 1, 'text': 1, 'user.description': 1,
+                     'retweeted_status.id': 1, 'quoted_status.id': 1}
+
+
+def tweet_type(tweet):
+    """
+    :return: index in TWEET_TYPES of the type of a tweet
+    """
+    if tweet.get('retweeted_status') is not None:
+        return 1
+    if tweet.get('quoted_status') is not None:
+        return 2
+    return 0
+
+
+class RollupCube(object):
+    """
+    Counts of tweets by (hour, keyword, tweet type, affiliation), growing along the hour axis as tweets are added
+    """
+
+    def __init__(self, kws_lst, aff_kw='ibm', start_hour=None, counts=None, watermark=None):
+        """
+        :param kws_lst: a list of keywords, at most kws_index.MAX_MASK_KWS
+        :param aff_kw: the keyword of the affiliation, matched in the 'description' of the authors
+        :param start_hour: hours since the Unix epoch of the first row of counts
+        :param counts: int64 array of shape (hours, len(kws_lst) + 1, len(TWEET_TYPES), len(AFFILIATIONS))
+        :param watermark: the last '_id' counted, None if no tweet was counted yet
+        """
+        self.kws_lst = list(kws_lst)
+        self.kws_axis = [ALL_KW] + self.kws_lst
+        self.aff_kw = aff_kw
+        self.start_hour = start_hour
+        if counts is None:
+            counts = np.zeros((0, len(self.kws_axis), len(TWEET_TYPES), len(AFFILIATIONS)), dtype=np.int64)
+        self.counts = counts
+        self.watermark = watermark
+
+    @property
+    def hours(self):
+        """
+        Hours since the Unix epoch of the rows of counts
+        """
+        return np.arange(len(self.counts), dtype=np.int64) + (self.start_hour or 0)
+
+    def ensure_hours(self, first_hour, last_hour):
+        """
+        Grow the hour axis (in place) so that it covers first_hour to last_hour
+        """
+        if self.start_hour is None:
+            self.start_hour = first_hour
+        pad_before = max(self.start_hour - first_hour, 0)
+        pad_after = max(last_hour - (self.start_hour + len(self.counts) - 1), 0)
+        if pad_before or pad_after:
+            self.counts = np.pad(np.asarray(self.counts), [(pad_before, pad_after), (0, 0), (0, 0), (0, 0)])
+            self.start_hour -= pad_before
+
+    def add(self, timestamps, kws_masks, types, affs):
+        """
+        Count a chunk of tweets
+
+        :param timestamps: NumPy array of Unix timestamps (in seconds) of the tweets
+        :param kws_masks: NumPy int64 array of the keyword bitmasks of the tweets, bit i for kws_lst[i]
+        :param types: NumPy array of the indices in TWEET_TYPES of the tweets
+        :param affs: NumPy array of the indices in AFFILIATIONS of the authors
+        """
+        if not len(timestamps):
+            return
+        hours = np.floor_divide(np.asarray(timestamps), 3600).astype(np.int64)
+        first_hour, last_hour = int(hours.min()), int(hours.max())
+        self.ensure_hours(first_hour, last_hour)
+        rows_n = last_hour - first_hour + 1
+        cell_shape = (rows_n, len(TWEET_TYPES), len(AFFILIATIONS))
+        cells = np.ravel_multi_index((hours - first_hour, types, affs), cell_shape)
+        rows = slice(first_hour - self.start_hour, last_hour - self.start_hour + 1)
+        cells_n = int(np.prod(cell_shape))
+        self.counts[rows, 0] += np.bincount(cells, minlength=cells_n).reshape(cell_shape)
+        for kw_ind in range(len(self.kws_lst)):
+            hit = ((kws_masks >> kw_ind) & 1).astype(bool)
+            if hit.any():
+                self.counts[rows, kw_ind + 1] += np.bincount(cells[hit], minlength=cells_n).reshape(cell_shape)
+
+    def merge(self, other):
+        """
+        Add the counts of another cube of the same keywords, in place
+        """
+        if other.kws_lst != self.kws_lst or other.aff_kw != self.aff_kw:
+            raise ValueError('Cannot merge rollup cubes of different keywords')
+        if other.start_hour is not None and len(other.counts):
+            first_hour = other.start_hour
+            self.ensure_hours(first_hour, first_hour + len(other.counts) - 1)
+            self.counts[first_hour - self.start_hour:first_hour - self.start_hour + len(other.counts)] += other.counts
+        return self
+
+    def save(self, rollup_dir):
+        """
+        Save counts.npy and meta.json into rollup_dir, replacing the files only once both are written
+        """
+        if not os.path.exists(rollup_dir):
+            os.makedirs(rollup_dir)
+        meta = {'kws_lst': self.kws_lst, 'aff_kw': self.aff_kw, 'start_hour': self.start_hour,
+                'watermark': self.watermark if self.watermark is None or isinstance(self.watermark, int)
+                else str(self.watermark),
+                'types': TWEET_TYPES, 'affs': AFFILIATIONS}
+        counts_file, meta_file = os.path.join(rollup_dir, 'counts.npy'), os.path.join(rollup_dir, 'meta.json')
+        np.save(counts_file + '.tmp.npy', np.asarray(self.counts))
+        with open(meta_file + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(counts_file + '.tmp.npy', counts_file)
+        os.replace(meta_file + '.tmp', meta_file)
+
+    @classmethod
+    def load(cls, rollup_dir, mmap=True):
+        """
+        Load a cube saved with save()
+
+        :param mmap: bool value indicates whether to memory-map the counts (read-only) instead of reading them
+        """
+        with open(os.path.join(rollup_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        counts = np.load(os.path.join(rollup_dir, 'counts.npy'), mmap_mode='r' if mmap else None)
+        watermark = meta['watermark']
+        if isinstance(watermark, str) and bson.ObjectId.is_valid(watermark):
+            watermark = bson.ObjectId(watermark)
+        return cls(meta['kws_lst'], aff_kw=meta['aff_kw'], start_hour=meta['start_hour'], counts=counts,
+                   watermark=watermark)
+
+    @classmethod
+    def load_or_create(cls, rollup_dir, kws_lst, aff_kw='ibm'):
+        """
+        Load the cube in rollup_dir to update it, or a new empty cube if there is none or it has other keywords
+        """
+        if os.path.exists(os.path.join(rollup_dir, 'meta.json')):
+            cube = cls.load(rollup_dir, mmap=False)
+            if cube.kws_lst == list(kws_lst) and cube.aff_kw == aff_kw:
+                return cube
+        return cls(kws_lst, aff_kw=aff_kw)
+
+    def pending_filter(self, collection):
+        """
+        Filter of the documents of a collection not counted yet, up to its current last '_id'
+
+        :param collection: the collection obj the cube counts, e.g. TW_RAW_COL
+        :return: (filter dict, last '_id'), (None, None) if there is no new document
+        """
+        last_doc = collection.find_one(projection={'_id': 1}, sort=[('_id', pymongo.DESCENDING)])
+        if last_doc is None or (self.watermark is not None and last_doc['_id'] <= self.watermark):
+            return None, None
+        conds = [{'_id': {'$lte': last_doc['_id']}}]
+        if self.watermark is not None:
+            conds.insert(0, {'_id': {'$gt': self.watermark}})
+        return {'$and': conds}, last_doc['_id']
+
+    '''
+    Queries
+    '''
+    def axis_inds(self, axis, labels):
+        """
+        :param axis: 'kw', 'type' or 'aff'
+        :param labels: a list of labels (or indices) on the axis, None for all of them
+        :return: a list of indices on the axis
+        """
+        axis_labels = {'kw': self.kws_axis, 'type': TWEET_TYPES, 'aff': AFFILIATIONS}[axis]
+        if labels is None:
+            return list(range(1, len(axis_labels))) if axis == 'kw' else list(range(len(axis_labels)))
+        return [label if isinstance(label, int) else axis_labels.index(label) for label in labels]
+
+    def select(self, start=None, end=None, kws=(ALL_KW,), types=None, affs=None):
+        """
+        Slice of the counts, without copy when possible
+
+        :param start: first time (anything pd.Timestamp takes, UTC), None from the first hour
+        :param end: time to stop before, None to the last hour
+        :param kws: a list of keywords (ALL_KW for all tweets), None for every keyword of kws_lst
+        :param types: a list of tweet types of TWEET_TYPES, None for all types
+        :param affs: a list of affiliations of AFFILIATIONS, None for all
+        :return: (hours array, counts array of shape (hours, kws, types, affs))
+        """
+        hours = self.hours
+        first = 0 if start is None else int(np.searchsorted(hours, self.to_hour(start)))
+        last = len(hours) if end is None else int(np.searchsorted(hours, self.to_hour(end)))
+        counts = np.asarray(self.counts[first:last])
+        for axis_i, (axis, labels) in enumerate([('kw', kws), ('type', types), ('aff', affs)], 1):
+            counts = counts.take(self.axis_inds(axis, labels), axis=axis_i)
+        return hours[first:last], counts
+
+    @staticmethod
+    def to_hour(time):
+        import pandas as pd # imported on first use, so that worker processes importing this module do not load it
+        return int(pd.Timestamp(time, tz='UTC').value // (3600 * 10 ** 9))
+
+    def frame(self, by=(), start=None, end=None, kws=(ALL_KW,), types=None, affs=None, freq='H'):
+        """
+        Time series of counts, summed over the selected labels of the axes not in by
+
+        :param by: axes ('kw', 'type' and/or 'aff') to keep as columns
+        :param freq: 'H' (hourly), 'D' (daily) or 'W' (weekly, weeks starting on Monday)
+        :return: pandas dataframe indexed by UTC times, one column per combination of labels of the by axes
+                 ('count' if by is empty)
+        """
+        import pandas as pd
+        by = [by] if isinstance(by, str) else list(by)
+        hours, counts = self.select(start, end, kws, types, affs)
+        labels = {'kw': [self.kws_axis[ind] for ind in self.axis_inds('kw', kws)],
+                  'type': [TWEET_TYPES[ind] for ind in self.axis_inds('type', types)],
+                  'aff': [AFFILIATIONS[ind] for ind in self.axis_inds('aff', affs)]}
+        sum_axes = tuple(axis_i for axis_i, axis in enumerate(AXES) if axis_i and axis not in by)
+        counts = counts.sum(axis=sum_axes)
+        index = pd.to_datetime(hours * 3600, unit='s', utc=True)
+        if by:
+            columns = pd.MultiIndex.from_product([labels[axis] for axis in AXES if axis in by],
+                                                 names=[axis for axis in AXES if axis in by])
+            df = pd.DataFrame(counts.reshape(len(hours), -1), index=index, columns=columns)
+            if len(by) == 1:
+                df.columns = df.columns.get_level_values(0)
+        else:
+            df = pd.DataFrame({'count': counts}, index=index)
+        if freq != 'H':
+            df = df.resample(FREQ_RULES[freq], closed='left', label='left').sum()
+        return df
+
+    def series(self, start=None, end=None, kws=(ALL_KW,), types=None, affs=None, freq='H'):
+        """
+        Time series of the total count of the selected labels, see frame
+
+        :return: pandas series indexed by UTC times
+        """
+        return self.frame((), start, end, kws, types, affs, freq)['count']
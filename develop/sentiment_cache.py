@@ -0,0 +1,184 @@
+"""
+Memoization of sentiment polarity scores, keyed by the hash of the scorer tag and the normalized text
+
+Identical texts (e.g. the 'quoted_status.text' of every quote of a popular tweet) are scored only once:
+scores are kept in an in-process LRU and in a persistent sqlite file shared by all worker processes and runs.
+The scorer tag (e.g. 'textblob-0.15.3') is part of the key, so changing the scorer or upgrading TextBlob
+does not return scores of the previous one.
+"""
+
+import collections
+import hashlib
+import importlib.metadata
+import os
+import re
+import sqlite3
+
+
+WHITESPACES_RE = re.compile(r'\s+')
+
+
+def textblob_polarity(text):
+    """
+    Default scorer: TextBlob sentiment polarity.
+    textblob (with nltk) is imported on first use, so processes which never score texts do not load it.
+    """
+    from textblob import TextBlob
+    return TextBlob(text).sentiment.polarity
+
+
+def get_scorer_tag(scorer):
+    """
+    Tag identifying a scorer in cache keys: the TextBlob version for the default scorer,
+    the module and name of the function otherwise
+    """
+    if scorer is textblob_polarity:
+        try:
+            return 'textblob-{}'.format(importlib.metadata.version('textblob'))
+        except importlib.metadata.PackageNotFoundError:
+            return 'textblob'
+    return '{}.{}'.format(scorer.__module__, scorer.__qualname__)
+
+
+def normalize_text(text):
+    """
+    Normalize a text before hashing: strip and collapse runs of whitespaces (which do not change polarity)
+    """
+    return WHITESPACES_RE.sub(' ', text).strip()
+
+
+def text_key(text, scorer_tag=''):
+    """
+    Content address of a text: sha1 digest of the scorer tag and the normalized UTF-8 bytes of the text
+    """
+    return hashlib.sha1('{}\0{}'.format(scorer_tag, normalize_text(text)).encode('utf-8')).digest()
+
+
+class PolarityCache(object):
+    """
+    Cache of polarity scores, in-process LRU backed by an optional sqlite file.
+
+    The sqlite connection is opened lazily, so a cache created in the parent can be passed to worker processes.
+    """
+
+    def __init__(self, db_file=None, lru_size=100000, scorer=textblob_polarity, scorer_tag=None, timeout=60):
+        """
+        :param db_file: the sqlite file shared across processes and runs, None for in-process cache only
+        :param lru_size: max number of scores kept in memory
+        :param scorer: function computing the polarity score of a text
+        :param scorer_tag: string identifying the scorer and its version in cache keys, None for get_scorer_tag(scorer);
+                           change it whenever the scores of the scorer change
+        :param timeout: seconds to wait for the sqlite file when other processes are writing
+        """
+        self.db_file = db_file
+        self.lru_size = lru_size
+        self.scorer = scorer
+        self.scorer_tag = scorer_tag if scorer_tag is not None else get_scorer_tag(scorer)
+        self.timeout = timeout
+        self._lru = collections.OrderedDict()
+        self._conn = None
+        self.hits_n = 0
+        self.misses_n = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_lru'] = collections.OrderedDict()
+        state['_conn'] = None
+        return state
+
+    def _get_conn(self):
+        if self._conn is None and self.db_file:
+            self._conn = sqlite3.connect(self.db_file, timeout=self.timeout)
+            self._conn.execute('PRAGMA journal_mode=WAL') # readers do not block the writer
+            self._conn.execute('CREATE TABLE IF NOT EXISTS polarity (key BLOB PRIMARY KEY, score REAL)')
+            self._conn.commit()
+        return self._conn
+
+    def _lru_put(self, key, score):
+        self._lru[key] = score
+        self._lru.move_to_end(key)
+        if len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def get_polarities(self, texts_lst):
+        """
+        Get polarity scores of a batch of texts; duplicated texts are scored once,
+        cached texts are not scored again
+
+        :param texts_lst: a list of texts
+        :return: a list of polarity scores
+        """
+        keys_lst = [text_key(text, self.scorer_tag) for text in texts_lst]
+        scores = {}
+        for key in set(keys_lst):
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                scores[key] = self._lru[key]
+
+        # look up missing keys in the persistent store
+        conn = self._get_conn()
+        missing_keys = [key for key in set(keys_lst) if key not in scores]
+        if conn is not None and missing_keys:
+            for s_ind in range(0, len(missing_keys), 500): # stay below sqlite max number of host parameters
+                chunk_keys = missing_keys[s_ind: s_ind + 500]
+                cursor = conn.execute('SELECT key, score FROM polarity WHERE key IN ({})'.format(','.join('?' * len(chunk_keys))),
+                                      chunk_keys)
+                for key, score in cursor:
+                    scores[key] = score
+                    self._lru_put(key, score)
+
+        # score texts still missing, once per distinct text
+        new_scores = []
+        for key, text in zip(keys_lst, texts_lst):
+            if key not in scores:
+                score = self.scorer(text)
+                scores[key] = score
+                self._lru_put(key, score)
+                new_scores.append((key, score))
+        self.misses_n += len(new_scores)
+        self.hits_n += len(keys_lst) - len(new_scores)
+        if conn is not None and new_scores:
+            conn.executemany('INSERT OR IGNORE INTO polarity (key, score) VALUES (?, ?)', new_scores)
+            conn.commit()
+
+        return [scores[key] for key in keys_lst]
+
+    def get_polarity(self, text):
+        """
+        Get polarity score of a single text
+
+        :param text: the text
+        :return: polarity score
+        """
+        return self.get_polarities([text])[0]
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+# caches of this process by sqlite file and scorer, see get_cache
+caches = {}
+caches_pid = os.getpid()
+
+
+def get_cache(db_file=None, scorer=textblob_polarity, **cache_options):
+    """
+    Get the cache of this process for a sqlite file and a scorer, creating it on first use, so that stages run many times
+    in the same (warm) process keep their in-process LRU (see worker_pool.py)
+
+    :param db_file: the sqlite file, None for in-process cache only
+    :param scorer: function computing the polarity score of a text
+    :param cache_options: see PolarityCache, only used when creating the cache
+    :return: PolarityCache obj
+    """
+    global caches, caches_pid
+    if caches_pid != os.getpid(): # sqlite connections must not be shared with a forked child
+        caches = {}
+        caches_pid = os.getpid()
+    cache = caches.get((db_file, scorer))
+    if cache is None:
+        cache = PolarityCache(db_file=db_file, scorer=scorer, **cache_options)
+        caches[(db_file, scorer)] = cache
+    return cache
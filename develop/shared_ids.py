@@ -0,0 +1,214 @@
+"""
+Broadcast large sets of ids to worker processes through shared memory
+
+A lookup set (e.g. the ids of IBM users) is built once in the parent, in a multiprocessing.shared_memory block,
+and passed to the workers as a small handle: pickling it only sends the name of the block,
+and each worker attaches to the block zero-copy on first use. Memory per worker stays flat
+however big the set is, and no worker rebuilds a Python set.
+    with shared_ids.SharedIds(ids_store.load_ids(USER_NT_IBM_DESC_IDS_LST_PKL)) as ibm_user_ids:
+        jobs = [multiprocessing.Process(target=..., args=(..., ibm_user_ids, ...)) for batch_i in range(process_n)]
+        ...
+The block is freed when the parent leaves the with block (or calls unlink()).
+
+SharedIds holds a sorted int64 array of ids (exact membership, see ids_store.isin);
+SharedBloomFilter holds a Bloom filter (approximate membership, no false negatives, ~1 byte per id for 1% errors).
+"""
+
+import math
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import ids_store
+import sketches
+
+
+class SharedArray(object):
+    """
+    NumPy array in a shared memory block, attached lazily after unpickling
+    """
+
+    def __init__(self, arr):
+        """
+        :param arr: NumPy array to copy into a new shared memory block (in the parent)
+        """
+        self.shape = arr.shape
+        self.dtype = arr.dtype.str
+        self.shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        self.owner = True
+        self._arr = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+        self._arr[...] = arr
+        self.name = self.shm.name
+
+    def __getstate__(self):
+        # only the name of the block is sent to the workers
+        state = self.__dict__.copy()
+        state.update(shm=None, _arr=None, owner=False)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    @property
+    def array(self):
+        """
+        The shared array, read-only in the workers
+        """
+        if self._arr is None:
+            self.shm = shared_memory.SharedMemory(name=self.name)
+            self._arr = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+            self._arr.flags.writeable = False
+        return self._arr
+
+    def close(self):
+        """
+        Detach from the block (in a worker)
+        """
+        self._arr = None
+        if self.shm is not None:
+            self.shm.close()
+            self.shm = None
+
+    def unlink(self):
+        """
+        Free the block (in the parent, once all workers are done)
+        """
+        owner = self.owner
+        shm = self.shm
+        self._arr = None
+        self.shm = None
+        if shm is not None:
+            shm.close()
+            if owner:
+                shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.unlink()
+
+
+class SharedIds(SharedArray):
+    """
+    Sorted array of unique int64 ids in shared memory, with exact membership tests
+    """
+
+    def __init__(self, ids):
+        """
+        :param ids: iterable of ids, e.g. a list or ids_store.load_ids(...)
+        """
+        super().__init__(ids_store.to_ids_array(ids))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def isin(self, values):
+        """
+        Vectorized membership test
+
+        :param values: array-like of ids
+        :return: NumPy bool array
+        """
+        return ids_store.isin(self.array, values)
+
+    def contains(self, value):
+        """
+        Membership test of a single id
+        """
+        return ids_store.contains(self.array, value)
+
+    def __contains__(self, value):
+        return self.contains(value)
+
+    def split(self, batch_i, process_n):
+        """
+        The batch_i-th of process_n contiguous slices of the ids, without copy
+
+        :return: NumPy int64 array (view of the shared array)
+        """
+        ids_n = len(self)
+        return self.array[batch_i * ids_n // process_n: (batch_i + 1) * ids_n // process_n]
+
+
+class SharedBloomFilter(SharedArray):
+    """
+    Bloom filter of int64 ids in shared memory, with approximate membership tests:
+    ids of the set always test True, other ids test True with probability about false_positive_rate.
+    Use it for sets too big to share exactly, or to cheaply reject most values before an exact test.
+    """
+
+    def __init__(self, ids, false_positive_rate=0.01):
+        """
+        :param ids: iterable of ids
+        :param false_positive_rate: target probability of a false positive
+        """
+        ids_arr = ids_store.to_ids_array(ids)
+        ids_n = max(len(ids_arr), 1)
+        bits_n = int(math.ceil(-ids_n * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.bits_n = max(bits_n + (-bits_n) % 8, 8)
+        self.hashes_n = max(int(round(self.bits_n / ids_n * math.log(2))), 1)
+        self.ids_n = len(ids_arr)
+        bits = np.zeros(self.bits_n // 8, dtype=np.uint8)
+        for s_ind in range(0, len(ids_arr), 1000000):
+            positions = self._positions(ids_arr[s_ind: s_ind + 1000000]).ravel()
+            np.bitwise_or.at(bits, positions >> 3, np.left_shift(1, positions & 7).astype(np.uint8))
+        super().__init__(bits)
+
+    def __len__(self):
+        return self.ids_n
+
+    def _positions(self, values):
+        """
+        Bit positions by double hashing (hash_1 + i * hash_2) of well mixed hashes (see sketches.hash64),
+        so that sequential or snowflake ids (timestamp in the high bits) spread as evenly as random ids
+
+        :return: NumPy array of bit positions, one row per value and one column per hash
+        """
+        hash_1 = sketches.hash64(np.asarray(values, dtype=np.int64))
+        hash_2 = sketches.hash64(hash_1) | np.uint64(1)
+        steps = np.arange(self.hashes_n, dtype=np.uint64)
+        hashes = hash_1[:, None] + hash_2[:, None] * steps[None, :] # wraps around 2**64
+        return (hashes % np.uint64(self.bits_n)).astype(np.int64)
+
+    def isin(self, values):
+        """
+        Vectorized approximate membership test
+
+        :param values: array-like of ids
+        :return: NumPy bool array, False where the value is surely not in the set
+        """
+        positions = self._positions(np.atleast_1d(values))
+        hits = (self.array[positions >> 3] >> (positions & 7).astype(np.uint8)) & 1
+        return hits.all(axis=1)
+
+    def contains(self, value):
+        """
+        Approximate membership test of a single id
+        """
+        return bool(self.isin([value])[0])
+
+    def __contains__(self, value):
+        return self.contains(value)
+
+
+if __name__ == '__main__':
+    '''
+    Check the false positive rate of SharedBloomFilter on id patterns of real data: sequential ids,
+    snowflake ids with empty low bits (one tweet per millisecond and worker) and with sequence numbers, random ids.
+    Every 11th id goes into the filter, the others are tested.
+    '''
+    ids_n = 100000
+    target_rate = 0.01
+    rng = np.random.default_rng(0)
+    timestamps_ms = np.sort(rng.integers(0, 30 * 86400 * 1000, size=11 * ids_n))
+    all_ids_cases = [('sequential', np.arange(10 ** 9, 10 ** 9 + 11 * ids_n)),
+                     ('snowflake, empty low bits', np.arange(10 ** 11, 10 ** 11 + 11 * ids_n) << 22),
+                     ('snowflake', ((10 ** 11 + timestamps_ms) << 22) + np.arange(11 * ids_n) % 4096),
+                     ('random', np.unique(rng.integers(0, 2 ** 62, size=11 * ids_n)))]
+    for case_name, all_ids in all_ids_cases:
+        with SharedBloomFilter(all_ids[::11], false_positive_rate=target_rate) as bloom_filter:
+            assert bloom_filter.isin(all_ids[::11]).all(), 'False negatives'
+            rate = bloom_filter.isin(np.delete(all_ids, np.s_[::11])).mean()
+        print('{}: false positive rate {:.4f} (target {})'.format(case_name, rate, target_rate))
+        assert rate < 1.5 * target_rate, 'False positive rate far above the target'
@@ -0,0 +1,311 @@
+"""
+Output sinks for worker processes: intermediate JSON lines files or MongoDB collections directly
+"""
+
+import codecs
+import json
+import os
+import queue
+import threading
+
+from pymongo import InsertOne, ReplaceOne
+from pymongo.errors import BulkWriteError
+
+import mongodb
+import utilities
+
+
+# error code of a write rejected by a unique index
+DUPLICATE_KEY_ERROR = 11000
+
+
+class JsonLinesSink(object):
+    """
+    Write documents into an intermediate JSON lines file, one document per line
+    """
+
+    def __init__(self, output_file, mode='w'):
+        """
+        :param output_file: the name/path of the intermediate output file
+        :param mode: 'w' to overwrite the file, 'a' to append to it
+        """
+        self.output_file = output_file
+        self.mode = mode
+        self._f = None
+
+    def _open(self):
+        if self._f is None:
+            self._f = codecs.open(self.output_file, self.mode, 'utf-8')
+
+    def write(self, doc):
+        self._open()
+        self._f.write(json.dumps(doc) + '\n')
+
+    def commit(self, range_i=None):
+        """
+        Make sure everything written so far is on disk
+
+        :param range_i: the index of the range committed (see checkpoints.Checkpointer.commit_range), unused here
+        """
+        if self._f is not None:
+            self._f.flush()
+            os.fsync(self._f.fileno())
+
+    def close(self):
+        self._open() # nothing written, still leave an empty file behind as before
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class MongoBulkSink(object):
+    """
+    Write documents straight into a MongoDB collection with bounded, unordered bulk writes.
+
+    Documents are buffered into batches of batch_size and handed to a background writer thread,
+    so computing the next batch overlaps with writing the previous one.
+    At most max_pending_batches batches wait for the writer; when the database falls behind,
+    write() blocks (backpressure) instead of piling up documents in memory.
+
+    The sink is created in the parent process and passed to workers as their output:
+    connection and writer thread are only set up on the first write() in each process.
+    With upsert_key (e.g. 'id'), documents replace existing ones with the same key instead of being inserted,
+    so re-running a procedure does not duplicate documents; create an index on the key first.
+    With ignore_duplicates, documents rejected by a unique index are skipped (and counted) instead of failing the sink.
+    """
+
+    def __init__(self, db_name, collection_name, batch_size=1000, upsert_key=None, max_pending_batches=2,
+                 ignore_duplicates=False, host='localhost', port=27017):
+        """
+        :param db_name: the name of the MongoDB database to write into
+        :param collection_name: the name of the collection to write into
+        :param batch_size: number of documents per bulk write
+        :param upsert_key: field to upsert documents by, None to insert
+        :param max_pending_batches: maximum number of full batches waiting to be written
+        :param ignore_duplicates: bool value indicates whether to skip documents violating a unique index
+        :param host: MongoDB host
+        :param port: MongoDB port
+        """
+        self.db_name = db_name
+        self.collection_name = collection_name
+        self.batch_size = batch_size
+        self.upsert_key = upsert_key
+        self.max_pending_batches = max_pending_batches
+        self.ignore_duplicates = ignore_duplicates
+        self.host = host
+        self.port = port
+        self._reset()
+
+    def _reset(self):
+        self._buffer = []
+        self._queue = None
+        self._thread = None
+        self._error = None
+        self.written_n = 0
+        self.duplicates_n = 0
+
+    def __getstate__(self):
+        # runtime state (connection, thread, buffer) stays in the process that created it
+        state = self.__dict__.copy()
+        for key in ['_buffer', '_queue', '_thread', '_error', 'written_n', 'duplicates_n']:
+            state.pop(key)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def _start(self):
+        collection = mongodb.initialize(db_name=self.db_name, collection_name=self.collection_name,
+                                        host=self.host, port=self.port)
+        self._queue = queue.Queue(maxsize=self.max_pending_batches)
+        self._thread = threading.Thread(target=self._run_writer, args=(collection,), daemon=True)
+        self._thread.start()
+
+    def _run_writer(self, collection):
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                self._queue.task_done()
+                return
+            if self._error is None: # after an error keep draining, so that write() never blocks forever
+                try:
+                    if self.upsert_key:
+                        ops = [ReplaceOne({self.upsert_key: doc[self.upsert_key]}, doc, upsert=True) for doc in batch]
+                    else:
+                        ops = [InsertOne(doc) for doc in batch]
+                    try:
+                        collection.bulk_write(ops, ordered=False)
+                        self.written_n += len(batch)
+                    except BulkWriteError as e:
+                        write_errors = e.details.get('writeErrors', [])
+                        if (not self.ignore_duplicates or e.details.get('writeConcernErrors')
+                                or any(error['code'] != DUPLICATE_KEY_ERROR for error in write_errors)):
+                            raise
+                        self.written_n += len(batch) - len(write_errors)
+                        self.duplicates_n += len(write_errors)
+                except Exception as e:
+                    self._error = e
+            self._queue.task_done()
+
+    def _check_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def flush(self):
+        """
+        Hand the buffered documents to the writer thread
+        """
+        if not self._buffer:
+            return
+        if self._thread is None:
+            self._start()
+        self._check_error()
+        self._queue.put(self._buffer) # blocks while max_pending_batches batches are waiting
+        self._buffer = []
+
+    def write(self, doc):
+        self._buffer.append(doc)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def commit(self, range_i=None):
+        """
+        Write out all buffered documents and wait until the database acknowledged them
+
+        :param range_i: the index of the range committed (see checkpoints.Checkpointer.commit_range), unused here
+        """
+        self.flush()
+        if self._thread is not None:
+            self._queue.join()
+        self._check_error()
+
+    def close(self):
+        """
+        Write out all buffered documents and wait for the writer thread to finish
+        """
+        self.flush()
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._queue = None
+            self._thread = None
+        self._check_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+            return
+        # leaving on an exception: do not hide it behind an error of the writer thread
+        try:
+            self.close()
+        except Exception as e:
+            print('MongoBulkSink on {}.{} failed as well: {!r}'.format(self.db_name, self.collection_name, e))
+
+
+class RangeFilesSink(object):
+    """
+    Write the documents of each checkpointed '_id' range into a JSON lines file of its own.
+
+    Documents of the range being processed go into a '.part' file next to output_file, which is renamed to
+    the file of the range (see checkpoints.Checkpointer.gen_range_filename) when the range is committed.
+    Re-running a procedure never truncates the output of ranges committed before, and a range that crashed
+    half way leaves nothing but its '.part' file, which is overwritten when the range is processed again.
+    Import the output with sinks.import_inter_files(checkpointer.get_range_files(...), ...).
+    """
+
+    def __init__(self, output_file, checkpointer):
+        """
+        :param output_file: the name/path of the intermediate output file of this process, its dir and suffix
+                            are used for the range files
+        :param checkpointer: checkpoints.Checkpointer obj the ranges are committed to
+        """
+        self.output_file = output_file
+        self.checkpointer = checkpointer
+        self.part_file = output_file + '.part'
+        self._sink = None
+
+    def _open(self):
+        if self._sink is None:
+            self._sink = JsonLinesSink(self.part_file, 'w')
+
+    def write(self, doc):
+        self._open()
+        self._sink.write(doc)
+
+    def commit(self, range_i=None):
+        """
+        Move everything written since the last commit into the file of range range_i
+
+        :param range_i: the index of the range committed (see checkpoints.Checkpointer.commit_range)
+        """
+        if range_i is None:
+            raise ValueError('RangeFilesSink only commits whole ranges, see checkpoints.Checkpointer.commit_range')
+        self._open() # an empty range still gets an empty file
+        self._sink.commit()
+        self._sink.close()
+        self._sink = None
+        output_dir, output_name = os.path.split(self.output_file)
+        suffix = os.path.splitext(output_name)[1][1:] or 'json'
+        os.replace(self.part_file, self.checkpointer.gen_range_filename(range_i, output_dir=output_dir, suffix=suffix))
+
+    def close(self):
+        # output of an uncommitted range stays in the '.part' file
+        if self._sink is not None:
+            self._sink.close()
+            self._sink = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_sink(output, checkpointer=None):
+    """
+    Get the sink a worker writes its output into
+
+    :param output: the name/path of an intermediate output file, or a sink obj (e.g. MongoBulkSink)
+    :param checkpointer: checkpoints.Checkpointer obj the worker commits its ranges to, None for no checkpoints;
+                         output files then become one RangeFilesSink file per range, and MongoBulkSink needs an
+                         upsert_key, so that ranges processed again replace their documents instead of duplicating them
+    :return: sink obj
+    """
+    if isinstance(output, str):
+        if checkpointer is not None:
+            return RangeFilesSink(output, checkpointer)
+        return JsonLinesSink(output)
+    if checkpointer is not None and isinstance(output, MongoBulkSink) and not output.upsert_key:
+        raise ValueError('Checkpointed procedures write into MongoDB with an upsert_key only, '
+                         'got MongoBulkSink on {}.{} without one'.format(output.db_name, output.collection_name))
+    return output
+
+
+def import_inter_files(inter_files, sink, chunk_size=10000, transform=None):
+    """
+    Import intermediate JSON lines files into a sink (e.g. MongoBulkSink), streaming them chunk by chunk,
+    so that memory use does not depend on the size of the files
+
+    :param inter_files: a list of intermediate output filenames, see utilities.gen_inter_filenames_list
+    :param sink: sink obj to write documents into
+    :param chunk_size: number of lines parsed at a time
+    :param transform: optional function applied to each parsed document before writing it
+    :return: number of imported documents
+    """
+    docs_n = 0
+    with sink:
+        for inter_file in inter_files:
+            print('Importing {}...'.format(inter_file))
+            for docs_lst in utilities.read_inter_file_chunks(inter_file, chunk_size):
+                for doc in docs_lst:
+                    sink.write(transform(doc) if transform else doc)
+                docs_n += len(docs_lst)
+    return docs_n
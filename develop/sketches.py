@@ -0,0 +1,341 @@
+"""
+Mergeable streaming sketches for keyword and influence summaries
+
+One streaming pass over TW_NT_COL/TW_RT_COL (see multiprocessing_workers.worker_sketch_tweets) summarizes tweets and users
+in bounded memory, without materializing per-user tables:
+    HyperLogLog:  distinct users (of all tweets, of the tweets with each keyword), ~0.8% error in 16KB
+    KLLSketch:    quantiles of followers_count (per user), retweet_count (per tweet)
+                  and the proportion of tweets of each user with each keyword (e.g. proportion of IBM tweets)
+Each worker builds its own SketchSet over its ranges, the parent merges them and saves the result for instant reuse:
+    sketch_set = sketches.SketchSet.load(os.path.join(SKETCHES_DIR, TW_NT_COL + '.npz'))
+    sketch_set.count('all/users/ibm')                   # distinct users tweeting about 'ibm'
+    sketch_set.quantile('ibm_users/followers_count', 0.5)
+    sketch_set.summary()                                # DataFrame of counts and quartiles of all sketches
+Sketches of the same name are merged by union, so sets built on different collections (or by different workers)
+combine into the sketch of the union, e.g. distinct users of native tweets and retweets together.
+"""
+
+import json
+
+import numpy as np
+
+
+HLL_P = 14 # 2**14 registers, standard error 1.04 / sqrt(2**14) ~= 0.8%
+KLL_K = 200 # largest compactor size, rank error ~1.65 / KLL_K ~= 0.8%
+
+
+def hash64(values):
+    """
+    splitmix64 finalizer of an array of integers: well mixed uint64 hashes, the same in every process
+
+    :param values: array-like of (u)int64 values
+    :return: uint64 array
+    """
+    h = np.asarray(values).astype(np.int64).view(np.uint64)
+    h = h + np.uint64(0x9E3779B97F4A7C15)
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+
+def leading_zeros(words):
+    """
+    Number of leading zero bits of each (non zero) uint64 word, by binary search on all words at once
+    """
+    words = words.copy()
+    res = np.zeros(len(words), dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        mask = words < np.uint64(1 << (64 - shift)) # the top shift bits are all zeros
+        res[mask] += shift
+        words[mask] <<= np.uint64(shift)
+    return res
+
+
+class HyperLogLog(object):
+    """
+    HyperLogLog distinct counter of integer ids (e.g. user ids)
+    """
+
+    def __init__(self, p=HLL_P, registers=None):
+        """
+        :param p: number of index bits, 2**p one byte registers
+        :param registers: uint8 array of 2**p registers to start from (see from_arrays)
+        """
+        self.p = p
+        self.registers = np.zeros(1 << p, dtype=np.uint8) if registers is None else registers
+
+    def add(self, values):
+        """
+        :param values: array-like of integer ids
+        """
+        h = hash64(values)
+        if not len(h):
+            return
+        inds = (h >> np.uint64(64 - self.p)).astype(np.intp)
+        # rank of the first set bit of the remaining bits, at most 64 - p + 1
+        words = (h << np.uint64(self.p)) | np.uint64(1 << (self.p - 1))
+        np.maximum.at(self.registers, inds, leading_zeros(words) + 1)
+
+    def merge(self, other):
+        """
+        Union with another HyperLogLog of the same p, in place
+        """
+        if other.p != self.p:
+            raise ValueError('Cannot merge HyperLogLog of p={} into p={}'.format(other.p, self.p))
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        """
+        :return: estimated number of distinct ids
+        """
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.ldexp(1.0, -self.registers.astype(np.int64)).sum()
+        zeros_n = int((self.registers == 0).sum())
+        if estimate <= 2.5 * m and zeros_n:
+            estimate = m * np.log(m / zeros_n) # linear counting for small cardinalities
+        return int(round(estimate))
+
+    def copy(self):
+        return HyperLogLog(self.p, self.registers.copy())
+
+    def to_arrays(self):
+        return {'registers': self.registers}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        registers = np.array(arrays['registers'], dtype=np.uint8)
+        return cls(int(np.log2(len(registers))), registers)
+
+
+class KLLSketch(object):
+    """
+    KLL quantiles sketch of a stream of numbers: a stack of compactors, where items of level h stand for 2**h items.
+    A full compactor is sorted and every other item (random offset) is promoted to the next level.
+    """
+
+    def __init__(self, k=KLL_K, seed=None):
+        """
+        :param k: size of the largest compactor, memory is about 3 * k items
+        :param seed: seed of the random offsets of compactions
+        """
+        self.k = k
+        self.compactors = [np.empty(0, dtype=np.float64)]
+        self.n = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.rng = np.random.default_rng(seed)
+
+    def capacity(self, level):
+        depth = len(self.compactors) - 1 - level
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def add(self, values):
+        """
+        :param values: array-like of numbers
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+        self.n += len(values)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.compactors[0] = np.concatenate([self.compactors[0], values])
+        self.compress()
+
+    def compress(self):
+        level = 0
+        while level < len(self.compactors):
+            compactor = self.compactors[level]
+            if len(compactor) > self.capacity(level):
+                if level + 1 == len(self.compactors):
+                    self.compactors.append(np.empty(0, dtype=np.float64))
+                compactor = np.sort(compactor)
+                kept_n = len(compactor) % 2 # an odd item out stays on this level
+                offset = int(self.rng.integers(2))
+                self.compactors[level + 1] = np.concatenate([self.compactors[level + 1],
+                                                             compactor[kept_n + offset::2]])
+                self.compactors[level] = compactor[:kept_n]
+                level = 0 # capacities of lower levels shrink as the stack grows
+            else:
+                level += 1
+
+    def merge(self, other):
+        """
+        Union with another KLLSketch, in place
+        """
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append(np.empty(0, dtype=np.float64))
+        for level, compactor in enumerate(other.compactors):
+            self.compactors[level] = np.concatenate([self.compactors[level], compactor])
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.compress()
+        return self
+
+    def weighted_items(self):
+        """
+        :return: (sorted items, cumulative weights) arrays
+        """
+        items = np.concatenate(self.compactors)
+        weights = np.concatenate([np.full(len(compactor), 1 << level, dtype=np.int64)
+                                  for level, compactor in enumerate(self.compactors)])
+        order = np.argsort(items, kind='stable')
+        return items[order], np.cumsum(weights[order])
+
+    def quantile(self, q):
+        """
+        :param q: a quantile in [0, 1] or an array of them
+        :return: estimated value(s) at the quantile(s), NaN if empty
+        """
+        q = np.asarray(q, dtype=np.float64)
+        if not self.n:
+            return np.full(q.shape, np.nan)[()]
+        items, cum_weights = self.weighted_items()
+        inds = np.searchsorted(cum_weights, q * cum_weights[-1], side='left')
+        res = items[np.minimum(inds, len(items) - 1)]
+        res = np.where(q <= 0, self.min, np.where(q >= 1, self.max, res))
+        return res[()]
+
+    def rank(self, value):
+        """
+        :return: estimated proportion of the items <= value
+        """
+        if not self.n:
+            return np.nan
+        items, cum_weights = self.weighted_items()
+        ind = np.searchsorted(items, value, side='right')
+        return float(cum_weights[ind - 1] / cum_weights[-1]) if ind else 0.0
+
+    def to_arrays(self):
+        return {'items': np.concatenate(self.compactors),
+                'level_lens': np.array([len(compactor) for compactor in self.compactors], dtype=np.int64),
+                'stats': np.array([self.k, self.n, self.min, self.max], dtype=np.float64)}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        k, n, min_value, max_value = arrays['stats']
+        sketch = cls(int(k))
+        offsets = np.concatenate([[0], np.cumsum(arrays['level_lens'])])
+        items = np.asarray(arrays['items'], dtype=np.float64)
+        sketch.compactors = [items[offsets[level]:offsets[level + 1]].copy() for level in range(len(offsets) - 1)]
+        sketch.n = int(n)
+        sketch.min = float(min_value)
+        sketch.max = float(max_value)
+        return sketch
+
+
+SKETCH_TYPES = {'hll': HyperLogLog, 'kll': KLLSketch}
+
+
+class SketchSet(object):
+    """
+    Named sketches plus exact counters, merged name by name. Names are paths like '<scope>/<metric>[/<keyword>]'.
+    """
+
+    def __init__(self):
+        self.sketches = {}
+        self.counts = {}
+
+    def hll(self, name, p=HLL_P):
+        """
+        Get the HyperLogLog of a name, creating it on first use
+        """
+        if name not in self.sketches:
+            self.sketches[name] = HyperLogLog(p)
+        return self.sketches[name]
+
+    def kll(self, name, k=KLL_K):
+        """
+        Get the KLLSketch of a name, creating it on first use
+        """
+        if name not in self.sketches:
+            self.sketches[name] = KLLSketch(k)
+        return self.sketches[name]
+
+    def incr(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + int(n)
+
+    def count(self, name):
+        """
+        :return: the exact counter of a name, or the distinct count of a HyperLogLog
+        """
+        if name in self.counts:
+            return self.counts[name]
+        return self.sketches[name].count()
+
+    def quantile(self, name, q):
+        return self.sketches[name].quantile(q)
+
+    def merge(self, other):
+        """
+        Merge another SketchSet in place: sketches of the same name by union, counters by sum
+        """
+        for name, sketch in other.sketches.items():
+            if name in self.sketches:
+                self.sketches[name].merge(sketch)
+            else:
+                self.sketches[name] = sketch
+        for name, n in other.counts.items():
+            self.incr(name, n)
+        return self
+
+    def summary(self, quantiles=(0.25, 0.5, 0.75, 0.9, 0.99)):
+        """
+        :return: DataFrame with one row per counter/sketch: its count (distinct count for a HyperLogLog,
+                 number of items for a KLLSketch) and the quantiles of the KLLSketch
+        """
+        import pandas as pd # imported on first use, so that worker processes importing this module do not load it
+        rows_lst = [dict(name=name, type='count', count=n) for name, n in self.counts.items()]
+        for name, sketch in self.sketches.items():
+            if isinstance(sketch, HyperLogLog):
+                rows_lst.append(dict(name=name, type='hll', count=sketch.count()))
+            else:
+                row = dict(name=name, type='kll', count=sketch.n, min=sketch.min, max=sketch.max)
+                row.update(zip(['q{:g}'.format(q) for q in quantiles], np.atleast_1d(sketch.quantile(quantiles))))
+                rows_lst.append(row)
+        return pd.DataFrame(rows_lst).sort_values('name').reset_index(drop=True)
+
+    def save(self, sketches_file):
+        """
+        Save all sketches and counters into a .npz file
+        """
+        arrays = {}
+        types = {}
+        for sketch_i, (name, sketch) in enumerate(self.sketches.items()):
+            types[name] = [type_name for type_name, cls in SKETCH_TYPES.items() if isinstance(sketch, cls)][0]
+            arrays.update({'{}_{}'.format(sketch_i, key): arr for key, arr in sketch.to_arrays().items()})
+        meta = {'names': list(self.sketches.keys()), 'types': types, 'counts': self.counts}
+        arrays['meta'] = np.array(json.dumps(meta))
+        with open(sketches_file, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, sketches_file):
+        """
+        Load sketches and counters saved with save()
+        """
+        sketch_set = cls()
+        with np.load(sketches_file) as arrays:
+            meta = json.loads(str(arrays['meta']))
+            for sketch_i, name in enumerate(meta['names']):
+                prefix = '{}_'.format(sketch_i)
+                sketch_arrays = {key[len(prefix):]: arrays[key] for key in arrays.files if key.startswith(prefix)}
+                sketch_set.sketches[name] = SKETCH_TYPES[meta['types'][name]].from_arrays(sketch_arrays)
+        sketch_set.counts = meta['counts']
+        return sketch_set
+
+
+def merge_sketch_files(sketches_files):
+    """
+    Merge the SketchSets saved by workers (e.g. multiprocessing_workers.worker_sketch_tweets) into one
+
+    :param sketches_files: a list of .npz files
+    :return: SketchSet obj
+    """
+    sketch_set = SketchSet()
+    for sketches_file in sketches_files:
+        sketch_set.merge(SketchSet.load(sketches_file))
+    return sketch_set
@@ -0,0 +1,175 @@
+"""
+Seeded generator of synthetic tweet corpora, for benchmarks without the real database
+
+Users have heavy-tailed followers counts and activity; tweets mention the collection keywords (API_QUERY_KWS)
+with Zipf popularity; retweets go preferentially to popular users' tweets, so cascades are skewed as in the real data.
+Documents have the fields of Twitter API v1.1 tweets used by the notebooks and workers.
+"""
+
+import bisect
+import datetime
+import json
+import os
+
+import numpy as np
+
+from config import * # import all global config variables
+
+
+WORDS = ['data', 'model', 'cloud', 'learning', 'new', 'how', 'future', 'business', 'great', 'read', 'via', 'today',
+         'insights', 'platform', 'research', 'open', 'source', 'team', 'event', 'join', 'us', 'top', 'trends',
+         'customer', 'bad', 'good', 'love', 'hate', 'awesome', 'terrible', 'security', 'scale', 'startup', 'jobs']
+DESCRIPTION_WORDS = ['engineer', 'scientist', 'developer', 'researcher', 'marketing', 'student', 'founder',
+                     'analytics', 'cloud', 'opinions', 'my', 'own', 'tech', 'enthusiast', 'speaker', 'author']
+EMPLOYERS = ['Microsoft', 'Google', 'Amazon', 'Oracle', 'SAP', 'Intel', 'Accenture']
+
+CREATED_AT_FORMAT = '%a %b %d %H:%M:%S +0000 %Y'
+# tweet ids are snowflake ids: milliseconds since the Twitter epoch shifted left by 22 bits
+TWITTER_EPOCH_MS = 1288834974657
+
+
+def zipf_weights(n, exponent=1.1):
+    """
+    Normalized Zipf weights of n ranks
+    """
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+
+def gen_users(rng, users_n, ibm_ratio=0.05):
+    """
+    :param rng: np.random.Generator obj
+    :param users_n: number of users
+    :param ibm_ratio: share of users with 'IBM' in their description
+    :return: a list of user objects
+    """
+    uids = 10 ** 6 + np.cumsum(rng.integers(1, 10 ** 5, size=users_n)) # sorted unique ids
+    followers_counts = np.minimum(rng.pareto(1.2, size=users_n) * 100, 10 ** 7).astype(np.int64)
+    is_ibm = rng.random(users_n) < ibm_ratio
+    users_lst = []
+    for ind in range(users_n):
+        desc_words = rng.choice(DESCRIPTION_WORDS, size=rng.integers(2, 7)).tolist()
+        employer = 'IBM' if is_ibm[ind] else (rng.choice(EMPLOYERS) if rng.random() < 0.3 else None)
+        if employer:
+            desc_words.insert(int(rng.integers(0, len(desc_words) + 1)), '@ {}'.format(employer))
+        uid = int(uids[ind])
+        users_lst.append({'id': uid, 'id_str': str(uid), 'screen_name': 'user{}'.format(uid),
+                          'name': 'User {}'.format(ind), 'description': ' '.join(desc_words),
+                          'followers_count': int(followers_counts[ind]),
+                          'friends_count': int(rng.integers(0, 2000)), 'lang': 'en'})
+    return users_lst
+
+
+def gen_text(rng, kws_weights, ibm_mention_ratio=0.03):
+    kws = rng.choice(API_QUERY_KWS, size=rng.integers(1, 4), p=kws_weights).tolist()
+    words = rng.choice(WORDS, size=rng.integers(5, 15)).tolist()
+    for kw in kws:
+        words.insert(int(rng.integers(0, len(words) + 1)), kw)
+    if rng.random() < ibm_mention_ratio:
+        words.insert(int(rng.integers(0, len(words) + 1)), 'IBM')
+    return ' '.join(words)[:140]
+
+
+def gen_corpus(users_n=1000, tweets_n=10000, rt_ratio=0.5, qt_ratio=0.1, reply_ratio=0.1, ibm_ratio=0.05,
+               days_n=30, seed=0):
+    """
+    Generate a synthetic corpus, in creation time order
+
+    :param users_n: number of users
+    :param tweets_n: number of tweets, including retweets
+    :param rt_ratio: share of retweets
+    :param qt_ratio: share of quote tweets among native tweets
+    :param reply_ratio: share of replies among native tweets
+    :param ibm_ratio: share of users with 'IBM' in their description
+    :param days_n: time span of the corpus in days
+    :param seed: random seed
+    :return: (a list of user objects, a list of tweets as in TW_RAW_COL)
+    """
+    rng = np.random.default_rng(seed)
+    users_lst = gen_users(rng, users_n, ibm_ratio)
+    # activity and popularity both heavy-tailed; popular authors get retweeted much more
+    activity_weights = zipf_weights(users_n)[rng.permutation(users_n)]
+    followers_counts = np.array([user['followers_count'] for user in users_lst], dtype=np.float64)
+    kws_weights = zipf_weights(len(API_QUERY_KWS), 1.0)
+
+    start_ms = int(datetime.datetime(2017, 4, 1, tzinfo=datetime.timezone.utc).timestamp() * 1000)
+    timestamps_ms = np.sort(rng.integers(start_ms, start_ms + days_n * 86400 * 1000, size=tweets_n))
+    is_rt = rng.random(tweets_n) < rt_ratio
+    is_rt[0] = False # the first tweet has nothing to retweet
+    authors = rng.choice(users_n, size=tweets_n, p=activity_weights)
+
+    natives_lst = [] # native tweets so far, the candidates of retweets and quotes
+    # cumulative popularity of native tweets, from their authors' followers counts and a random appeal
+    natives_cum_weights = []
+    tweets_lst = []
+    for ind in range(tweets_n):
+        timestamp_ms = int(timestamps_ms[ind])
+        tweet_id = ((timestamp_ms - TWITTER_EPOCH_MS) << 22) + ind
+        user = users_lst[authors[ind]]
+        tweet = {'id': tweet_id, 'id_str': str(tweet_id),
+                 'created_at': datetime.datetime.fromtimestamp(timestamp_ms // 1000, datetime.timezone.utc).strftime(CREATED_AT_FORMAT),
+                 'timestamp_ms': str(timestamp_ms), 'user': dict(user), 'lang': 'en',
+                 'retweet_count': 0, 'in_reply_to_status_id': None}
+        if is_rt[ind] and natives_lst:
+            original = natives_lst[bisect.bisect(natives_cum_weights, rng.random() * natives_cum_weights[-1])]
+            original['retweet_count'] += 1
+            tweet['retweeted_status'] = dict(original, retweet_count=original['retweet_count'])
+            tweet['text'] = 'RT @{}: {}'.format(original['user']['screen_name'], original['text'])[:140]
+            tweet['retweet_count'] = original['retweet_count']
+        else:
+            tweet['text'] = gen_text(rng, kws_weights)
+            if natives_lst and rng.random() < qt_ratio:
+                quoted = natives_lst[bisect.bisect(natives_cum_weights, rng.random() * natives_cum_weights[-1])]
+                tweet['quoted_status'] = {key: value for key, value in quoted.items() if key != 'quoted_status'}
+                tweet['quoted_status_id'] = quoted['id']
+            elif natives_lst and rng.random() < reply_ratio:
+                tweet['in_reply_to_status_id'] = natives_lst[int(rng.integers(0, len(natives_lst)))]['id']
+            natives_lst.append(tweet)
+            weight = np.log2(2 + followers_counts[authors[ind]]) * rng.pareto(1.5)
+            natives_cum_weights.append((natives_cum_weights[-1] if natives_cum_weights else 0.0) + weight)
+        tweets_lst.append(tweet)
+
+    # snapshot the final retweet counts into the native tweets as stored
+    return users_lst, [json.loads(json.dumps(tweet)) for tweet in tweets_lst]
+
+
+def write_raw_dump(tweets_lst, raw_file, server_messages_n=0):
+    """
+    Write tweets as a raw JSON lines dump, as collected from the streaming API (input of ingest.ingest_raw_files)
+
+    :param tweets_lst: a list of tweets
+    :param raw_file: the path of the dump file
+    :param server_messages_n: number of 'delete'/'limit' messages to interleave
+    """
+    step = max(len(tweets_lst) // server_messages_n, 1) if server_messages_n else None
+    with open(raw_file, 'w') as f:
+        for ind, tweet in enumerate(tweets_lst):
+            if step and ind % step == 0:
+                f.write(json.dumps({'limit': {'track': ind}}) + '\n')
+            f.write(json.dumps(tweet) + '\n')
+
+
+def write_follower_files(users_lst, followers_dir, hydrated_uids_lst, max_followers=5000, seed=0):
+    """
+    Write hydrated followers files, one '<uid>.json' file of follower user objects (one per line) per user,
+    as read by multiprocessing_workers.worker_count_ibm_followers_ibm_users
+
+    :param users_lst: a list of user objects, followers are sampled from them
+    :param followers_dir: directory of the files
+    :param hydrated_uids_lst: the list of user ids to write files for
+    :param max_followers: max number of followers per file
+    :param seed: random seed
+    :return: total number of followers written
+    """
+    rng = np.random.default_rng(seed)
+    if not os.path.exists(followers_dir):
+        os.makedirs(followers_dir)
+    users_by_id = {user['id']: user for user in users_lst}
+    lines_lst = [json.dumps(user) + '\n' for user in users_lst]
+    total_n = 0
+    for uid in hydrated_uids_lst:
+        followers_n = min(users_by_id[uid]['followers_count'], max_followers)
+        with open(os.path.join(followers_dir, '{}.json'.format(uid)), 'w') as f:
+            f.writelines(lines_lst[ind] for ind in rng.integers(0, len(lines_lst), size=followers_n))
+        total_n += followers_n
+    return total_n
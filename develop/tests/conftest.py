@@ -0,0 +1,93 @@
+"""
+Shared fixtures: an in-process MongoDB stand-in (mongomock) and the seeded synthetic corpus (see synthetic_corpus.py)
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingest
+import mongodb
+import synthetic_corpus
+import utilities
+
+
+TEST_DB_NAME = 'test'
+
+
+@pytest.fixture(scope='session')
+def corpus():
+    """
+    (a list of user objects, a list of tweets as in TW_RAW_COL)
+    """
+    return synthetic_corpus.gen_corpus(users_n=300, tweets_n=3000, seed=0)
+
+
+@pytest.fixture(scope='session')
+def mongo_client():
+    """
+    One mongomock client that every connection of mongodb.py goes to
+    (tests that write to the database use their own database or procedure names)
+    """
+    mongomock = pytest.importorskip('mongomock')
+    find = mongomock.collection.Collection.find
+    
+    def strict_find(self, *args, **kwargs):
+        # pymongo only accepts an integer batch_size, mongomock accepts anything
+        if 'batch_size' in kwargs and not isinstance(kwargs['batch_size'], int):
+            raise TypeError('batch_size must be an integer, not {}'.format(type(kwargs['batch_size'])))
+        return find(self, *args, **kwargs)
+    
+    def drop_sort(add_op):
+        # pymongo >= 4.11 passes the 'sort' option of ReplaceOne/UpdateOne, older mongomock does not take it
+        def wrapper(self, *args, **kwargs):
+            kwargs.pop('sort', None)
+            return add_op(self, *args, **kwargs)
+        return wrapper
+    
+    client = mongomock.MongoClient()
+    mongodb.set_client_factory(lambda host, port, **options: client)
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(mongomock.collection.Collection, 'find', strict_find)
+        for name in ['add_replace', 'add_update']:
+            mp.setattr(mongomock.collection.BulkOperationBuilder, name,
+                       drop_sort(getattr(mongomock.collection.BulkOperationBuilder, name)))
+        yield client
+    mongodb.set_client_factory(None)
+
+
+@pytest.fixture(scope='session')
+def db(mongo_client, corpus, tmp_path_factory):
+    """
+    The corpus loaded into TEST_DB_NAME with ingest.ingest_raw_files
+    """
+    raw_file = str(tmp_path_factory.mktemp('raw') / 'raw.json')
+    synthetic_corpus.write_raw_dump(corpus[1], raw_file, server_messages_n=30)
+    ingest.ingest_raw_files([raw_file], db_name=TEST_DB_NAME, batch_size=500)
+    return mongo_client[TEST_DB_NAME]
+
+
+def run_batches(target, gen_args, process_n, collection=None, ranges_n=8, field='_id'):
+    """
+    Run a worker function for batch_i in range(process_n) one after the other in this process,
+    with a queue of ranges of collection shared by all batches as in the notebooks
+
+    :param gen_args: function taking (batch_i, id_ranges_queue) and returning the args of the worker
+    """
+    id_ranges_queue = None
+    if collection is not None:
+        id_ranges = mongodb.gen_id_ranges(collection, ranges_n, sample_size=500, field=field)
+        id_ranges_queue = utilities.gen_id_ranges_queue(id_ranges, process_n)
+    for batch_i in range(process_n):
+        target(*gen_args(batch_i, id_ranges_queue))
+
+
+def read_outputs(output_files):
+    """
+    :return: a list of the documents of intermediate output files
+    """
+    return [doc for output_file in output_files if os.path.exists(output_file)
+            for docs_lst in utilities.read_inter_file_chunks(output_file) for doc in docs_lst]
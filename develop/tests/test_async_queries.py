@@ -0,0 +1,147 @@
+import asyncio
+import collections
+
+import pytest
+from pymongo import errors
+
+import async_queries
+import mongodb
+import multiprocessing_workers
+import shared_ids
+from config import * # import all global config variables
+
+from conftest import TEST_DB_NAME, read_outputs
+
+
+class AsyncCursor(object):
+    def __init__(self, cursor):
+        self.cursor = cursor
+    
+    def batch_size(self, batch_size):
+        self.cursor = self.cursor.batch_size(batch_size)
+        return self
+    
+    async def to_list(self, length):
+        await asyncio.sleep(0) # let other queries run, as a round trip would
+        return list(self.cursor)
+
+
+class AsyncCollection(object):
+    def __init__(self, collection):
+        self.collection = collection
+    
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self.collection.find(*args, **kwargs))
+    
+    async def find_one(self, *args, **kwargs):
+        return self.collection.find_one(*args, **kwargs)
+    
+    async def aggregate(self, pipeline, **kwargs):
+        return AsyncCursor(self.collection.aggregate(pipeline, **kwargs))
+
+
+class AsyncClient(object):
+    """
+    asyncio client stand-in over a mongomock client, with the interface of pymongo's AsyncMongoClient used here
+    """
+    
+    def __init__(self, client):
+        self.client = client
+    
+    def __getitem__(self, db_name):
+        db = self.client[db_name]
+        return type('AsyncDatabase', (), {'__getitem__': lambda _, name: AsyncCollection(db[name])})()
+    
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def async_client(mongo_client):
+    mongodb.set_async_client_factory(lambda host, port, **options: AsyncClient(mongo_client))
+    yield
+    mongodb.set_async_client_factory(None)
+
+
+def run_map(items, query_fn, **engine_options):
+    ordered = engine_options.pop('ordered', True)
+    
+    async def collect():
+        async with async_queries.AsyncQueryEngine(TEST_DB_NAME, **engine_options) as engine:
+            return [result async for result in engine.map(query_fn, items, ordered=ordered)], engine
+    return asyncio.run(collect())
+
+
+def test_map_order_and_concurrency(async_client):
+    in_flight = [0, 0] # current, max
+    
+    async def query_fn(db, item):
+        in_flight[0] += 1
+        in_flight[1] = max(in_flight)
+        await asyncio.sleep(0.001 * (10 - item))
+        in_flight[0] -= 1
+        return item * 2
+    
+    results, _ = run_map(range(10), query_fn, concurrency=4)
+    assert results == [(item, item * 2) for item in range(10)]
+    assert in_flight[1] == 4
+    
+    results, _ = run_map(range(10), query_fn, concurrency=4, ordered=False)
+    assert sorted(results) == [(item, item * 2) for item in range(10)]
+    assert [item for item, _ in results][:4] != [0, 1, 2, 3] # the slow first items complete last
+
+
+def test_retries(async_client):
+    failures = collections.Counter()
+    
+    async def query_fn(db, item):
+        if failures[item] < 2:
+            failures[item] += 1
+            raise errors.AutoReconnect('connection lost')
+        return item
+    
+    results, engine = run_map([1, 2], query_fn, retries=2, retry_delay=0.001)
+    assert results == [(1, 1), (2, 2)] and engine.retries_n == 4
+    
+    failures.clear()
+    with pytest.raises(errors.AutoReconnect):
+        run_map([1], query_fn, retries=1, retry_delay=0.001)
+
+
+def test_find_grouped(db, async_client, corpus):
+    user_ids = sorted({tweet['user']['id'] for tweet in corpus[1]})[::3] + [-1] # a user without tweets
+    user_ids_set = set(user_ids)
+    expected = collections.defaultdict(list)
+    for doc in db[TW_NT_COL].find(projection={'_id': 0, 'id': 1, 'user.id': 1}):
+        if doc['user']['id'] in user_ids_set:
+            expected[doc['user']['id']].append(doc['id'])
+    
+    groups = list(async_queries.find_grouped(TEST_DB_NAME, TW_NT_COL, 'user.id', user_ids,
+                                             projection={'_id': 0, 'id': 1, 'user.id': 1}, chunk_size=20, concurrency=4))
+    assert [user_id for user_id, _ in groups] == sorted(expected)
+    assert {user_id: sorted(doc['id'] for doc in docs_lst) for user_id, docs_lst in groups} == \
+           {user_id: sorted(ids) for user_id, ids in expected.items()}
+
+
+def test_stream_stops_early(async_client):
+    async def query_fn(db, item):
+        return item
+    
+    results = async_queries.stream(TEST_DB_NAME, query_fn, range(10 ** 6), concurrency=8)
+    assert [next(results) for _ in range(5)] == [(item, item) for item in range(5)]
+    results.close() # stops the background thread
+
+
+def test_get_unique_user_async(db, async_client, corpus, tmp_path):
+    user_ids = sorted({tweet['user']['id'] for tweet in corpus[1] if 'retweeted_status' not in tweet})
+    with shared_ids.SharedIds(user_ids) as unique_user_ids:
+        users_lsts = []
+        for async_concurrency in [None, 4]:
+            output_files = [str(tmp_path / '{}-{}.json'.format(async_concurrency, batch_i)) for batch_i in range(2)]
+            for batch_i in range(2):
+                multiprocessing_workers.worker_get_unique_user(TEST_DB_NAME, TW_NT_COL, batch_i, 2, output_files[batch_i],
+                                                               unique_user_ids, chunk_size=50,
+                                                               async_concurrency=async_concurrency)
+            users_lsts.append(sorted(read_outputs(output_files), key=lambda user_obj: user_obj['id']))
+    assert [user_obj['id'] for user_obj in users_lsts[0]] == user_ids
+    assert users_lsts[1] == users_lsts[0]
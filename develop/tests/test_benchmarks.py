@@ -0,0 +1,21 @@
+import json
+
+import benchmarks
+
+
+def write_results(results_file, helpers, stages):
+    with open(results_file, 'w') as f:
+        json.dump({'helpers': {name: {'items_per_sec': value} for name, value in helpers.items()},
+                   'stages': {name: {'docs_per_sec': value} for name, value in stages.items()}}, f)
+    return str(results_file)
+
+
+def test_compare_results(tmp_path):
+    baseline_file = write_results(tmp_path / 'baseline.json', {'parse': 1000.0, 'tag': 500.0, 'old': 10.0},
+                                  {'parse_created_at': 200.0, 'tag_kws': 100.0})
+    results_file = write_results(tmp_path / 'results.json', {'parse': 950.0, 'tag': 300.0, 'new': 1.0},
+                                 {'parse_created_at': 100.0, 'tag_kws': 150.0})
+    assert benchmarks.compare_results(baseline_file, results_file) == [('tag', 500.0, 300.0),
+                                                                       ('parse_created_at', 200.0, 100.0)]
+    assert benchmarks.compare_results(baseline_file, results_file, tolerance=0.6) == []
+    assert benchmarks.compare_results(baseline_file, baseline_file) == []
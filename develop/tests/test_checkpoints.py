@@ -0,0 +1,97 @@
+import copy
+import os
+
+import pytest
+
+import checkpoints
+import mongodb
+import multiprocessing_workers
+import sinks
+import utilities
+from config import * # import all global config variables
+
+from conftest import read_outputs
+
+
+DB_NAME = 'test_checkpoints'
+PROCEDURE_NAME = 'parse_created_at'
+
+
+class CrashingCheckpointer(checkpoints.Checkpointer):
+    """
+    Checkpointer whose process crashes before committing its crash_at-th range
+    """
+
+    def __init__(self, *args, crash_at=3, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.crash_at = crash_at
+        self.commits_n = 0
+
+    def commit_range(self, range_i, sink=None):
+        self.commits_n += 1
+        if self.commits_n == self.crash_at:
+            raise RuntimeError('crash')
+        super().commit_range(range_i, sink=sink)
+
+
+def run_parse_created_at(checkpointer, output_dir, process_n=2, ranges_n=6):
+    collection = mongodb.initialize(DB_NAME, TW_RAW_COL)
+    id_ranges_queue = checkpointer.gen_pending_id_ranges_queue(collection, ranges_n, process_n, sample_size=500)
+    for batch_i in range(process_n):
+        output_file = os.path.join(output_dir, '{}-{}.json'.format(PROCEDURE_NAME, batch_i))
+        multiprocessing_workers.worker_parse_created_at(DB_NAME, TW_RAW_COL, batch_i, process_n, output_file,
+                                                        id_ranges_queue, 500, checkpointer)
+
+
+def test_resume_after_crash(mongo_client, corpus, tmp_path):
+    tweets_lst = corpus[1]
+    mongo_client.drop_database(DB_NAME)
+    mongo_client[DB_NAME][TW_RAW_COL].insert_many(copy.deepcopy(tweets_lst[:2000]))
+    output_dir = str(tmp_path)
+
+    with pytest.raises(RuntimeError):
+        run_parse_created_at(CrashingCheckpointer(DB_NAME, PROCEDURE_NAME, crash_at=3), output_dir)
+    checkpointer = checkpoints.Checkpointer(DB_NAME, PROCEDURE_NAME)
+    assert checkpointer.get_progress()[0] == 2
+
+    # resume, then refresh after new tweets arrive
+    run_parse_created_at(checkpointer, output_dir)
+    mongo_client[DB_NAME][TW_RAW_COL].insert_many(copy.deepcopy(tweets_lst[2000:]))
+    run_parse_created_at(checkpointer, output_dir)
+    done_n, planned_n = checkpointer.get_progress()
+    assert done_n == planned_n
+
+    output_lst = read_outputs(checkpointer.get_range_files(output_dir))
+    assert sorted(doc['id'] for doc in output_lst) == sorted(tweet['id'] for tweet in tweets_lst) # each tweet once
+    expected = {tweet['id']: utilities.parse_tweet_created_at_str(tweet['created_at']) for tweet in tweets_lst}
+    assert all(doc['created_at_parsed'] == expected[doc['id']] for doc in output_lst)
+
+    # nothing left to do
+    assert checkpointer.plan_pending_id_ranges(mongo_client[DB_NAME][TW_RAW_COL], 6, sample_size=500) == []
+    checkpointer.reset()
+    assert checkpointer.get_progress() == (0, 0)
+
+
+def test_open_sink_with_checkpointer(tmp_path):
+    checkpointer = checkpoints.Checkpointer(DB_NAME, PROCEDURE_NAME)
+    assert isinstance(sinks.open_sink(str(tmp_path / 'out.json'), checkpointer), sinks.RangeFilesSink)
+    assert isinstance(sinks.open_sink(str(tmp_path / 'out.json')), sinks.JsonLinesSink)
+    with pytest.raises(ValueError):
+        sinks.open_sink(sinks.MongoBulkSink(DB_NAME, 'out'), checkpointer)
+    upsert_sink = sinks.MongoBulkSink(DB_NAME, 'out', upsert_key='id')
+    assert sinks.open_sink(upsert_sink, checkpointer) is upsert_sink
+
+
+def test_range_files_sink(mongo_client, tmp_path):
+    checkpointer = checkpoints.Checkpointer(DB_NAME, 'range_files')
+    output_file = str(tmp_path / 'out.json')
+    with sinks.RangeFilesSink(output_file, checkpointer) as sink:
+        sink.write({'id': 1})
+        sink.commit(0)
+        sink.commit(1) # an empty range
+        sink.write({'id': 2}) # never committed
+        with pytest.raises(ValueError):
+            sink.commit()
+    assert read_outputs([checkpointer.gen_range_filename(0, str(tmp_path))]) == [{'id': 1}]
+    assert os.path.exists(checkpointer.gen_range_filename(1, str(tmp_path)))
+    assert os.path.exists(output_file + '.part')
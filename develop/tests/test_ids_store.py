@@ -0,0 +1,58 @@
+import pickle
+
+import numpy as np
+import pytest
+
+import ids_store
+
+
+@pytest.fixture
+def id_sets():
+    rng = np.random.default_rng(0)
+    return (set(rng.integers(0, 5000, size=2000).tolist()), set(rng.integers(2500, 7500, size=2000).tolist()))
+
+
+def test_to_ids_array(id_sets):
+    ids_a = id_sets[0]
+    for ids in [ids_a, list(ids_a) * 2, np.array(list(ids_a), dtype=np.int32)]:
+        ids_arr = ids_store.to_ids_array(ids)
+        assert ids_arr.dtype == np.int64
+        assert ids_arr.tolist() == sorted(ids_a)
+    assert len(ids_store.to_ids_array([])) == 0
+
+
+def test_set_ops_match_python_sets(id_sets):
+    ids_a, ids_b = id_sets
+    ids_arr_a, ids_arr_b = ids_store.to_ids_array(ids_a), ids_store.to_ids_array(ids_b)
+    assert ids_store.intersect(ids_arr_a, ids_arr_b).tolist() == sorted(ids_a & ids_b)
+    assert ids_store.union(ids_arr_a, ids_arr_b).tolist() == sorted(ids_a | ids_b)
+    assert ids_store.difference(ids_arr_a, ids_arr_b).tolist() == sorted(ids_a - ids_b)
+    values = list(range(-10, 8000, 3))
+    assert ids_store.isin(ids_arr_a, values).tolist() == [value in ids_a for value in values]
+    assert [ids_store.contains(ids_arr_a, value) for value in values[:200]] == [value in ids_a for value in values[:200]]
+
+
+def test_set_ops_on_empty_arrays(id_sets):
+    ids_arr = ids_store.to_ids_array(id_sets[0])
+    empty_arr = ids_store.to_ids_array([])
+    assert not ids_store.isin(empty_arr, [1, 2]).any()
+    assert not ids_store.contains(empty_arr, 1)
+    assert ids_store.difference(ids_arr, empty_arr).tolist() == ids_arr.tolist()
+    assert len(ids_store.intersect(ids_arr, empty_arr)) == 0
+
+
+def test_save_load_roundtrip(id_sets, tmp_path):
+    ids_pkl = str(tmp_path / 'ids_lst.pkl')
+    npy_path = ids_store.save_ids(id_sets[0], ids_pkl)
+    assert npy_path == str(tmp_path / 'ids_lst.npy')
+    for mmap in [True, False]:
+        assert ids_store.load_ids(ids_pkl, mmap=mmap).tolist() == sorted(id_sets[0])
+
+
+def test_migrate_ids_pkl(id_sets, tmp_path):
+    ids_pkl = str(tmp_path / 'ids_lst.pkl')
+    with open(ids_pkl, 'wb') as f:
+        pickle.dump(list(id_sets[1]), f)
+    assert ids_store.load_ids(ids_pkl).tolist() == sorted(id_sets[1]) # read from the pickle before migrating
+    ids_store.migrate_ids_pkl(ids_pkl, remove_pkl=True)
+    assert ids_store.load_ids(ids_pkl).tolist() == sorted(id_sets[1])
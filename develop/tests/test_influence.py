@@ -0,0 +1,107 @@
+import collections
+
+import numpy as np
+import pytest
+
+import influence
+import mongodb
+import utilities
+from config import * # import all global config variables
+
+from conftest import TEST_DB_NAME
+
+
+def expected_aggregates(tweets_lst):
+    """
+    Per-user aggregates computed tweet by tweet
+    """
+    expected = collections.defaultdict(lambda: dict.fromkeys(influence.SUM_COLS, 0))
+    latest = {}
+    rt_tids = collections.defaultdict(set)
+    for tweet in tweets_lst:
+        if 'retweeted_status' in tweet:
+            row = expected[tweet['retweeted_status']['user']['id']]
+            is_ibm = utilities.simple_test_keyword_in_text(tweet['user'].get('description'), 'ibm')
+            row['all_srt'] += 1
+            row['ibm_srt' if is_ibm else 'nonibm_srt'] += 1
+            for col in ['all_n', 'ibm_n' if is_ibm else 'nonibm_n']:
+                if tweet['retweeted_status']['id'] not in rt_tids[col]:
+                    rt_tids[col].add(tweet['retweeted_status']['id'])
+                    row[col] += 1
+        else:
+            uid = tweet['user']['id']
+            row = expected[uid]
+            srt = tweet.get('retweet_count') or 0
+            kind = 'q' if 'quoted_status' in tweet else 'p' if tweet.get('in_reply_to_status_id') is not None else 'nr'
+            row['n_n'] += 1
+            row['n_src'] += srt
+            row[kind + '_n'] += 1
+            row[kind + '_src'] += srt
+            if uid not in latest or tweet['id'] > latest[uid][0]:
+                latest[uid] = (tweet['id'], tweet['user'].get('followers_count') or 0)
+    for uid, (_, fo) in latest.items():
+        expected[uid]['fo'] = fo
+    return expected
+
+
+def check_aggregates(acc, tweets_lst):
+    expected = expected_aggregates(tweets_lst)
+    acc.consolidate()
+    assert acc.uids.tolist() == sorted(expected)
+    for col in influence.SUM_COLS:
+        assert acc.cols[col].tolist() == [expected[uid][col] for uid in sorted(expected)], col
+    assert acc.cols['fo'].tolist() == [expected[uid].get('fo', -1) for uid in sorted(expected)]
+
+
+def scan(acc, db_name):
+    acc.scan_collection(mongodb.initialize(db_name, TW_NT_COL), acc.add_native_tweets, influence.NATIVE_PROJECTION, 300)
+    acc.scan_collection(mongodb.initialize(db_name, TW_RT_COL), acc.add_retweets, influence.RETWEET_PROJECTION, 300)
+
+
+def test_scan_matches_tweet_by_tweet(db, corpus):
+    acc = influence.InfluenceAccumulator(merge_rows=1000)
+    scan(acc, TEST_DB_NAME)
+    check_aggregates(acc, corpus[1])
+
+
+@pytest.mark.parametrize('batch_size', [None, 100])
+def test_incremental_update(db, mongo_client, corpus, tmp_path, monkeypatch, batch_size):
+    monkeypatch.setattr(mongodb, 'CURSOR_BATCH_SIZE', batch_size)
+    db_name = 'test_influence_{}'.format(batch_size)
+    mongo_client.drop_database(db_name)
+    natives_lst = list(db[TW_NT_COL].find(sort=[('_id', 1)]))
+    retweets_lst = list(db[TW_RT_COL].find(sort=[('_id', 1)]))
+    
+    mongo_client[db_name][TW_NT_COL].insert_many(natives_lst[:len(natives_lst) // 2])
+    mongo_client[db_name][TW_RT_COL].insert_many(retweets_lst[:len(retweets_lst) // 3])
+    acc = influence.InfluenceAccumulator(merge_rows=1000)
+    scan(acc, db_name)
+    state_file = str(tmp_path / 'influence.npz')
+    acc.save(state_file)
+    
+    # only the new documents are scanned after loading the state
+    mongo_client[db_name][TW_NT_COL].insert_many(natives_lst[len(natives_lst) // 2:])
+    mongo_client[db_name][TW_RT_COL].insert_many(retweets_lst[len(retweets_lst) // 3:])
+    acc = influence.InfluenceAccumulator.load(state_file)
+    assert acc.scan_collection(mongodb.initialize(db_name, TW_NT_COL), acc.add_native_tweets,
+                               influence.NATIVE_PROJECTION) == len(natives_lst) - len(natives_lst) // 2
+    acc.scan_collection(mongodb.initialize(db_name, TW_RT_COL), acc.add_retweets, influence.RETWEET_PROJECTION)
+    check_aggregates(acc, natives_lst + retweets_lst)
+
+
+def test_influence_table():
+    acc = influence.InfluenceAccumulator()
+    acc.add_native_tweets([{'id': 1, 'user': {'id': 10, 'followers_count': 100}, 'retweet_count': 4},
+                           {'id': 2, 'user': {'id': 10, 'followers_count': 200}, 'retweet_count': 6},
+                           {'id': 3, 'user': {'id': 20, 'followers_count': 0}, 'retweet_count': 0}])
+    acc.add_followers([{'uid': 10, 'followers_count': 50, 'ibm_followers_count': 5}])
+    acc.add_retweets([{'user': {'id': 30, 'description': 'IBM research'}, 'retweeted_status': {'id': 1, 'user': {'id': 10}}},
+                      {'user': {'id': 40, 'description': ''}, 'retweeted_status': {'id': 2, 'user': {'id': 10}}}])
+    table = influence.influence_table(acc).set_index('uid')
+    assert table.loc[10, 'fo'] == 200
+    assert table.loc[10, ['all_n', 'ibm_n', 'nonibm_n']].tolist() == [2, 1, 1]
+    assert table.loc[10, 'simple_inf'] == pytest.approx(10 / (200 * 2))
+    assert table.loc[10, 'in_simple_inf'] == pytest.approx(1 / (5 * 2))
+    assert table.loc[10, 'out_compound_inf'] == pytest.approx(1 / 2 * np.log(45))
+    assert np.isnan(table.loc[20, 'all_simple_inf'])
+    assert influence.influence_table(acc, uids=[20])['uid'].tolist() == [20]
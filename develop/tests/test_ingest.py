@@ -0,0 +1,53 @@
+import collections
+
+import ingest
+import synthetic_corpus
+from config import *
+
+from conftest import TEST_DB_NAME
+
+
+def test_ingest_routes_tweets(db, corpus):
+    tweets_lst = corpus[1]
+    expected = collections.Counter(col_name for tweet in tweets_lst for col_name in ingest.route_tweet(tweet))
+    for col_name in [TW_RAW_COL, TW_NT_COL, TW_RT_COL, TW_NT_QT_COL, TW_RT_QT_COL]:
+        assert db[col_name].count_documents({}) == expected[col_name]
+    assert expected[TW_RT_COL] > 0 and expected[TW_NT_QT_COL] > 0
+
+
+def test_ingest_skips_duplicates(db, corpus, tmp_path):
+    tweets_lst = corpus[1]
+    raw_file = str(tmp_path / 'more.json')
+    synthetic_corpus.write_raw_dump(tweets_lst[-100:] + tweets_lst[:50], raw_file)
+    stats = ingest.ingest_raw_files([raw_file], db_name=TEST_DB_NAME, build_indexes=False)
+    assert stats['duplicates'] == 150
+    assert stats[TW_RAW_COL] == 0
+    assert db[TW_RAW_COL].count_documents({}) == len(tweets_lst)
+
+
+def test_ingest_counts_dropped_lines(mongo_client, tmp_path):
+    raw_file = str(tmp_path / 'raw.json')
+    with open(raw_file, 'w') as f:
+        f.write('{"delete": {}}\n{"id": 1}\nnot json\n\n{"id": 2, "user": {"id": 3}, "text": "a"}\n')
+    stats = ingest.ingest_raw_files([raw_file], db_name='test_ingest_dropped', build_indexes=False)
+    assert (stats['server_messages'], stats['no_user'], stats['malformed'], stats[TW_RAW_COL]) == (1, 1, 1, 1)
+
+
+def test_ingest_migrates_non_unique_index(mongo_client, corpus, tmp_path):
+    # as loaded by 20170414-clean_raw_data: non-unique 'id_1' index, duplicated tweets
+    db_name = 'test_ingest_migrate'
+    mongo_client.drop_database(db_name)
+    tweets_lst = corpus[1][:100]
+    mongo_client[db_name][TW_RAW_COL].insert_many([dict(tweet) for tweet in tweets_lst + tweets_lst[:10]])
+    mongo_client[db_name][TW_RAW_COL].create_index('id')
+    
+    raw_file = str(tmp_path / 'more.json')
+    synthetic_corpus.write_raw_dump(corpus[1][90:120], raw_file)
+    stats = ingest.ingest_raw_files([raw_file], db_name=db_name)
+    assert (stats['duplicates'], stats[TW_RAW_COL]) == (10, 20)
+    tw_raw_col = mongo_client[db_name][TW_RAW_COL]
+    assert sorted(tw_raw_col.distinct('id')) == sorted(tweet['id'] for tweet in corpus[1][:120])
+    assert tw_raw_col.count_documents({}) == 120
+    assert tw_raw_col.index_information()['id_1'].get('unique')
+    assert 'user.id_1' in tw_raw_col.index_information()
+    mongo_client.drop_database(db_name)
@@ -0,0 +1,106 @@
+import multiprocessing
+import pickle
+import signal
+import time
+
+import pytest
+
+import instrumentation
+
+
+class ListSink(object):
+
+    def __init__(self):
+        self.docs_lst = []
+        self.closed = False
+
+    def write(self, doc):
+        time.sleep(0.001)
+        self.docs_lst.append(doc)
+
+    def commit(self, range_i=None):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def run_worker(instrument, batch_i, process_n, docs_n):
+    stats = instrumentation.start(instrument, batch_i, process_n)
+    with stats.wrap_sink(ListSink()) as sink:
+        for doc in stats.iter_docs(range(docs_n)):
+            if doc % 2:
+                sink.write(doc)
+    stats.add('evens', docs_n // 2)
+    return stats.finish()
+
+
+@instrumentation.instrumented
+def failing_worker(instrument):
+    stats = instrumentation.start(instrument, 0, 1)
+    for _ in stats.iter_docs(range(10)):
+        pass
+    raise RuntimeError('worker failed')
+
+
+def test_counters_and_timers():
+    instrument = instrumentation.Instrument('test', report_interval=60)
+    snapshot = run_worker(instrument, 1, 2, 100)
+    assert snapshot['done'] and (snapshot['batch_i'], snapshot['process_n']) == (1, 2)
+    assert snapshot['counters'] == {'docs_read': 100, 'docs_written': 50, 'evens': 50}
+    assert snapshot['timers']['write'] >= 0.05 and snapshot['timers']['cursor_wait'] >= 0
+    assert abs(sum(snapshot['timers'].values()) - snapshot['elapsed']) < 0.01
+    assert instrument.stats_queue.get(timeout=5) == snapshot
+    assert instrumentation.start(None, 0, 1).finish() is None
+
+
+def test_plain_queue_is_not_picklable():
+    instrument = instrumentation.Instrument('test')
+    with pytest.raises(RuntimeError):
+        pickle.dumps(instrument)
+
+
+def test_monitor_processes(tmp_path):
+    profile_file = str(tmp_path / 'profile.json')
+    instrument = instrumentation.Instrument('test', total_docs_n=300, report_interval=0.01, profile_file=profile_file)
+    jobs = [multiprocessing.Process(target=run_worker, args=(instrument, batch_i, 3, 100 * (batch_i + 1)))
+            for batch_i in range(3)]
+    for job in jobs:
+        job.start()
+    profile = instrument.monitor(jobs, print_interval=0.05)
+    for job in jobs:
+        job.join()
+    assert [snapshot['batch_i'] for snapshot in profile['processes']] == [0, 1, 2]
+    assert all(snapshot['done'] for snapshot in profile['processes'])
+    assert profile['summary']['counters']['docs_read'] == 600
+    assert profile['summary']['processes_done'] == 3 and profile['summary']['straggler'] is None
+    assert profile['summary']['eta'] == 0
+
+
+def test_manager_queue_in_pool_tasks():
+    with multiprocessing.Manager() as manager, multiprocessing.Pool(2) as pool:
+        instrument = instrumentation.Instrument('test', report_interval=60, manager=manager)
+        pickle.dumps(instrument)
+        async_results = [pool.apply_async(run_worker, args=(instrument, batch_i, 2, 10)) for batch_i in range(2)]
+        profile = instrument.monitor(async_results, print_interval=0.05)
+        assert [result.get(timeout=10)['counters']['docs_read'] for result in async_results] == [10, 10]
+    assert profile['summary']['counters']['docs_written'] == 10
+
+
+def test_profiler_stopped_when_worker_raises():
+    instrument = instrumentation.Instrument('test', report_interval=60, profile=True)
+    with pytest.raises(RuntimeError):
+        failing_worker(instrument)
+    assert signal.getitimer(signal.ITIMER_PROF) == (0.0, 0.0)
+    assert signal.getsignal(signal.SIGPROF) == signal.SIG_DFL
+    assert instrumentation.running_profilers == []
+    
+    snapshot = run_worker(instrument, 0, 1, 1000)
+    assert snapshot['profile']['interval'] == instrument.profile_interval
+    assert signal.getitimer(signal.ITIMER_PROF) == (0.0, 0.0)
@@ -0,0 +1,58 @@
+import pytest
+
+import keywords_matcher
+import utilities
+from config import * # import all global config variables
+
+
+def test_matches_simple_test_loop(corpus):
+    users_lst, tweets_lst = corpus
+    texts_lst = [tweet['text'] for tweet in tweets_lst] + [user['description'] for user in users_lst] + ['', None]
+    kws_lst = API_QUERY_KWS + ['ibm']
+    for ignore_case in [True, False]:
+        matcher = keywords_matcher.KeywordsMatcher(kws_lst, ignore_case=ignore_case)
+        for text in texts_lst:
+            expected = [utilities.simple_test_keyword_in_text(text, kw, ignore_case=ignore_case) for kw in kws_lst]
+            assert matcher.tag(text) == expected
+            assert matcher.test(text) == any(expected)
+            assert matcher.mask(text) == sum(1 << kw_ind for kw_ind, hit in enumerate(expected) if hit)
+
+
+@pytest.mark.parametrize('kws_lst', [['ibm'], ['ibm', '#AI', 'cloud', 'watson', 'blockchain']])
+@pytest.mark.parametrize('text, hit', [('test on IBM', True), ('this is a test on #Ibm tag', True),
+                                       ('This is another test IBM@London', True), ('IBM.', True),
+                                       ('test onibm', False), ('test on iloveibmhahaha', False),
+                                       ('IBMer, Mainframe supporter', False), ('ibm_france', False)])
+def test_word_boundary(kws_lst, text, hit):
+    matcher = keywords_matcher.KeywordsMatcher(kws_lst, word_boundary=True)
+    assert matcher.test(text) == hit
+    assert matcher.tag(text)[0] == hit
+    # without word boundaries any substring hits
+    assert keywords_matcher.KeywordsMatcher(kws_lst).test(text)
+
+
+@pytest.mark.parametrize('text, hit', [('#AI', True), ('love #ai!', True), ('#AI.', True), ('#AIR', False),
+                                       ('x#AI', False), ('#AI_lab', False), ('AI', False)])
+def test_word_boundary_hashtag(text, hit):
+    for kws_lst in [['#AI'], ['#AI', 'watson', 'blockchain', 'cloud foundry']]:
+        assert keywords_matcher.KeywordsMatcher(kws_lst, word_boundary=True).test(text) == hit
+
+
+def test_case_sensitive_kws():
+    matcher = keywords_matcher.KeywordsMatcher(['ibm', 'AI'], case_sensitive_kws=['AI'])
+    assert matcher.tag('IBM and AI') == [True, True]
+    assert matcher.tag('ibm said') == [True, False] # 'said' has 'ai' but not 'AI'
+    assert not matcher.test('said')
+    assert keywords_matcher.KeywordsMatcher(['AI'], ignore_case=False).tag('ai AI') == [True]
+
+
+def test_empty_keyword_never_matches():
+    matcher = keywords_matcher.KeywordsMatcher(['', 'ibm'])
+    assert matcher.tag('some text') == [False, False]
+    assert matcher.tag('IBM') == [False, True]
+    assert not keywords_matcher.KeywordsMatcher(['']).test('some text')
+
+
+def test_get_matcher_is_cached():
+    assert keywords_matcher.get_matcher(['ibm', 'ai']) is keywords_matcher.get_matcher(['ibm', 'ai'])
+    assert keywords_matcher.get_matcher(['ibm']) is not keywords_matcher.get_matcher(['ibm'], word_boundary=True)
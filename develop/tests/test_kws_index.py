@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+import kws_index
+import mongodb
+
+
+KWS_LST = ['ibm', 'watson', '#AI']
+
+
+@pytest.mark.parametrize('densities', [(0.01, 0.02), (0.01, 0.5), (0.3, 0.6)])
+def test_roaring_ops_match_sets(densities):
+    rng = np.random.default_rng(0)
+    ordinals_n = 5 * kws_index.CONTAINER_SIZE
+    a, b = [np.flatnonzero(rng.random(ordinals_n) < density) for density in densities]
+    bitmap_a, bitmap_b = kws_index.RoaringBitmap.from_ordinals(a), kws_index.RoaringBitmap.from_ordinals(b)
+    assert bitmap_a.to_ordinals().tolist() == a.tolist() and len(bitmap_a) == len(a)
+    assert (bitmap_a & bitmap_b).to_ordinals().tolist() == np.intersect1d(a, b).tolist()
+    assert (bitmap_b & bitmap_a).to_ordinals().tolist() == np.intersect1d(a, b).tolist()
+    assert (bitmap_a | bitmap_b).to_ordinals().tolist() == np.union1d(a, b).tolist()
+    assert (bitmap_a - bitmap_b).to_ordinals().tolist() == np.setdiff1d(a, b).tolist()
+    assert (bitmap_b - bitmap_a).to_ordinals().tolist() == np.setdiff1d(b, a).tolist()
+    restored = kws_index.RoaringBitmap.from_arrays(**bitmap_b.to_arrays())
+    assert restored.to_ordinals().tolist() == b.tolist()
+
+
+def test_empty_bitmaps():
+    empty = kws_index.RoaringBitmap.from_ordinals(np.zeros(0, dtype=np.int64))
+    full = kws_index.RoaringBitmap.from_range(10)
+    assert len(empty) == 0 and len(empty & full) == 0 and (empty | full).to_ordinals().tolist() == list(range(10))
+    assert kws_index.RoaringBitmap.from_arrays(**empty.to_arrays()).to_ordinals().tolist() == []
+
+
+@pytest.fixture(scope='module')
+def tagged(mongo_client, tmp_path_factory):
+    """
+    (index built from a tag collection with 'kws_mask', index built from the same tags in 'X_<i>' fields,
+    tweet ids, user ids, masks)
+    """
+    rng = np.random.default_rng(1)
+    tweets_n = 3000
+    tweet_ids = rng.permutation(np.arange(tweets_n, dtype=np.int64) * 7 + 10 ** 15)
+    user_ids = rng.integers(0, 200, tweets_n)
+    masks = (rng.random((tweets_n, len(KWS_LST))) < [0.3, 0.1, 0.05]) @ (1 << np.arange(len(KWS_LST)))
+    db = mongo_client['test_kws_index']
+    db['tag_mask'].insert_many([{'id': int(tid), 'user_id': int(uid), 'kws_mask': int(mask)}
+                                for tid, uid, mask in zip(tweet_ids, user_ids, masks)])
+    db['tag_fields'].insert_many([dict({'id': int(tid), 'user_id': int(uid)},
+                                       **{'X_{}'.format(ind): bool(mask >> ind & 1) for ind in range(len(KWS_LST))})
+                                  for tid, uid, mask in zip(tweet_ids, user_ids, masks)])
+    index_dir = tmp_path_factory.mktemp('kws_index')
+    indexes = [kws_index.build_kws_index(KWS_LST, db_name='test_kws_index', collection_name=collection_name,
+                                         index_dir=str(index_dir / collection_name), chunk_size=500)
+               for collection_name in ['tag_mask', 'tag_fields']]
+    yield indexes, tweet_ids, user_ids, masks
+    mongo_client.drop_database('test_kws_index')
+
+
+def test_queries_match_masks(tagged):
+    indexes, tweet_ids, user_ids, masks = tagged
+    has = lambda ind: (masks >> ind & 1).astype(bool)
+    queries = [({'all_of': ['ibm']}, has(0)),
+               ({'all_of': ['ibm', 'watson']}, has(0) & has(1)),
+               ({'any_of': ['watson', '#AI']}, has(1) | has(2)),
+               ({'all_of': ['ibm'], 'none_of': [2]}, has(0) & ~has(2)),
+               ({'none_of': ['ibm']}, ~has(0)),
+               ({}, np.ones(len(masks), dtype=bool))]
+    for index in indexes:
+        assert len(index) == len(tweet_ids) and np.asarray(index.tweet_ids).tolist() == sorted(tweet_ids.tolist())
+        for query, expected_mask in queries:
+            assert index.count(**query) == expected_mask.sum(), query
+            assert index.ids(**query).tolist() == sorted(tweet_ids[expected_mask].tolist()), query
+            order = np.argsort(tweet_ids)
+            assert index.match_masks(**query).tolist() == expected_mask[order].tolist(), query
+
+
+def test_user_rollup(tagged):
+    indexes, tweet_ids, user_ids, masks = tagged
+    df = indexes[0].user_rollup(all_of=['ibm'], user_ids=[5, 7, 1000])
+    for user_id in [5, 7]:
+        row = df[df['user_id'] == user_id].iloc[0]
+        assert row['tweets_num'] == (user_ids == user_id).sum()
+        assert row['matched_num'] == ((user_ids == user_id) & (masks & 1 == 1)).sum()
+    assert df['user_id'].tolist() == [5, 7]
+    assert indexes[0].user_rollup()['tweets_num'].sum() == len(tweet_ids)
+
+
+def test_too_many_keywords():
+    with pytest.raises(ValueError):
+        kws_index.build_kws_index(['kw{}'.format(ind) for ind in range(kws_index.MAX_MASK_KWS + 1)])
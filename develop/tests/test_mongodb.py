@@ -0,0 +1,113 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import mongodb
+
+
+class FakeClient(object):
+    """
+    Records how it was created and whether it was closed
+    """
+
+    def __init__(self, host, port, **options):
+        self.host, self.port, self.options = host, port, options
+        self.pid = os.getpid()
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_clients(monkeypatch):
+    factory = mongodb.client_factory
+    monkeypatch.setattr(mongodb, 'CLIENT_SETTINGS', dict(mongodb.CLIENT_SETTINGS))
+    monkeypatch.setattr(mongodb, 'CURSOR_BATCH_SIZE', mongodb.CURSOR_BATCH_SIZE)
+    mongodb.set_client_factory(FakeClient)
+    yield
+    mongodb.set_client_factory(factory)
+
+
+def test_clients_reused_per_options(fake_clients):
+    client = mongodb.get_client()
+    assert mongodb.get_client('localhost', 27017) is client
+    assert client.options == {}
+    assert mongodb.get_client(port=27018) is not client
+    other = mongodb.get_client(maxPoolSize=5)
+    assert other is not client and other.options == {'maxPoolSize': 5}
+    assert mongodb.get_client(maxPoolSize=5) is other
+    
+    mongodb.close_clients()
+    assert client.closed and other.closed
+    assert mongodb.get_client() is not client
+
+
+def test_configure(fake_clients):
+    client = mongodb.get_client()
+    mongodb.configure(max_pool_size=10, compressors='zstd', batch_size=500)
+    assert mongodb.CURSOR_BATCH_SIZE == 500
+    configured = mongodb.get_client()
+    assert configured is not client and configured.options == {'maxPoolSize': 10, 'compressors': 'zstd'}
+    # explicit options override the settings
+    assert mongodb.get_client(maxPoolSize=2).options == {'maxPoolSize': 2, 'compressors': 'zstd'}
+    mongodb.configure(read_preference='secondaryPreferred')
+    assert mongodb.get_client().options['readPreference'] == 'secondaryPreferred'
+    assert mongodb.CLIENT_SETTINGS['maxPoolSize'] == 10
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_fresh_client_after_fork(fake_clients):
+    client = mongodb.get_client()
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0: # child: report whether it got its own client, without closing the parent's one
+        try:
+            child_client = mongodb.get_client()
+            ok = child_client is not client and child_client.pid == os.getpid() and mongodb.get_client() is child_client
+            mongodb.close_clients()
+            os.write(write_fd, b'1' if ok and not client.closed else b'0')
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    assert os.read(read_fd, 1) == b'1'
+    os.waitpid(pid, 0)
+    os.close(read_fd)
+    assert mongodb.get_client() is client and not client.closed
+
+
+def test_fresh_client_after_fork_without_hooks(fake_clients, monkeypatch):
+    # as if forked without going through os.register_at_fork hooks: the pid check resets the clients
+    client = mongodb.get_client()
+    monkeypatch.setattr(mongodb, 'clients_pid', -1)
+    assert mongodb.get_client() is not client
+    assert mongodb.clients_pid == os.getpid() and not client.closed
+
+
+def test_clients_closed_at_exit():
+    code = '\n'.join(['import mongodb',
+                      'class Client(object):',
+                      '    def __init__(self, host, port, **options): pass',
+                      '    def close(self): print("closed")',
+                      'mongodb.set_client_factory(Client)',
+                      'mongodb.get_client()'])
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=os.path.dirname(os.path.dirname(__file__)))
+    assert output.decode().split() == ['closed']
+
+
+def test_gen_id_ranges_from_samples(mongo_client):
+    # (mongomock has no '$bucketAuto' for exact split points)
+    sample_size = 100
+    collection = mongo_client['test_id_ranges']['col']
+    collection.drop()
+    assert mongodb.gen_id_ranges(collection, 4, sample_size=sample_size) == [(None, None)]
+    collection.insert_many([{'n': n} for n in range(1000)])
+    assert mongodb.gen_id_ranges(collection, 4, sample_size=sample_size, filter={'n': -1}) == [(None, None)]
+    
+    id_ranges = mongodb.gen_id_ranges(collection, 4, sample_size=sample_size, field='n')
+    assert 2 <= len(id_ranges) <= 4 and id_ranges[0][0] is None and id_ranges[-1][1] is None
+    counts = [collection.count_documents(mongodb.gen_id_range_filter(id_range, field='n')) for id_range in id_ranges]
+    assert sum(counts) == 1000
+    mongo_client.drop_database('test_id_ranges')
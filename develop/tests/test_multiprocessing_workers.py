@@ -0,0 +1,95 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import multiprocessing_workers
+import shared_ids
+import utilities
+from config import * # import all global config variables
+
+from conftest import TEST_DB_NAME, read_outputs, run_batches
+
+
+def test_worker_without_id_ranges_queue_fails_at_start(tmp_path):
+    # fails before connecting to the database or opening the output file
+    output_file = str(tmp_path / 'out.json')
+    with pytest.raises(ValueError):
+        multiprocessing_workers.worker_parse_created_at('db', 'col', 0, 1, output_file)
+    with pytest.raises(ValueError):
+        multiprocessing_workers.iter_batch_cursors(None, 0, 1, projection={'id': 1})
+    with pytest.raises(ValueError):
+        multiprocessing_workers.iter_batch_id_ranges(None)
+    assert not (tmp_path / 'out.json').exists()
+
+
+def test_iter_batch_id_ranges_until_sentinel():
+    id_ranges_queue = utilities.gen_id_ranges_queue([(None, 10), (10, None)], 2)
+    assert list(multiprocessing_workers.iter_batch_id_ranges(id_ranges_queue)) == [(0, (None, 10)), (1, (10, None))]
+    assert list(multiprocessing_workers.iter_batch_id_ranges(id_ranges_queue)) == []
+
+
+def test_import_does_not_load_pandas_or_textblob():
+    # worker processes import this module, the heavy dependencies are loaded on first use only
+    code = 'import sys, multiprocessing_workers; print(sorted({"pandas", "textblob"} & set(sys.modules)))'
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=os.path.dirname(os.path.dirname(__file__)))
+    assert output.decode().strip() == '[]'
+
+
+@pytest.mark.parametrize('use_queue', [False, True])
+def test_count_ibm_followers(tmp_path, use_queue):
+    descriptions = {'1': ['IBMer', None, 'nothing here', '', 'Loves #ibm', 'ＩＢＭ'],
+                    '2': ['ibm'] * 50,
+                    '3': [],
+                    '4': ['Watson at I B M', 'tibmo', 'x' * 1000]}
+    for uid, descs_lst in descriptions.items():
+        lines = [json.dumps({'id': ind, 'description': desc}) for ind, desc in enumerate(descs_lst)]
+        (tmp_path / '{}.json'.format(uid)).write_text('\n'.join(lines) + '\n\n')
+    process_n = 2
+    uids_queue = utilities.gen_files_queue_by_size(str(tmp_path), list(descriptions), process_n) if use_queue else None
+    output_files = [str(tmp_path / 'out-{}.json'.format(batch_i)) for batch_i in range(process_n)]
+    for batch_i in range(process_n):
+        multiprocessing_workers.worker_count_ibm_followers_ibm_users(str(tmp_path), batch_i, process_n,
+                                                                     output_files[batch_i], list(descriptions), uids_queue)
+    
+    # same counts as json.loads and utilities.simple_test_keyword_in_text, one follower obj at a time
+    counts = {doc['uid']: (doc['followers_count'], doc['ibm_followers_count']) for doc in read_outputs(output_files)}
+    assert counts == {uid: (len(descs_lst), sum(utilities.simple_test_keyword_in_text(desc, 'ibm') for desc in descs_lst))
+                      for uid, descs_lst in descriptions.items()}
+    assert counts['1'] == (6, 2)
+
+
+@pytest.mark.parametrize('use_shared_ids', [True, False])
+def test_get_unique_user_matches_find_one(db, corpus, tmp_path, use_shared_ids):
+    """
+    Same users as one find_one() per unique user id, as the original worker did
+    """
+    collection = db[TW_NT_COL]
+    unique_user_ids = sorted(set(collection.distinct('user.id')))
+    process_n = 3
+    output_files = [str(tmp_path / 'users-{}.json'.format(batch_i)) for batch_i in range(process_n)]
+    with shared_ids.SharedIds(unique_user_ids) as ids:
+        run_batches(multiprocessing_workers.worker_get_unique_user,
+                    lambda batch_i, queue: (TEST_DB_NAME, TW_NT_COL, batch_i, process_n, output_files[batch_i],
+                                            ids if use_shared_ids else None, 50, queue),
+                    process_n, collection=None if use_shared_ids else collection, field='user.id')
+    users_lst = read_outputs(output_files)
+    assert sorted(user_obj['id'] for user_obj in users_lst) == unique_user_ids
+    for user_obj in users_lst:
+        assert user_obj == collection.find_one(filter={'user.id': user_obj['id']}, projection={'_id': 0, 'user': 1})['user']
+
+
+def test_get_unique_user_keeps_latest_user_obj(mongo_client, tmp_path):
+    db_name = 'test_unique_user'
+    mongo_client.drop_database(db_name)
+    mongo_client[db_name]['tweets'].insert_many([{'id': 2, 'user': {'id': 10, 'followers_count': 5}},
+                                                 {'id': 3, 'user': {'id': 10, 'followers_count': 7}},
+                                                 {'id': 1, 'user': {'id': 10, 'followers_count': 1}},
+                                                 {'id': 4, 'user': {'id': 20, 'followers_count': 0}}])
+    output_file = str(tmp_path / 'users.json')
+    with shared_ids.SharedIds([10, 20]) as ids:
+        multiprocessing_workers.worker_get_unique_user(db_name, 'tweets', 0, 1, output_file, ids)
+    assert read_outputs([output_file]) == [{'id': 10, 'followers_count': 7}, {'id': 20, 'followers_count': 0}]
+    mongo_client.drop_database(db_name)
@@ -0,0 +1,122 @@
+import json
+import pickle
+
+import pytest
+
+import mongodb
+import pipeline
+import sinks
+
+
+PIPELINE_DB_NAME = 'test_pipeline'
+
+
+class InlinePool(object):
+    """
+    Runs the batches one after the other in this process, with their args pickled as for pool tasks
+    """
+
+    def run(self, target, gen_args, process_n):
+        return [target(*pickle.loads(pickle.dumps(gen_args(batch_i)))) for batch_i in range(process_n)]
+
+
+def worker_copy(db_name, batch_i, process_n, sink):
+    with sink:
+        for doc in mongodb.initialize(db_name, 'src').find(projection={'_id': 0}):
+            if doc['n'] % process_n == batch_i:
+                sink.write(doc)
+
+
+def build_pipeline(tmp_path, runs, fail=()):
+    def run_copy(ctx):
+        runs.append('copy')
+        sink = ctx.gen_sink('mid')
+        ctx.run_workers(worker_copy, lambda batch_i: (ctx.db_name, batch_i, ctx.process_n, sink))
+    
+    def run_count(ctx):
+        runs.append('count')
+        if 'count' in fail:
+            raise RuntimeError('count failed')
+        with open(str(tmp_path / 'count.json'), 'w') as f:
+            json.dump(ctx.db['mid'].count_documents({}), f)
+    
+    def run_report(ctx):
+        runs.append('report')
+        with open(str(tmp_path / 'report.txt'), 'w') as f:
+            f.write(open(str(tmp_path / 'count.json')).read())
+    
+    stages = [pipeline.Stage('report', [pipeline.file(str(tmp_path / 'count.json'))],
+                             [pipeline.file(str(tmp_path / 'report.txt'))], run_report),
+              pipeline.Stage('count', [pipeline.col('mid')], [pipeline.file(str(tmp_path / 'count.json'))], run_count),
+              pipeline.Stage('copy', [pipeline.col('src')], [pipeline.col('mid')], run_copy)]
+    return pipeline.Pipeline(stages, db_name=PIPELINE_DB_NAME, state_file=str(tmp_path / 'state.json'),
+                             process_n=3, pool=InlinePool())
+
+
+@pytest.fixture
+def src_db(mongo_client):
+    mongo_client.drop_database(PIPELINE_DB_NAME)
+    mongo_client[PIPELINE_DB_NAME]['src'].insert_many([{'n': n} for n in range(10)])
+    yield mongo_client[PIPELINE_DB_NAME]
+    mongo_client.drop_database(PIPELINE_DB_NAME)
+
+
+def test_runs_in_order_and_skips_up_to_date(src_db, tmp_path):
+    runs = []
+    assert build_pipeline(tmp_path, runs).run() == {'copy': 'ran', 'count': 'ran', 'report': 'ran'}
+    assert runs == ['copy', 'count', 'report']
+    assert sorted(doc['n'] for doc in src_db['mid'].find()) == list(range(10))
+    assert (tmp_path / 'report.txt').read_text() == '10'
+    
+    runs.clear()
+    assert build_pipeline(tmp_path, runs).run() == {'copy': 'skipped', 'count': 'skipped', 'report': 'skipped'}
+    assert runs == []
+    
+    # a new input document makes the chain run again, output collections are rebuilt from scratch
+    src_db['src'].insert_one({'n': 10})
+    assert build_pipeline(tmp_path, runs).run(targets=['count']) == {'copy': 'ran', 'count': 'ran'}
+    assert (tmp_path / 'count.json').read_text() == '11'
+    
+    runs.clear()
+    assert build_pipeline(tmp_path, runs).run(force=['count']) == {'copy': 'skipped', 'count': 'ran', 'report': 'ran'}
+    assert runs == ['count', 'report']
+
+
+def test_failure_blocks_dependents(src_db, tmp_path):
+    runs = []
+    assert build_pipeline(tmp_path, runs, fail=['count']).run() == {'copy': 'ran', 'count': 'failed', 'report': 'blocked'}
+    assert runs == ['copy', 'count']
+    assert 'count' not in json.load(open(str(tmp_path / 'state.json')))
+
+
+def test_failure_blocks_dependents_of_dependents(src_db, tmp_path):
+    # 'b' sorts before 'c', the stage it depends on
+    def fail(ctx):
+        raise RuntimeError('a failed')
+    
+    noop = lambda ctx: None
+    stages = [pipeline.Stage('a', [pipeline.col('src')], [pipeline.col('x')], fail),
+              pipeline.Stage('c', [pipeline.col('x')], [pipeline.col('y')], noop),
+              pipeline.Stage('b', [pipeline.col('y')], [pipeline.col('z')], noop)]
+    results = pipeline.Pipeline(stages, db_name=PIPELINE_DB_NAME, state_file=str(tmp_path / 'state.json'),
+                                pool=InlinePool()).run()
+    assert results == {'a': 'failed', 'c': 'blocked', 'b': 'blocked'}
+
+
+def test_missing_input_fails(mongo_client, tmp_path):
+    mongo_client.drop_database(PIPELINE_DB_NAME)
+    assert build_pipeline(tmp_path, []).run(targets=['copy']) == {'copy': 'failed'}
+
+
+def test_invalid_graphs(mongo_client, tmp_path):
+    noop = lambda ctx: None
+    with pytest.raises(ValueError):
+        pipeline.Pipeline([pipeline.Stage('a', [pipeline.col('y')], [pipeline.col('x')], noop),
+                           pipeline.Stage('b', [pipeline.col('x')], [pipeline.col('y')], noop)],
+                          db_name=PIPELINE_DB_NAME, pool=InlinePool())
+    with pytest.raises(ValueError):
+        pipeline.Pipeline([pipeline.Stage('a', [], [pipeline.col('x')], noop),
+                           pipeline.Stage('b', [], [pipeline.col('x')], noop)],
+                          db_name=PIPELINE_DB_NAME, pool=InlinePool())
+    with pytest.raises(ValueError):
+        build_pipeline(tmp_path, []).run(targets=['unknown'])
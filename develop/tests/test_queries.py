@@ -0,0 +1,101 @@
+import collections
+
+import mongomock
+import numpy as np
+import pytest
+
+import multiprocessing_workers
+import queries
+import shared_ids
+import tweet_text
+from config import * # import all global config variables
+
+from conftest import TEST_DB_NAME, read_outputs, run_batches
+
+
+@pytest.fixture
+def in_sizes(monkeypatch):
+    """
+    Sizes of the '$in' lists of the find() calls made during a test
+    """
+    sizes_lst = []
+    find = mongomock.collection.Collection.find
+    
+    def spy_find(self, filter=None, *args, **kwargs):
+        sizes_lst.extend(len(condition['$in']) for condition in (filter or {}).values()
+                         if isinstance(condition, dict) and '$in' in condition)
+        return find(self, filter, *args, **kwargs)
+    
+    monkeypatch.setattr(mongomock.collection.Collection, 'find', spy_find)
+    return sizes_lst
+
+
+@pytest.fixture(scope='module')
+def user_ids(corpus):
+    return [user['id'] for user in corpus[0][::3]]
+
+
+def test_in_lists():
+    assert queries.to_in_list(np.array([3, 1, 3, 2], dtype=np.uint64)) == [1, 2, 3]
+    assert all(type(id_int) is int for id_int in queries.to_in_list({5, 4}))
+    assert list(queries.chunk_ids([5, 1, 4, 2, 3, 2], chunk_size=2)) == [[1, 2], [3, 4], [5]]
+    assert list(queries.chunk_ids([])) == []
+    assert queries.gen_in_filter('user.id', [1, 2], {'lang': 'en'}) == {'lang': 'en', 'user.id': {'$in': [1, 2]}}
+    assert queries.covering_projection(['user.id', 'id']) == {'_id': 0, 'user.id': 1, 'id': 1}
+
+
+def test_find_grouped(db, corpus, user_ids, in_sizes):
+    expected = collections.defaultdict(list)
+    for tweet in corpus[1]:
+        if tweet['user']['id'] in set(user_ids) and 'retweeted_status' not in tweet:
+            expected[tweet['user']['id']].append(tweet['id'])
+    groups = list(queries.find_grouped(db[TW_NT_COL], 'user.id', user_ids + [-1],
+                                       projection=queries.covering_projection(['user.id', 'id']), chunk_size=30))
+    assert [user_id for user_id, _ in groups] == sorted(expected)
+    assert {user_id: sorted(doc['id'] for doc in docs_lst) for user_id, docs_lst in groups} == {
+        user_id: sorted(tweet_ids) for user_id, tweet_ids in expected.items()}
+    assert all(set(doc) == {'user', 'id'} for _, docs_lst in groups for doc in docs_lst)
+    assert max(in_sizes) == 30 and len(in_sizes) == -(-(len(set(user_ids)) + 1) // 30)
+    
+    filtered = list(queries.find_in(db[TW_NT_COL], 'user.id', user_ids, filter={'lang': 'en'}))
+    assert len(filtered) == sum(tweet['lang'] == 'en' for user_id in expected
+                                for tweet in db[TW_NT_COL].find({'user.id': user_id}))
+
+
+def test_filter_rt_ibm_tweets_chunks_in_filter(db, corpus, user_ids, in_sizes, monkeypatch, tmp_path):
+    monkeypatch.setattr(multiprocessing_workers, 'IN_FILTER_CHUNK_SIZE', 20)
+    process_n = 2
+    output_files = [str(tmp_path / 'rt-{}.json'.format(batch_i)) for batch_i in range(process_n)]
+    run_batches(multiprocessing_workers.worker_filter_rt_ibm_tweets,
+                lambda batch_i, queue: (TEST_DB_NAME, TW_RT_COL, batch_i, process_n, output_files[batch_i],
+                                        user_ids, queue),
+                process_n, collection=db[TW_RT_COL])
+    assert in_sizes and max(in_sizes) <= 20
+    assert sorted(doc['id'] for doc in read_outputs(output_files)) == sorted(
+        tweet['id'] for tweet in corpus[1]
+        if 'retweeted_status' in tweet and tweet['retweeted_status']['user']['id'] in set(user_ids))
+
+
+@pytest.mark.parametrize('max_in_filter_ids', [None, 10 ** 5, 0])
+def test_build_user_corpora(db, user_ids, max_in_filter_ids, monkeypatch, tmp_path):
+    """
+    Same documents as one find() per user, as 20170921-user_tweets_sentiment did
+    """
+    monkeypatch.setattr(multiprocessing_workers, 'MAX_IN_FILTER_IDS', max_in_filter_ids or 0)
+    process_n = 2
+    output_files = [str(tmp_path / 'corpora-{}.json'.format(batch_i)) for batch_i in range(process_n)]
+    with shared_ids.SharedIds(user_ids) as ids:
+        run_batches(multiprocessing_workers.worker_build_user_corpora,
+                    lambda batch_i, queue: (TEST_DB_NAME, TW_NT_COL, batch_i, process_n, output_files[batch_i],
+                                            ids if max_in_filter_ids is not None else None, queue, None, 50),
+                    process_n, collection=db[TW_NT_COL], field='user.id')
+    docs = {doc['user_id']: doc for doc in read_outputs(output_files)}
+    
+    expected_ids = user_ids if max_in_filter_ids is not None else db[TW_NT_COL].distinct('user.id')
+    expected_ids = [user_id for user_id in expected_ids if db[TW_NT_COL].count_documents({'user.id': user_id})]
+    assert sorted(docs) == sorted(expected_ids)
+    for user_id in expected_ids:
+        texts_lst = [tweet['text'] for tweet in db[TW_NT_COL].find({'user.id': user_id})]
+        text = tweet_text.preprocess_tweet(tweet_text.raw_user_document(texts_lst))
+        assert (docs[user_id]['tweets_num'], docs[user_id]['text']) == (len(texts_lst), text)
+        assert docs[user_id]['tf'] == tweet_text.term_frequencies(text)
@@ -0,0 +1,87 @@
+import collections
+
+import numpy as np
+import pytest
+
+import mongodb
+import multiprocessing_workers
+import retweet_graph
+import utilities
+from config import * # import all global config variables
+
+from conftest import TEST_DB_NAME, read_outputs, run_batches
+
+
+@pytest.fixture(scope='module')
+def graph(db, tmp_path_factory):
+    return retweet_graph.build_retweet_graph(TEST_DB_NAME, TW_RT_COL, str(tmp_path_factory.mktemp('graph')), chunk_size=500)
+
+
+@pytest.fixture(scope='module')
+def retweets(corpus):
+    return [tweet for tweet in corpus[1] if 'retweeted_status' in tweet]
+
+
+@pytest.fixture(scope='module')
+def ibm_user_ids(corpus):
+    return sorted(user['id'] for user in corpus[0] if 'ibm' in user['description'].lower())
+
+
+def test_cascade_sizes(graph, retweets, corpus):
+    expected = collections.Counter(tweet['retweeted_status']['id'] for tweet in retweets)
+    tweet_ids, author_ids, sizes = graph.cascade_sizes()
+    assert dict(zip(tweet_ids.tolist(), sizes.tolist())) == expected
+    authors = {tweet['retweeted_status']['id']: tweet['retweeted_status']['user']['id'] for tweet in retweets}
+    assert [authors[tweet_id] for tweet_id in tweet_ids.tolist()] == author_ids.tolist()
+    # same as the retweet counts of the native tweets when collected
+    natives = {tweet['id']: tweet['retweet_count'] for tweet in corpus[1] if 'retweeted_status' not in tweet}
+    assert all(natives[tweet_id] == n for tweet_id, n in expected.items())
+    for tweet_id in list(expected)[:50]:
+        assert graph.cascade_size(tweet_id) == expected[tweet_id]
+    assert graph.cascade_size(-1) == 0
+
+
+def test_queries_on_author_sets(graph, retweets, ibm_user_ids):
+    author_ids = ibm_user_ids + [-1] # an author never retweeted
+    author_set = set(author_ids)
+    author_retweets = [tweet for tweet in retweets if tweet['retweeted_status']['user']['id'] in author_set]
+    assert len(author_retweets) > 0
+    assert graph.retweeters_of(author_ids).tolist() == sorted({tweet['user']['id'] for tweet in author_retweets})
+    assert len(graph.retweeters_of(author_ids, unique=False)) == len(author_retweets)
+
+    tweet_ids, _, sizes = graph.cascade_sizes(author_ids)
+    assert dict(zip(tweet_ids.tolist(), sizes.tolist())) == collections.Counter(
+        tweet['retweeted_status']['id'] for tweet in author_retweets)
+
+    split = graph.in_out_split(author_ids, ibm_user_ids)
+    for ind, uid in enumerate(split['uid'].tolist()):
+        uid_retweets = [tweet for tweet in author_retweets if tweet['retweeted_status']['user']['id'] == uid]
+        in_n = sum(tweet['user']['id'] in author_set for tweet in uid_retweets)
+        assert (split['all_n'][ind], split['all_srt'][ind], split['in_srt'][ind], split['out_srt'][ind]) == (
+            len({tweet['retweeted_status']['id'] for tweet in uid_retweets}), len(uid_retweets), in_n,
+            len(uid_retweets) - in_n)
+    assert len(graph.in_out_split([-1], ibm_user_ids)['uid']) == 0
+
+
+def test_retweets_of_matches_filter_worker(graph, ibm_user_ids, tmp_path):
+    """
+    Same retweets as worker_filter_rt_ibm_tweets (the filtered copy of TW_RT_COL the graph replaces)
+    """
+    process_n = 3
+    output_files = [str(tmp_path / 'rt_ibm-{}.json'.format(batch_i)) for batch_i in range(process_n)]
+    run_batches(multiprocessing_workers.worker_filter_rt_ibm_tweets,
+                lambda batch_i, queue: (TEST_DB_NAME, TW_RT_COL, batch_i, process_n, output_files[batch_i],
+                                        ibm_user_ids, queue),
+                process_n, collection=mongodb.initialize(TEST_DB_NAME, TW_RT_COL))
+    expected_lst = read_outputs(output_files)
+    res = graph.retweets_of(ibm_user_ids)
+    assert sorted(zip(res['author'].tolist(), res['tweet'].tolist(), res['retweeter'].tolist(),
+                      res['timestamp'].tolist())) == sorted(
+        (doc['retweeted_status']['user']['id'], doc['retweeted_status']['id'], doc['user']['id'],
+         int(utilities.get_tweet_timestamp(doc))) for doc in expected_lst)
+
+
+def test_ranges_to_inds():
+    starts, ends = np.array([3, 10, 7, 0]), np.array([5, 10, 9, 1])
+    assert retweet_graph.ranges_to_inds(starts, ends).tolist() == [3, 4, 7, 8, 0]
+    assert len(retweet_graph.ranges_to_inds(np.array([], dtype=np.int64), np.array([], dtype=np.int64))) == 0
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import keywords_matcher
+import mongodb
+import multiprocessing_workers
+import rollup_cube
+import utilities
+from config import * # import all global config variables
+
+from conftest import run_batches
+
+
+KWS_LST = ['ibm', 'watson', '#AI']
+ROLLUP_DB_NAME = 'test_rollup'
+
+
+def to_timestamps(times_lst):
+    return np.array([pd.Timestamp(time, tz='UTC').value // 10 ** 9 for time in times_lst], dtype=np.int64)
+
+
+def test_weekly_buckets_start_on_monday():
+    cube = rollup_cube.RollupCube(KWS_LST)
+    # Monday, Sunday of the same week, next Monday
+    cube.add(to_timestamps(['2017-05-01 10:00', '2017-05-07 23:00', '2017-05-08 01:00']),
+             np.array([1, 0, 1]), np.array([0, 1, 0]), np.array([0, 0, 1]))
+    assert cube.series(freq='W').to_dict() == {pd.Timestamp('2017-05-01', tz='UTC'): 2,
+                                               pd.Timestamp('2017-05-08', tz='UTC'): 1}
+    assert cube.series(freq='D').sum() == 3 and len(cube.series(freq='D')) == 8
+    assert cube.series(kws=['ibm'], freq='W').tolist() == [1, 1]
+    assert cube.series(types=['rt'], freq='W').tolist() == [1, 0]
+    
+    df = cube.frame(by='aff', freq='W')
+    assert df.columns.tolist() == rollup_cube.AFFILIATIONS and df['ibm'].tolist() == [0, 1]
+    df = cube.frame(by=['kw', 'type'], kws=None, start='2017-05-08')
+    assert df.columns.names == ['kw', 'type'] and df.values.sum() == 1 and df[('ibm', 'nt')].sum() == 1
+
+
+def test_add_merge_save_load(tmp_path):
+    rng = np.random.default_rng(0)
+    timestamps = rng.integers(1490000000, 1500000000, 1000)
+    kws_masks = rng.integers(0, 8, 1000)
+    types = rng.integers(0, 3, 1000)
+    affs = rng.integers(0, 2, 1000)
+    whole = rollup_cube.RollupCube(KWS_LST)
+    whole.add(timestamps, kws_masks, types, affs)
+    
+    merged = rollup_cube.RollupCube(KWS_LST)
+    for inds in np.array_split(np.argsort(-timestamps), 3): # later parts start earlier
+        part = rollup_cube.RollupCube(KWS_LST)
+        part.add(timestamps[inds], kws_masks[inds], types[inds], affs[inds])
+        merged.merge(part)
+    assert merged.start_hour == whole.start_hour and np.array_equal(merged.counts, whole.counts)
+    
+    merged.save(str(tmp_path / 'cube'))
+    loaded = rollup_cube.RollupCube.load(str(tmp_path / 'cube'))
+    assert np.array_equal(loaded.counts, whole.counts) and loaded.series().sum() == 1000
+    assert loaded.series(kws=['#AI']).sum() == (kws_masks & 4 > 0).sum()
+    with pytest.raises(ValueError):
+        merged.merge(rollup_cube.RollupCube(['ibm']))
+
+
+def run_rollup_workers(cube, collection, tmp_path, process_n=2):
+    pending_filter, last_id = cube.pending_filter(collection)
+    if pending_filter is None:
+        return False
+    output_dirs = [str(tmp_path / 'rollup-{}-{}'.format(last_id, batch_i)) for batch_i in range(process_n)]
+    run_batches(multiprocessing_workers.worker_rollup_tweets,
+                lambda batch_i, id_ranges_queue: (ROLLUP_DB_NAME, TW_RAW_COL, batch_i, process_n, output_dirs[batch_i],
+                                                  KWS_LST, id_ranges_queue, pending_filter),
+                process_n, collection=collection)
+    for output_dir in output_dirs:
+        cube.merge(rollup_cube.RollupCube.load(output_dir))
+    cube.watermark = last_id
+    return True
+
+
+def test_incremental_rollup(db, mongo_client, tmp_path):
+    mongo_client.drop_database(ROLLUP_DB_NAME)
+    tweets_lst = list(db[TW_RAW_COL].find(sort=[('_id', 1)]))
+    collection = mongo_client[ROLLUP_DB_NAME][TW_RAW_COL]
+    rollup_dir = str(tmp_path / 'cube')
+    
+    collection.insert_many(tweets_lst[:len(tweets_lst) // 2])
+    cube = rollup_cube.RollupCube.load_or_create(rollup_dir, KWS_LST)
+    assert run_rollup_workers(cube, collection, tmp_path)
+    cube.save(rollup_dir)
+    # nothing new to count
+    assert not run_rollup_workers(rollup_cube.RollupCube.load_or_create(rollup_dir, KWS_LST), collection, tmp_path)
+    
+    collection.insert_many(tweets_lst[len(tweets_lst) // 2:])
+    cube = rollup_cube.RollupCube.load_or_create(rollup_dir, KWS_LST)
+    assert run_rollup_workers(cube, collection, tmp_path)
+    
+    # same counts as tweet by tweet
+    hours = utilities.get_tweets_timestamps(tweets_lst).astype(np.int64) // 3600
+    matcher = keywords_matcher.get_matcher(KWS_LST)
+    expected = rollup_cube.RollupCube(KWS_LST)
+    expected.add(hours * 3600, np.array([matcher.mask(tweet.get('text')) for tweet in tweets_lst]),
+                 np.array([rollup_cube.tweet_type(tweet) for tweet in tweets_lst]),
+                 np.array([utilities.simple_test_keyword_in_text(tweet['user'].get('description'), 'ibm')
+                           for tweet in tweets_lst], dtype=np.int64))
+    assert cube.start_hour == expected.start_hour and np.array_equal(cube.counts, expected.counts)
+    assert cube.series(freq='D').sum() == len(tweets_lst)
+    mongo_client.drop_database(ROLLUP_DB_NAME)
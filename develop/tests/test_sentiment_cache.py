@@ -0,0 +1,39 @@
+import sentiment_cache
+
+
+def length_scorer(text):
+    return float(len(text))
+
+
+def test_duplicates_scored_once(tmp_path):
+    scored = []
+    def scorer(text):
+        scored.append(text)
+        return float(len(text))
+    cache = sentiment_cache.PolarityCache(db_file=str(tmp_path / 'cache.sqlite'), scorer=scorer, scorer_tag='len')
+    assert cache.get_polarities(['a b', 'a  b ', 'abc']) == [3.0, 3.0, 3.0]
+    assert scored == ['a b', 'abc']
+    cache.close()
+    
+    # scores persist across caches sharing the sqlite file
+    cache = sentiment_cache.PolarityCache(db_file=str(tmp_path / 'cache.sqlite'), scorer=scorer, scorer_tag='len')
+    assert cache.get_polarity('abc') == 3.0
+    assert scored == ['a b', 'abc']
+    cache.close()
+
+
+def test_scorer_tag_in_key(tmp_path):
+    db_file = str(tmp_path / 'cache.sqlite')
+    cache = sentiment_cache.PolarityCache(db_file=db_file, scorer=length_scorer, scorer_tag='v1')
+    assert cache.get_polarity('abc') == 3.0
+    cache.close()
+    
+    # a new version of the scorer does not get the scores of the previous one
+    cache = sentiment_cache.PolarityCache(db_file=db_file, scorer=lambda text: -1.0, scorer_tag='v2')
+    assert cache.get_polarity('abc') == -1.0
+    cache.close()
+    
+    assert sentiment_cache.get_scorer_tag(sentiment_cache.textblob_polarity).startswith('textblob')
+    assert sentiment_cache.get_scorer_tag(length_scorer) == 'test_sentiment_cache.length_scorer'
+    assert sentiment_cache.get_cache(None, scorer=length_scorer) is sentiment_cache.get_cache(None, scorer=length_scorer)
+    assert sentiment_cache.get_cache(None, scorer=length_scorer) is not sentiment_cache.get_cache(None)
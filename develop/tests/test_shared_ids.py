@@ -0,0 +1,49 @@
+import pickle
+
+import numpy as np
+import pytest
+
+import shared_ids
+
+
+@pytest.fixture
+def tweet_ids(corpus):
+    return [tweet['id'] for tweet in corpus[1]]
+
+
+def test_shared_ids_membership(tweet_ids):
+    with shared_ids.SharedIds(tweet_ids[::2]) as ids:
+        assert len(ids) == len(set(tweet_ids[::2]))
+        assert ids.isin(tweet_ids).tolist() == [ind % 2 == 0 for ind in range(len(tweet_ids))]
+        assert tweet_ids[0] in ids and tweet_ids[1] not in ids
+        # a pickled copy (as sent to a worker) attaches to the same shared memory
+        assert pickle.loads(pickle.dumps(ids)).array.tolist() == ids.array.tolist()
+
+
+def test_shared_ids_split(tweet_ids):
+    with shared_ids.SharedIds(tweet_ids) as ids:
+        for process_n in [1, 3, 7]:
+            slices_lst = [ids.split(batch_i, process_n) for batch_i in range(process_n)]
+            assert np.concatenate(slices_lst).tolist() == sorted(set(tweet_ids))
+
+
+def gen_id_patterns(ids_n):
+    """
+    Sequential ids, snowflake ids with empty low bits (one per millisecond) and with sequence numbers, random ids
+    """
+    rng = np.random.default_rng(0)
+    ms = 10 ** 12 + np.arange(ids_n, dtype=np.int64) * 7
+    return {'sequential': np.arange(ids_n, dtype=np.int64) + 10 ** 6,
+            'snowflake_empty_low_bits': ms << 22,
+            'snowflake': (ms << 22) + rng.integers(0, 1 << 12, size=ids_n),
+            'random': rng.integers(0, 1 << 62, size=ids_n)}
+
+
+@pytest.mark.parametrize('pattern', ['sequential', 'snowflake_empty_low_bits', 'snowflake', 'random'])
+def test_bloom_filter_rates(pattern):
+    ids = gen_id_patterns(110000)[pattern]
+    member_mask = np.arange(len(ids)) % 11 == 0
+    with shared_ids.SharedBloomFilter(ids[member_mask], false_positive_rate=0.01) as bloom:
+        assert bloom.isin(ids[member_mask]).all() # no false negatives
+        assert bloom.isin(ids[~member_mask]).mean() < 0.015
+        assert int(ids[member_mask][0]) in bloom
@@ -0,0 +1,111 @@
+import pickle
+import threading
+import time
+
+import mongomock
+import pytest
+from pymongo.errors import BulkWriteError
+
+import instrumentation
+import sinks
+
+
+SINKS_DB_NAME = 'test_sinks'
+
+
+@pytest.fixture
+def sinks_db(mongo_client):
+    mongo_client.drop_database(SINKS_DB_NAME)
+    yield mongo_client[SINKS_DB_NAME]
+    mongo_client.drop_database(SINKS_DB_NAME)
+
+
+def test_backpressure(sinks_db, monkeypatch):
+    bulk_write = mongomock.collection.Collection.bulk_write
+    release = threading.Event()
+    
+    def slow_bulk_write(self, *args, **kwargs):
+        release.wait(timeout=10)
+        return bulk_write(self, *args, **kwargs)
+    
+    monkeypatch.setattr(mongomock.collection.Collection, 'bulk_write', slow_bulk_write)
+    sink = sinks.MongoBulkSink(SINKS_DB_NAME, 'out', batch_size=1, max_pending_batches=2)
+    written = []
+    
+    def write_docs():
+        for n in range(10):
+            sink.write({'n': n})
+            written.append(n)
+    
+    writer = threading.Thread(target=write_docs)
+    writer.start()
+    time.sleep(0.2)
+    # one batch being written, two waiting, the fourth write blocked
+    assert writer.is_alive() and len(written) == 3
+    release.set()
+    writer.join(timeout=10)
+    sink.close()
+    assert sink.written_n == 10 and sinks_db['out'].count_documents({}) == 10
+
+
+def test_upsert_key(sinks_db):
+    sinks_db['out'].create_index('id', unique=True)
+    with sinks.MongoBulkSink(SINKS_DB_NAME, 'out', batch_size=2, upsert_key='id') as sink:
+        for n in range(5):
+            sink.write({'id': n, 'v': 0})
+        sink.commit()
+        for n in range(3, 7):
+            sink.write({'id': n, 'v': 1})
+    assert sorted((doc['id'], doc['v']) for doc in sinks_db['out'].find()) == [
+        (0, 0), (1, 0), (2, 0), (3, 1), (4, 1), (5, 1), (6, 1)]
+
+
+def test_ignore_duplicates(sinks_db):
+    sinks_db['out'].create_index('id', unique=True)
+    with sinks.MongoBulkSink(SINKS_DB_NAME, 'out', batch_size=3, ignore_duplicates=True) as sink:
+        for n in [0, 1, 1, 2, 0, 3, 4]:
+            sink.write({'id': n})
+    assert (sink.written_n, sink.duplicates_n) == (5, 2)
+    assert sinks_db['out'].count_documents({}) == 5
+
+
+def test_writer_error_raised_in_caller(sinks_db):
+    sinks_db['out'].create_index('id', unique=True)
+    sink = sinks.MongoBulkSink(SINKS_DB_NAME, 'out', batch_size=2)
+    for n in [0, 0, 1]:
+        sink.write({'id': n})
+    with pytest.raises(BulkWriteError):
+        sink.commit()
+    with pytest.raises(BulkWriteError): # still failed, the later batches are dropped
+        sink.close()
+    
+    # leaving on another exception keeps that exception, also through an instrumented sink
+    stats = instrumentation.Instrument('test', report_interval=60).start(0, 1)
+    with pytest.raises(KeyError):
+        with stats.wrap_sink(sinks.MongoBulkSink(SINKS_DB_NAME, 'out', batch_size=1)) as sink:
+            sink.write({'id': 0})
+            sink.write({'id': 5})
+            raise KeyError('worker failed')
+
+
+def test_pickled_sink_starts_fresh(sinks_db):
+    sink = sinks.MongoBulkSink(SINKS_DB_NAME, 'out', batch_size=1)
+    sink.write({'n': 0})
+    copy = pickle.loads(pickle.dumps(sink))
+    assert (copy.written_n, copy._thread) == (0, None)
+    with copy:
+        copy.write({'n': 1})
+    sink.close()
+    assert sinks_db['out'].count_documents({}) == 2
+
+
+def test_import_inter_files(sinks_db, tmp_path):
+    inter_files = [str(tmp_path / 'inter-{}.json'.format(batch_i)) for batch_i in range(3)]
+    for batch_i, inter_file in enumerate(inter_files):
+        with sinks.JsonLinesSink(inter_file) as sink:
+            for n in range(batch_i * 10):
+                sink.write({'batch_i': batch_i, 'n': n})
+    sink = sinks.MongoBulkSink(SINKS_DB_NAME, 'out', batch_size=7)
+    docs_n = sinks.import_inter_files(inter_files, sink, chunk_size=4, transform=lambda doc: dict(doc, imported=True))
+    assert docs_n == 30 and sink.written_n == 30
+    assert sinks_db['out'].count_documents({'imported': True, 'batch_i': 2}) == 20
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+import sketches
+
+
+@pytest.fixture
+def values():
+    rng = np.random.default_rng(0)
+    return rng.lognormal(3, 1.5, size=100000)
+
+
+def test_hll_merge_equals_whole():
+    rng = np.random.default_rng(0)
+    ids = rng.integers(0, 1 << 40, size=200000)
+    whole = sketches.HyperLogLog()
+    whole.add(ids)
+    merged = sketches.HyperLogLog()
+    for ids_part in np.array_split(ids, 7):
+        part = sketches.HyperLogLog()
+        part.add(ids_part)
+        merged.merge(part)
+    np.testing.assert_array_equal(merged.registers, whole.registers)
+    exact_n = len(np.unique(ids))
+    assert abs(merged.count() - exact_n) / exact_n < 0.03
+
+
+@pytest.mark.parametrize('exact_n', [0, 10, 1000, 30000])
+def test_hll_small_and_duplicate_ids(exact_n):
+    hll = sketches.HyperLogLog()
+    hll.add(np.arange(exact_n, dtype=np.int64))
+    hll.add(np.arange(exact_n, dtype=np.int64)) # duplicates do not count
+    assert abs(hll.count() - exact_n) <= max(0.03 * exact_n, 1)
+
+
+def test_hll_merge_different_p_fails():
+    with pytest.raises(ValueError):
+        sketches.HyperLogLog(p=12).merge(sketches.HyperLogLog(p=14))
+
+
+def test_kll_merge_accuracy(values):
+    whole = sketches.KLLSketch(seed=0)
+    whole.add(values)
+    merged = sketches.KLLSketch(seed=0)
+    for ind, values_part in enumerate(np.array_split(values, 9)):
+        part = sketches.KLLSketch(seed=ind)
+        for chunk in np.array_split(values_part, 5):
+            part.add(chunk)
+        merged.merge(part)
+    sorted_values = np.sort(values)
+    qs = np.array([0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99])
+    for sketch in [whole, merged]:
+        assert sketch.n == len(values)
+        assert (sketch.min, sketch.max) == (values.min(), values.max())
+        # rank of the estimated quantiles within a few rank errors of the exact ranks
+        ranks = np.searchsorted(sorted_values, sketch.quantile(qs), side='right') / len(values)
+        assert np.abs(ranks - qs).max() < 0.03
+        assert abs(sketch.rank(np.median(values)) - 0.5) < 0.03
+    assert sum(len(compactor) for compactor in merged.compactors) < 10 * sketches.KLL_K
+
+
+def test_kll_empty():
+    sketch = sketches.KLLSketch()
+    assert np.isnan(sketch.quantile(0.5))
+    assert np.isnan(sketch.rank(1.0))
+
+
+def test_sketch_set_save_load_merge(values, tmp_path):
+    sketches_files = []
+    for ind, values_part in enumerate(np.array_split(values, 3)):
+        sketch_set = sketches.SketchSet()
+        sketch_set.hll('users').add(values_part.astype(np.int64))
+        sketch_set.kll('values').add(values_part)
+        sketch_set.incr('tweets', len(values_part))
+        sketches_file = str(tmp_path / 'sketches-{}.npz'.format(ind))
+        sketch_set.save(sketches_file)
+        sketches_files.append(sketches_file)
+    merged = sketches.merge_sketch_files(sketches_files)
+    assert merged.count('tweets') == len(values)
+    exact_n = len(np.unique(values.astype(np.int64)))
+    assert abs(merged.count('users') - exact_n) / exact_n < 0.03
+    assert abs(merged.quantile('values', 0.5) - np.median(values)) / np.median(values) < 0.05
+    summary = merged.summary()
+    assert summary['name'].tolist() == ['tweets', 'users', 'values']
+    assert summary.set_index('name').loc['values', 'count'] == len(values)
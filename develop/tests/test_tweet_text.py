@@ -0,0 +1,41 @@
+import random
+import re
+
+import pytest
+
+import tweet_text
+
+
+def preprocessTweet(tweet):
+    """
+    preprocessTweet of 20170921-user_tweets_sentiment, as it was before tweet_text
+    """
+    tweet = tweet.lower()
+    tweet = re.sub(r'((www\.[^\s]+)|(https?://[^\s]+))', ' ', tweet)
+    tweet = re.sub(r'@[^\s]+', ' ', tweet)
+    tweet = re.sub(r'[\s]+', ' ', tweet)
+    tweet = re.sub(r'#([^\s]+)', r'\1', tweet)
+    tweet = tweet.strip('\'"')
+    return tweet
+
+
+@pytest.mark.parametrize('text', [
+    'hi @http:// there', '@www.', '@https://', '@www.x', 'x@www.a b', '@@www.x', '@foohttp://x y',
+    '"Watson #AI #ibm rocks" http://ibm.co/x @IBM', '##ai a#b#c', '  \n\t ', '', "'quoted'", '#',
+])
+def test_same_as_preprocess_tweet(text):
+    assert tweet_text.preprocess_tweet(text) == preprocessTweet(text)
+
+
+def test_fuzz_batches_same_as_preprocess_tweet():
+    rnd = random.Random(0)
+    pieces = ['@', '#', 'www.', 'http://', 'https://', 'a', 'B', 'ibm', ' ', '\n', '\t', '"', "'", '.', '/', ':']
+    texts_lst = [''.join(rnd.choice(pieces) for _ in range(rnd.randint(0, 12))) for _ in range(5000)]
+    assert tweet_text.preprocess_tweets(texts_lst) == [preprocessTweet(text) for text in texts_lst]
+    assert tweet_text.preprocess_tweets([]) == []
+
+
+def test_term_frequencies():
+    text = tweet_text.preprocess_tweet(tweet_text.raw_user_document(['IBM #Watson http://x', "it's @ibm IBM"]))
+    assert tweet_text.term_frequencies(text) == {'ibm': 2, 'watson': 1, "it's": 1}
+    assert tweet_text.term_frequencies(text, stopwords={"it's"}) == {'ibm': 2, 'watson': 1}
@@ -0,0 +1,60 @@
+import multiprocessing
+import pickle
+
+import numpy as np
+
+import utilities
+
+
+def test_parse_created_at_matches_strptime(corpus):
+    created_at_strs = [tweet['created_at'] for tweet in corpus[1]]
+    expected = np.array([utilities.parse_tweet_created_at_str(s) for s in created_at_strs])
+    assert [utilities.parse_tweet_created_at_str_fast(s) for s in created_at_strs] == expected.tolist()
+    np.testing.assert_array_equal(utilities.parse_tweet_created_at_strs(created_at_strs), expected)
+    np.testing.assert_array_equal(utilities.parse_tweet_created_at_strs(created_at_strs, dtype=np.int64), expected)
+
+
+def test_parse_created_at_edge_dates():
+    created_at_strs = ['Thu Jan 01 00:00:00 +0000 1970', 'Tue Feb 29 23:59:59 +0000 2000',
+                       'Sun Dec 31 12:30:05 +0000 2017', 'Mon Mar 01 00:00:00 +0000 2100']
+    expected = [utilities.parse_tweet_created_at_str(s) for s in created_at_strs]
+    assert [utilities.parse_tweet_created_at_str_fast(s) for s in created_at_strs] == expected
+    assert utilities.parse_tweet_created_at_strs(created_at_strs).tolist() == expected
+    assert len(utilities.parse_tweet_created_at_strs([])) == 0
+
+
+def test_get_tweets_timestamps(corpus):
+    tweets_lst = corpus[1][:500]
+    # half of the tweets without 'timestamp_ms', parsed from 'created_at'
+    tweets_lst = [{key: value for key, value in tweet.items() if key != 'timestamp_ms' or ind % 2}
+                  for ind, tweet in enumerate(tweets_lst)]
+    expected = [utilities.parse_tweet_created_at_str(tweet['created_at']) for tweet in tweets_lst]
+    assert [utilities.get_tweet_timestamp(tweet) for tweet in tweets_lst] == expected
+    np.testing.assert_array_equal(utilities.get_tweets_timestamps(tweets_lst), expected)
+
+
+def test_iter_chunks():
+    assert list(utilities.iter_chunks(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(utilities.iter_chunks([], 3)) == []
+
+
+def test_gen_id_ranges_queue():
+    id_ranges = [(None, 10), (10, 20), (20, None)]
+    id_ranges_queue = utilities.gen_id_ranges_queue(id_ranges, process_n=2)
+    items = [id_ranges_queue.get(timeout=5) for _ in range(len(id_ranges) + 2)]
+    assert items[:len(id_ranges)] == list(enumerate(id_ranges))
+    assert items[len(id_ranges):] == [None, None] # one sentinel per process
+
+
+def test_gen_files_queue_by_size(tmp_path):
+    sizes = {'1': 30, '2': 500, '3': 0, '4': 120}
+    for name, size in sizes.items():
+        (tmp_path / '{}.json'.format(name)).write_bytes(b'x' * size)
+    files_queue = utilities.gen_files_queue_by_size(str(tmp_path), list(sizes), process_n=2)
+    items = [files_queue.get(timeout=5) for _ in range(len(sizes) + 2)]
+    assert items == [('2', 500), ('4', 120), ('1', 30), ('3', 0), None, None] # largest files first
+    
+    with multiprocessing.Manager() as manager:
+        files_queue = utilities.gen_files_queue_by_size(str(tmp_path), ['1', '2'], process_n=1, manager=manager)
+        files_queue = pickle.loads(pickle.dumps(files_queue)) # as passed to pool tasks
+        assert list(iter(files_queue.get, None)) == [('2', 500), ('1', 30)]
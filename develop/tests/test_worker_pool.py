@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+import keywords_matcher
+import worker_pool
+
+
+def task_state(batch_i, offset=0):
+    """
+    :return: (batch_i + offset, pid of the process, keywords compiled in the process)
+    """
+    return batch_i + offset, os.getpid(), [kws for kws, _ in keywords_matcher.matchers if kws[0] == 'warm']
+
+
+def task_fail(batch_i):
+    if batch_i == 1:
+        raise ValueError('batch 1 failed')
+    return batch_i
+
+
+def test_warm_pool_reuses_processes():
+    assert not task_state(0)[2]
+    with worker_pool.WarmPool(2, kws_lsts=[['warm', 'pool'], ['ibm']]) as pool:
+        results = pool.run(task_state, lambda batch_i: (batch_i,), process_n=6, gen_kwargs=lambda batch_i: {'offset': 10})
+        assert [result[0] for result in results] == list(range(10, 16))
+        # matchers compiled once by the initializer of each process, before any task
+        assert all(result[2] == [('warm', 'pool')] for result in results)
+        
+        pids = {result[1] for result in results}
+        assert len(pids) <= 2 and os.getpid() not in pids
+        # later runs get the same warm processes (a run of small tasks may not reach all of them)
+        assert len(pids | {result[1] for result in pool.run(task_state, lambda batch_i: (batch_i,))}) <= 2
+        
+        with pytest.raises(ValueError):
+            pool.run(task_fail, lambda batch_i: (batch_i,), process_n=3)
+        assert pool.run(task_fail, lambda batch_i: (batch_i,), process_n=1) == [0]
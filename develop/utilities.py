@@ -2,8 +2,14 @@
 Various utility functions
 """
 
+import codecs
 import datetime
+import json
+import multiprocessing
 import os
+import time
+
+import numpy as np
 
 from config import * # import all global config variables
 
@@ -24,6 +30,150 @@ def parse_tweet_created_at_str(created_at_str):
     return timestamp
 
 
+TWEET_CREATED_AT_MONTHS = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+                           'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
+DAYS_IN_MONTH = [0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+
+def days_from_epoch(year, month, day):
+    """
+    Number of days from 1970-01-01 to a date of the proleptic Gregorian calendar.
+    Works on both ints and NumPy int64 arrays.
+    See http://howardhinnant.github.io/date_algorithms.html#days_from_civil
+    """
+    year = year - (month <= 2)
+    era = year // 400
+    yoe = year - era * 400 # year of era [0, 399]
+    doy = (153 * (month + 12 * (month <= 2) - 3) + 2) // 5 + day - 1 # day of year starting from March 1st [0, 365]
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy # day of era [0, 146096]
+    return era * 146097 + doe - 719468
+
+
+def parse_tweet_created_at_str_fast(created_at_str):
+    """
+    Fast path of parse_tweet_created_at_str, slicing the fixed offsets of the format
+    "Wed Aug 27 13:08:45 +0000 2008" instead of calling strptime.
+    Falls back to parse_tweet_created_at_str for anything not in this exact format.
+    
+    :param created_at_str: the string of 'created_at' field
+    :return: Unix timestamp
+    """
+    try:
+        if (len(created_at_str) == 30 and created_at_str[10] == ' ' and created_at_str[13] == ':'
+                and created_at_str[16] == ':' and created_at_str[25] == ' '):
+            month = TWEET_CREATED_AT_MONTHS[created_at_str[4:7]]
+            day = int(created_at_str[8:10])
+            hour = int(created_at_str[11:13])
+            minute = int(created_at_str[14:16])
+            second = int(created_at_str[17:19])
+            offset = int(created_at_str[21:23]) * 3600 + int(created_at_str[23:25]) * 60
+            year = int(created_at_str[26:30])
+            if (1 <= day <= DAYS_IN_MONTH[month] and hour < 24 and minute < 60 and second < 60
+                    and created_at_str[20] in '+-' and created_at_str[26:30].isdigit()):
+                if month == 2 and day == 29 and not (year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)):
+                    raise ValueError(created_at_str)
+                if created_at_str[20] == '-':
+                    offset = -offset
+                return float(days_from_epoch(year, month, day) * 86400 + hour * 3600 + minute * 60 + second - offset)
+    except (KeyError, ValueError):
+        pass
+    return parse_tweet_created_at_str(created_at_str)
+
+
+# 3 bytes month abbreviations packed into sorted int keys, for vectorized lookup
+TWEET_CREATED_AT_MONTH_KEYS = np.array(sorted((ord(abbr[0]) << 16) + (ord(abbr[1]) << 8) + ord(abbr[2])
+                                              for abbr in TWEET_CREATED_AT_MONTHS), dtype=np.int64)
+TWEET_CREATED_AT_MONTH_NUMS = np.array([TWEET_CREATED_AT_MONTHS[chr(key >> 16) + chr((key >> 8) & 255) + chr(key & 255)]
+                                        for key in TWEET_CREATED_AT_MONTH_KEYS], dtype=np.int64)
+
+
+def parse_tweet_created_at_strs(created_at_strs, dtype=np.float64):
+    """
+    Vectorized batch version of parse_tweet_created_at_str.
+    All strings are parsed at once with NumPy on their fixed offsets;
+    strings not in the exact format fall back to parse_tweet_created_at_str one by one.
+    
+    :param created_at_strs: a list (or array) of strings of 'created_at' field
+    :param dtype: dtype of returned array, np.float64 or np.int64
+    :return: NumPy array of Unix timestamps
+    """
+    strs_n = len(created_at_strs)
+    if strs_n == 0:
+        return np.zeros(0, dtype=dtype)
+    
+    # view the ASCII bytes of all strings as a (strs_n, 30) matrix, non-ASCII strings are left for the fallback
+    encoded_lst = [created_at_str.encode('ascii', 'replace') if isinstance(created_at_str, str) else b''
+                   for created_at_str in created_at_strs]
+    chars = np.frombuffer(np.array(encoded_lst, dtype='S30').tobytes(), dtype=np.uint8).reshape(strs_n, 30).astype(np.int64)
+    lengths = np.fromiter((len(encoded) for encoded in encoded_lst), dtype=np.int64, count=strs_n)
+    
+    def digits(start, end):
+        res = np.zeros(strs_n, dtype=np.int64)
+        for col in range(start, end):
+            res = res * 10 + (chars[:, col] - 48)
+        return res
+    
+    digit_cols = [8, 9, 11, 12, 14, 15, 17, 18, 21, 22, 23, 24, 26, 27, 28, 29]
+    valid = ((lengths == 30) & (chars[:, 10] == 32) & (chars[:, 13] == 58) & (chars[:, 16] == 58)
+             & (chars[:, 19] == 32) & (chars[:, 25] == 32) & ((chars[:, 20] == 43) | (chars[:, 20] == 45))
+             & np.all((chars[:, digit_cols] >= 48) & (chars[:, digit_cols] <= 57), axis=1))
+    
+    month_keys = (chars[:, 4] << 16) + (chars[:, 5] << 8) + chars[:, 6]
+    month_inds = np.minimum(np.searchsorted(TWEET_CREATED_AT_MONTH_KEYS, month_keys), len(TWEET_CREATED_AT_MONTH_KEYS) - 1)
+    valid &= TWEET_CREATED_AT_MONTH_KEYS[month_inds] == month_keys
+    month = TWEET_CREATED_AT_MONTH_NUMS[month_inds]
+    
+    day = digits(8, 10)
+    hour = digits(11, 13)
+    minute = digits(14, 16)
+    second = digits(17, 19)
+    offset = (digits(21, 23) * 3600 + digits(23, 25) * 60) * np.where(chars[:, 20] == 45, -1, 1)
+    year = digits(26, 30)
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    days_in_month = np.array(DAYS_IN_MONTH, dtype=np.int64)[month] - ((month == 2) & ~leap)
+    valid &= (day >= 1) & (day <= days_in_month) & (hour < 24) & (minute < 60) & (second < 60)
+    
+    timestamps = (days_from_epoch(year, month, day) * 86400 + hour * 3600 + minute * 60 + second - offset).astype(dtype)
+    for ind in np.flatnonzero(~valid):
+        timestamps[ind] = parse_tweet_created_at_str(created_at_strs[ind])
+    return timestamps
+
+
+def get_tweet_timestamp(tweet):
+    """
+    Get Unix timestamp (in seconds) of a tweet, from 'timestamp_ms' field if present,
+    otherwise by parsing its 'created_at' field
+    
+    :param tweet: tweet document with 'timestamp_ms' and/or 'created_at' field
+    :return: Unix timestamp
+    """
+    timestamp_ms = tweet.get('timestamp_ms')
+    if timestamp_ms is not None:
+        return float(int(timestamp_ms) // 1000)
+    return parse_tweet_created_at_str_fast(tweet['created_at'])
+
+
+def get_tweets_timestamps(tweets, dtype=np.float64):
+    """
+    Vectorized batch version of get_tweet_timestamp
+    
+    :param tweets: a list of tweet documents with 'timestamp_ms' and/or 'created_at' field
+    :param dtype: dtype of returned array, np.float64 or np.int64
+    :return: NumPy array of Unix timestamps
+    """
+    timestamps = np.zeros(len(tweets), dtype=dtype)
+    parse_inds = []
+    for ind, tweet in enumerate(tweets):
+        timestamp_ms = tweet.get('timestamp_ms')
+        if timestamp_ms is not None:
+            timestamps[ind] = int(timestamp_ms) // 1000
+        else:
+            parse_inds.append(ind)
+    if parse_inds:
+        timestamps[parse_inds] = parse_tweet_created_at_strs([tweets[ind]['created_at'] for ind in parse_inds], dtype=dtype)
+    return timestamps
+
+
 def gen_inter_filenames_list(nb_name, procedure_name, process_n, suffix):
     """
     Generate a list of intermediate output filenames for a multiprocessing procedure.
@@ -41,6 +191,110 @@ def gen_inter_filenames_list(nb_name, procedure_name, process_n, suffix):
     return filenames_list
 
 
+def iter_chunks(iterable, chunk_size):
+    """
+    Split an iterable (e.g. a cursor) into lists of at most chunk_size items
+    
+    :param iterable: iterable to split
+    :param chunk_size: maximum number of items per chunk
+    :return: generator of lists
+    """
+    chunk_lst = []
+    for item in iterable:
+        chunk_lst.append(item)
+        if len(chunk_lst) >= chunk_size:
+            yield chunk_lst
+            chunk_lst = []
+    if chunk_lst:
+        yield chunk_lst
+
+
+def read_inter_file_chunks(inter_file, chunk_size=10000):
+    """
+    Read an intermediate JSON lines output file back in chunks of parsed documents,
+    instead of reading all lines into memory at once
+    
+    :param inter_file: the name/path of the intermediate output file
+    :param chunk_size: maximum number of documents per chunk
+    :return: generator of lists of documents
+    """
+    with codecs.open(inter_file, 'r', 'utf-8') as f:
+        for lines_lst in iter_chunks(f, chunk_size):
+            yield [json.loads(line) for line in lines_lst]
+
+
+def gen_id_ranges_queue(id_ranges, process_n, range_inds=None, manager=None):
+    """
+    Put '_id' ranges (see mongodb.gen_id_ranges) into a queue shared by all processes of a multiprocessing procedure.
+    Each process keeps taking the next range until it gets a None sentinel, so faster processes handle more ranges.
+    Split the collection into many more ranges than processes (e.g. 10-50x) to balance the workload.
+    
+    :param id_ranges: a list of (lower, upper) '_id' bounds
+    :param process_n: number of processes of this procedure, one None sentinel is put for each of them
+    :param range_inds: a list of indices identifying the ranges (e.g. checkpointed ranges), None to number them from 0
+    :param manager: multiprocessing.Manager obj to create the queue with, so that it can be passed to pool tasks
+                    (see pipeline.py); None for a plain multiprocessing.Queue passed to new processes
+    :return: multiprocessing.Queue obj of (range index, (lower, upper)) items
+    """
+    if range_inds is None:
+        range_inds = range(len(id_ranges))
+    id_ranges_queue = manager.Queue() if manager is not None else multiprocessing.Queue()
+    for range_i, id_range in zip(range_inds, id_ranges):
+        id_ranges_queue.put((range_i, id_range))
+    for _ in range(process_n):
+        id_ranges_queue.put(None)
+    return id_ranges_queue
+
+
+def benchmark_parse_created_at(created_at_strs, repeat=3):
+    """
+    Compare parsing 'created_at' strings one by one with strptime against the fast and the vectorized parsers
+    
+    :param created_at_strs: a list of strings of 'created_at' field
+    :param repeat: number of timing runs, the best one is reported
+    :return: dict of best running time (in seconds) of each parser
+    """
+    expected = [parse_tweet_created_at_str(created_at_str) for created_at_str in created_at_strs]
+    assert [parse_tweet_created_at_str_fast(created_at_str) for created_at_str in created_at_strs] == expected
+    assert parse_tweet_created_at_strs(created_at_strs).tolist() == expected
+    
+    runs = [('strptime', lambda: [parse_tweet_created_at_str(created_at_str) for created_at_str in created_at_strs]),
+            ('fast', lambda: [parse_tweet_created_at_str_fast(created_at_str) for created_at_str in created_at_strs]),
+            ('vectorized', lambda: parse_tweet_created_at_strs(created_at_strs))]
+    res = {}
+    for name, run in runs:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+        res[name] = min(timings)
+    return res
+
+
+def gen_files_queue_by_size(files_dir, names_lst, process_n, suffix='json', manager=None):
+    """
+    Put files into a queue shared by all processes of a multiprocessing procedure, largest files first.
+    Each process keeps taking the next file until it gets a None sentinel, so the few huge files
+    are spread over processes from the start and small files fill in the gaps.
+    
+    :param files_dir: dir of the files
+    :param names_lst: a list of file names without suffix (e.g. hydrated user ids)
+    :param process_n: number of processes of this procedure, one None sentinel is put for each of them
+    :param suffix: common suffix of the files
+    :param manager: multiprocessing.Manager obj to create the queue with, so that it can be passed to pool tasks
+                    (see pipeline.py); None for a plain multiprocessing.Queue passed to new processes
+    :return: multiprocessing.Queue obj of (name, file size in bytes) items
+    """
+    sizes_lst = [os.path.getsize(os.path.join(files_dir, '{}.{}'.format(name, suffix))) for name in names_lst]
+    files_queue = manager.Queue() if manager is not None else multiprocessing.Queue()
+    for size, name in sorted(zip(sizes_lst, names_lst), key=lambda item: item[0], reverse=True):
+        files_queue.put((name, size))
+    for _ in range(process_n):
+        files_queue.put(None)
+    return files_queue
+
+
 def simple_test_keyword_in_text(text, keyword, ignore_case=True):
     """
     Simple funtion for testing whether keyword exists in text.
@@ -80,3 +334,11 @@ if __name__ == '__main__':
         res = simple_test_keyword_in_text(test_text, test_keyword)
         print('include keyword "{}": {}'.format(test_keyword, res))
         print('')
+    
+    # benchmark parsing 'created_at' strings of one tweet per minute over about two years
+    created_at_strs = [datetime.datetime.fromtimestamp(1451606400 + minute * 60, datetime.timezone.utc).strftime('%a %b %d %H:%M:%S +0000 %Y')
+                       for minute in range(1000000)]
+    res = benchmark_parse_created_at(created_at_strs)
+    for name in ['strptime', 'fast', 'vectorized']:
+        print('Parse {} created_at strings ({}): {:.3f}s ({:.1f}x)'.format(len(created_at_strs), name, res[name],
+                                                                          res['strptime'] / res[name]))
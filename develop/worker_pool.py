@@ -0,0 +1,105 @@
+"""
+Long-lived pool of warm worker processes, running many stage invocations in a row
+
+Starting fresh processes for every stage costs each process its imports, its MongoDB connection,
+its compiled keyword matchers and its sentiment model. The processes of a WarmPool are started once,
+initialize all of that up front, and keep it between tasks: the workers get their clients, matchers and caches
+from the per-process registries (mongodb.get_client, keywords_matcher.get_matcher, sentiment_cache.get_cache),
+which return the warm objects.
+    with worker_pool.WarmPool(process_n, kws_lsts=[API_QUERY_KWS, ['ibm']], sentiment=True) as pool:
+        pool.run(multiprocessing_workers.worker_parse_created_at,
+                 lambda batch_i: (DB_NAME, TW_RAW_COL, batch_i, process_n, inter_files[batch_i], id_ranges_queue))
+        pool.run(multiprocessing_workers.worker_tag_kws_in_tw, ...)
+Queues passed to pool tasks have to come from a multiprocessing.Manager (see utilities.gen_id_ranges_queue).
+"""
+
+import multiprocessing
+import os
+import time
+
+import keywords_matcher
+import mongodb
+import sentiment_cache
+
+
+def init_worker(host, port, kws_lsts, sentiment, sentiment_cache_db):
+    """
+    Initializer of the processes of a WarmPool: connect to MongoDB, compile matchers and load the sentiment model
+
+    :param host: MongoDB host
+    :param port: MongoDB port
+    :param kws_lsts: a list of lists of keywords to compile matchers for
+    :param sentiment: bool value indicates whether to load the sentiment model (textblob)
+    :param sentiment_cache_db: the sqlite file of the polarity cache to open, see sentiment_cache.get_cache
+    """
+    start_time = time.perf_counter()
+    mongodb.get_client(host, port) # the client connects in the background
+    for kws_lst in kws_lsts:
+        keywords_matcher.get_matcher(kws_lst)
+    if sentiment:
+        sentiment_cache.get_cache(sentiment_cache_db).scorer('warm up')
+    print('Process {} warmed up in {:.2f}s'.format(os.getpid(), time.perf_counter() - start_time))
+
+
+class WarmPool(object):
+    """
+    multiprocessing.Pool whose processes are initialized once (see init_worker) and reused by every stage run on it
+    """
+
+    def __init__(self, process_n=None, kws_lsts=(), sentiment=False, sentiment_cache_db=None,
+                 host='localhost', port=27017, maxtasksperchild=None):
+        """
+        :param process_n: number of processes, CPU numbers minus 1 by default
+        :param kws_lsts: a list of lists of keywords the stages will match, e.g. [API_QUERY_KWS, ['ibm']]
+        :param sentiment: bool value indicates whether the stages will score sentiment
+        :param sentiment_cache_db: the sqlite file of the polarity cache, e.g. SENTIMENT_CACHE_DB
+        :param host: MongoDB host
+        :param port: MongoDB port
+        :param maxtasksperchild: number of tasks after which a process is replaced, None to keep processes forever
+        """
+        self.process_n = process_n or max(multiprocessing.cpu_count() - 1, 1)
+        self.pool = multiprocessing.Pool(self.process_n, initializer=init_worker,
+                                         initargs=(host, port, [list(kws_lst) for kws_lst in kws_lsts],
+                                                   sentiment, sentiment_cache_db),
+                                         maxtasksperchild=maxtasksperchild)
+
+    def apply_async(self, target, args=(), kwds=None):
+        """
+        Run one task, see multiprocessing.Pool.apply_async
+        """
+        return self.pool.apply_async(target, args, kwds or {})
+
+    def run(self, target, gen_args, process_n=None, gen_kwargs=None):
+        """
+        Run a worker function for batch_i in range(process_n) on the warm processes and wait for all of them
+
+        :param target: worker function (see multiprocessing_workers.py)
+        :param gen_args: function taking batch_i and returning the args of the worker
+        :param process_n: number of batches, the number of processes of the pool by default
+        :param gen_kwargs: function taking batch_i and returning the kwargs of the worker, None for no kwargs
+        :return: a list of the return values of the batches
+        """
+        process_n = process_n or self.process_n
+        async_results = [self.apply_async(target, gen_args(batch_i), gen_kwargs(batch_i) if gen_kwargs else None)
+                         for batch_i in range(process_n)]
+        return [async_result.get() for async_result in async_results] # re-raises exceptions of the workers
+
+    def close(self):
+        """
+        Wait for the running tasks and stop the processes
+        """
+        self.pool.close()
+        self.pool.join()
+
+    def terminate(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()